@@ -15,14 +15,16 @@ import pymongo
 from pymongo.errors import DuplicateKeyError
 from pymongo import ReturnDocument
 import sys
+import threading
 import time
 
 if __name__ == '__main__':
     sys.path.append(os.environ.get('XLRINFRADIR', ''))
 
 from py_common.env_configuration import EnvConfiguration
+from py_common.jenkins_aggregators.windowed_stats import BuildWindows
 from py_common.jenkins_api import JenkinsApi
-from py_common.mongo import MongoDB, JenkinsMongoDB
+from py_common.mongo import MongoDB, JenkinsMongoDB, MongoDBWriteBuffer
 from py_common.prometheus_api import PrometheusAPI
 from py_common.sorts import nat_sort
 
@@ -32,13 +34,28 @@ class JenkinsAllJobIndex(object):
     Interface to the collections that keep particular meta-data
     spanning multiple jobs.
     """
+    # Rollup bucket sizes, largest first.
+    ROLLUP_GRANULARITY_MS = [('day', 24*3600*1000),
+                             ('hour', 3600*1000)]
+    ENV_PARAMS = {'JENKINS_BUILD_MAX_DURATION_HR':
+                    {'required': True,
+                     'type': EnvConfiguration.NUMBER,
+                     'default': 168}}
 
     def __init__(self, *, jmdb):
         self.logger = logging.getLogger(__name__)
         self.jmdb = jmdb
+        cfg = EnvConfiguration(JenkinsAllJobIndex.ENV_PARAMS)
+        # Builds running longer than this are not found by
+        # builds_active_between() if they started before the period.
+        self.max_duration_ms = int(cfg.get('JENKINS_BUILD_MAX_DURATION_HR')*3600*1000)
 
-    def index_data(self, *, job_name, bnum, data, is_done, is_reparse):
+    def index_data(self, *, job_name, bnum, data, is_done, is_reparse, wbuf=None):
         """
+        If a MongoDBWriteBuffer is passed via wbuf, writes are added to
+        the buffer and it is the caller's responsibility to flush.
+        Otherwise, writes are applied before returning.
+
         Expects to find at least the following in data:
             {'parameters': jbi.parameters(),
              'git_branches': jbi.git_branches(),
@@ -73,14 +90,22 @@ class JenkinsAllJobIndex(object):
 
         self.logger.debug("job_entry: {}".format(job_entry))
 
+        flush = wbuf is None
+        if flush:
+            wbuf = MongoDBWriteBuffer()
+
         # Jobs by time
         if start_time_ms is not None and not is_reparse:
             coll = self.jmdb.builds_by_time_collection(time_ms=start_time_ms)
-            coll.create_index([('job_name', pymongo.ASCENDING),
-                               ('build_number', pymongo.ASCENDING)],
-                              unique=True)
-            coll.find_one_and_replace({'job_name':job_name, 'build_number': bnum},
-                                       job_entry, upsert=True)
+            wbuf.replace_one(coll=coll,
+                             filter={'job_name':job_name, 'build_number': bnum},
+                             doc=job_entry, upsert=True)
+
+        # Rollups (completed builds only, each counted once even if
+        # re-indexed, see _rollup_build())
+        if start_time_ms is not None and is_done and not is_reparse:
+            self._rollup_build(job_name=job_name, bnum=bnum, start_time_ms=start_time_ms,
+                               duration_ms=duration_ms, result=result, wbuf=wbuf)
 
         # Downstream Jobs
         coll = self.jmdb.downstream_jobs()
@@ -97,74 +122,388 @@ class JenkinsAllJobIndex(object):
                 continue
             up_key = "{}:{}".format(up_jname, up_bnum)
             self.logger.debug("up_key {} down_key {}".format(up_key, down_key))
-            coll.find_one_and_update({'_id': up_key},
-                                     {'$addToSet': {'down': down_key}},
-                                     upsert = True)
+            wbuf.update_one(coll=coll,
+                            filter={'_id': up_key},
+                            update={'$addToSet': {'down': down_key}},
+                            upsert=True)
+
+        if flush:
+            wbuf.flush()
+
+    @staticmethod
+    def rollup_key(*, job_name, granularity, bucket_ms):
+        return "{}:{}:{}".format(job_name, granularity, bucket_ms)
+
+    @staticmethod
+    def rollup_inc(*, result, duration_ms):
+        """
+        Return the rollup document increments for a completed build.
+        """
+        duration_ms = duration_ms or 0
+        return {'results.{}.count'.format(result): 1,
+                'results.{}.duration_ms'.format(result): duration_ms,
+                'results.{}.duration_s_sq'.format(result): (duration_ms/1000)**2}
+
+    def _rollup_build(self, *, job_name, bnum, start_time_ms, duration_ms, result, wbuf):
+        """
+        Add a completed build to the job's hourly and daily rollups:
+            {'_id': <job_name>:<granularity>:<bucket_ms>,
+             'job_name': <job_name>,
+             'granularity': 'day' | 'hour',
+             'bucket_ms': <bucket start time>,
+             'builds': [<build numbers counted>, ...],
+             'results': {<result>: {'count': <builds>,
+                                    'duration_ms': <sum of durations>,
+                                    'duration_s_sq': <sum of squared durations (s)>}, ...}}
+        Builds are bucketed by start time (as for builds_by_time()).
+
+        The increments are applied together with adding the build to
+        'builds', and only if it's not there already, so a build indexed
+        again (e.g. after a failed status write) isn't counted twice.
+        """
+        coll = self.jmdb.job_rollup_collection()
+        inc = JenkinsAllJobIndex.rollup_inc(result=result, duration_ms=duration_ms)
+        for granularity, size_ms in JenkinsAllJobIndex.ROLLUP_GRANULARITY_MS:
+            bucket_ms = start_time_ms - (start_time_ms % size_ms)
+            key = JenkinsAllJobIndex.rollup_key(job_name=job_name,
+                                                granularity=granularity,
+                                                bucket_ms=bucket_ms)
+            wbuf.update_once(coll=coll,
+                             filter={'_id': key, 'builds': {'$ne': str(bnum)}},
+                             update={'$inc': inc,
+                                     '$push': {'builds': str(bnum)},
+                                     '$setOnInsert': {'job_name': job_name,
+                                                      'granularity': granularity,
+                                                      'bucket_ms': bucket_ms}})
+
+    def _rollup_plan(self, *, start_time_ms, end_time_ms):
+        """
+        Cover [start, end) with the fewest rollup buckets.
 
-    def builds_by_time(self, *, start_time_ms, end_time_ms, full=False):
+        Returns (buckets, edges) where buckets is a list of
+        (granularity, first_bucket_ms, end_ms) ranges of whole buckets
+        and edges is a list of (start, end) ranges not covered by any
+        whole bucket.
+        """
+        buckets = []
+        ranges = [(start_time_ms, end_time_ms)]
+        for granularity, size_ms in JenkinsAllJobIndex.ROLLUP_GRANULARITY_MS:
+            remaining = []
+            for start, end in ranges:
+                first = -(-start//size_ms)*size_ms  # round up
+                last = (end//size_ms)*size_ms       # round down
+                if first >= last:
+                    remaining.append((start, end))
+                    continue
+                buckets.append((granularity, first, last))
+                if start < first:
+                    remaining.append((start, first))
+                if last < end:
+                    remaining.append((last, end))
+            ranges = remaining
+        return buckets, ranges
+
+    def rollup_stats(self, *, start_time_ms, end_time_ms, job_names=None):
+        """
+        Return summary statistics of completed builds that started between
+        start and end times, in the same form as job_stats(), plus the sum
+        of squared durations (for variance):
+            {'stats': [{'job_name': <name>,
+                        'result': <result>,
+                        'count': <number of builds>,
+                        'total_duration_ms': <sum of build durations>,
+                        'avg_duration_ms': <average build duration>,
+                        'duration_s_sq': <sum of squared durations (s)>}, ...]}
+
+        Computed from daily and hourly rollups, with any partial hours at
+        either end of the period taken from the individual builds, so the
+        cost depends on the length of the period, not the number of builds.
+        """
+        buckets, edges = self._rollup_plan(start_time_ms=start_time_ms,
+                                           end_time_ms=end_time_ms)
+        merged = {}
+
+        def add(*, job_name, result, count, duration_ms, duration_s_sq):
+            row = merged.setdefault((job_name, result),
+                                    {'job_name': job_name,
+                                     'result': result,
+                                     'count': 0,
+                                     'total_duration_ms': 0,
+                                     'duration_s_sq': 0})
+            row['count'] += count
+            row['total_duration_ms'] += duration_ms
+            row['duration_s_sq'] += duration_s_sq
+
+        if buckets:
+            query = {'$or': [{'granularity': granularity,
+                              'bucket_ms': {'$gte': first, '$lt': last}}
+                             for granularity, first, last in buckets]}
+            if job_names is not None:
+                query['job_name'] = {'$in': list(job_names)}
+            for doc in self.jmdb.job_rollup_collection().find(query, projection={'builds': 0}):
+                for result, vals in doc.get('results', {}).items():
+                    add(job_name=doc['job_name'], result=result,
+                        count=vals.get('count', 0),
+                        duration_ms=vals.get('duration_ms', 0),
+                        duration_s_sq=vals.get('duration_s_sq', 0))
+
+        for start, end in edges:
+            builds = self.builds_by_time(start_time_ms=start, end_time_ms=end,
+                                         job_names=job_names)
+            for bld in builds['builds']:
+                # Rollups only include completed builds.
+                if bld.get('result', 'PENDING') == 'PENDING':
+                    continue
+                inc = JenkinsAllJobIndex.rollup_inc(result=bld['result'],
+                                                    duration_ms=bld.get('duration_ms'))
+                prefix = 'results.{}.'.format(bld['result'])
+                add(job_name=bld['job_name'], result=bld['result'],
+                    count=1,
+                    duration_ms=inc[prefix+'duration_ms'],
+                    duration_s_sq=inc[prefix+'duration_s_sq'])
+
+        stats = []
+        for row in merged.values():
+            row['avg_duration_ms'] = 0
+            if row['count']:
+                row['avg_duration_ms'] = int(row['total_duration_ms']/row['count'])
+            stats.append(row)
+        return {'stats': stats}
+
+    def builds_by_time(self, *, start_time_ms, end_time_ms, full=False, job_names=None):
         '''
         Return all builds that started between start and end times.
+        Optionally limited to the given list of job names.
+        '''
+        return {'builds': list(self.iter_builds_by_time(start_time_ms=start_time_ms,
+                                                        end_time_ms=end_time_ms,
+                                                        full=full,
+                                                        job_names=job_names))}
+
+    def iter_builds_by_time(self, *, start_time_ms, end_time_ms, full=False,
+                                     job_names=None, projection=None, sort=False):
+        '''
+        Generator form of builds_by_time() yielding builds as they are
+        read from the DB.  Optionally only the projected fields, and/or
+        sorted by start time.
         '''
         # Build start time after period start time AND
         # build start time before period end time
         query = {'$and': [{'start_time_ms': {'$gte': start_time_ms}},
                           {'start_time_ms': {'$lt': end_time_ms}}]}
+        if job_names is not None:
+            query['job_name'] = {'$in': list(job_names)}
 
         colls = self.jmdb.builds_by_time_collections(
                                     start_time_ms=start_time_ms,
                                     end_time_ms=end_time_ms)
-        builds = []
+        return self._iter_builds(colls=colls, query=query, full=full,
+                                 projection=projection, sort=sort)
+
+    def job_stats(self, *, start_time_ms, end_time_ms, job_names=None):
+        """
+        Return summary statistics for builds that started between start
+        and end times (same period semantics as builds_by_time()) as
+        computed by the server:
+            {'stats': [{'job_name': <name>,
+                        'result': <result>,
+                        'count': <number of builds>,
+                        'total_duration_ms': <sum of build durations>,
+                        'avg_duration_ms': <average build duration>}, ...]}
+
+        Optionally limited to the given list of job names.
+        """
+        match = {'start_time_ms': {'$gte': start_time_ms, '$lt': end_time_ms}}
+        if job_names is not None:
+            match['job_name'] = {'$in': list(job_names)}
+        pipeline = [{'$match': match},
+                    {'$group': {'_id': {'job_name': '$job_name', 'result': '$result'},
+                                'count': {'$sum': 1},
+                                'total_duration_ms': {'$sum': '$duration_ms'}}}]
+
+        # Each collection produces its own partial rows, merge them.
+        merged = {}
+        colls = self.jmdb.builds_by_time_collections(
+                                    start_time_ms=start_time_ms,
+                                    end_time_ms=end_time_ms)
         for coll in colls:
-            docs = coll.find(query)
-            if not docs:
-                continue
-            for doc in docs:
+            for doc in coll.aggregate(pipeline):
+                key = (doc['_id'].get('job_name'), doc['_id'].get('result'))
+                row = merged.setdefault(key, {'job_name': key[0],
+                                              'result': key[1],
+                                              'count': 0,
+                                              'total_duration_ms': 0})
+                row['count'] += doc['count']
+                row['total_duration_ms'] += doc['total_duration_ms'] or 0
+        stats = []
+        for row in merged.values():
+            row['avg_duration_ms'] = 0
+            if row['count']:
+                row['avg_duration_ms'] = int(row['total_duration_ms']/row['count'])
+            stats.append(row)
+        return {'stats': stats}
+
+    def _iter_builds(self, *, colls, query, full, projection=None, sort=False):
+        """
+        Generator yielding builds matching query from each collection
+        in turn.  Collections are bucketed by start time and given in
+        time order, so sorting each by start time sorts them all.
+        """
+        if projection is not None:
+            projection = dict(projection)
+        elif not full:
+            projection = {}
+        if projection is not None and not full:
+            projection['_id'] = 0
+        for coll in colls:
+            cursor = coll.find(query, projection=projection or None)
+            if sort:
+                cursor = cursor.sort('start_time_ms', pymongo.ASCENDING)
+            for doc in cursor:
                 if full:
                     doc['collection_name'] = coll.name
-                else:
-                    doc.pop('_id')
-                builds.append(doc)
-        return {'builds': builds}
+                yield doc
 
     def builds_active_between(self, *, start_time_ms, end_time_ms, full=False):
         '''
         Return all builds that were active between the start and end time.
+
+        Builds are filed by start time, so only the time collections
+        spanning the period, plus enough prior collections to cover
+        builds of up to the maximum expected duration, are searched.
+        '''
+        return {'builds': list(self.iter_builds_active_between(start_time_ms=start_time_ms,
+                                                               end_time_ms=end_time_ms,
+                                                               full=full))}
+
+    def iter_builds_active_between(self, *, start_time_ms, end_time_ms, full=False,
+                                            projection=None, sort=False):
+        '''
+        Generator form of builds_active_between().  See iter_builds_by_time()
         '''
+        earliest_start_ms = max(0, start_time_ms-self.max_duration_ms)
+
         # Build start time before period end time AND
         # build end time after period start time
-        query = {'$and': [{'start_time_ms': {'$lte': end_time_ms}},
-                          {'end_time_ms': {'$gte': start_time_ms}}]}
+        # (the lower bound on start time allows use of the index)
+        query = {'start_time_ms': {'$gte': earliest_start_ms,
+                                   '$lte': end_time_ms},
+                 'end_time_ms': {'$gte': start_time_ms}}
 
-        builds = []
-        for coll in self.jmdb.all_builds_by_time_collections():
-            docs = coll.find(query)
-            if not docs:
-                continue
-            for doc in docs:
-                if full:
-                    doc['collection_name'] = coll.name
-                else:
-                    doc.pop('_id')
-                builds.append(doc)
-        return {'builds': builds}
+        colls = self.jmdb.builds_by_time_collections(
+                                    start_time_ms=earliest_start_ms,
+                                    end_time_ms=end_time_ms)
+        return self._iter_builds(colls=colls, query=query, full=full,
+                                 projection=projection, sort=sort)
 
-    def _get_downstream(self, *, job_name, bnum):
-        rtn = []
-        key = "{}:{}".format(job_name, bnum)
-        doc = self.jmdb.downstream_jobs().find_one({'_id': key})
-        if not doc:
+    DOWNSTREAM_MODES = ['bfs', 'graph']
+
+    def _downstream_map_bfs(self, *, root_key, max_depth):
+        """
+        Fetch the downstream documents one tree level at a time,
+        using a single $in query per level.  Each key is fetched
+        at most once.
+
+        Returns a dict of key -> list of downstream keys.
+        """
+        coll = self.jmdb.downstream_jobs()
+        down_map = {}
+        seen = set([root_key])
+        frontier = [root_key]
+        depth = 0
+        while frontier and (max_depth is None or depth < max_depth):
+            next_frontier = []
+            for doc in coll.find({'_id': {'$in': frontier}}, projection={'down': 1}):
+                downs = doc.get('down') or []
+                down_map[doc['_id']] = downs
+                for downkey in downs:
+                    if downkey in seen:
+                        continue
+                    seen.add(downkey)
+                    next_frontier.append(downkey)
+            frontier = next_frontier
+            depth += 1
+        return down_map
+
+    def _downstream_map_graph(self, *, root_key, max_depth):
+        """
+        Fetch the entire downstream tree in one round trip using $graphLookup.
+
+        Returns a dict of key -> list of downstream keys.
+        """
+        coll = self.jmdb.downstream_jobs()
+        lookup = {'from': coll.name,
+                  'startWith': '$down',
+                  'connectFromField': 'down',
+                  'connectToField': '_id',
+                  'as': 'tree'}
+        if max_depth is not None:
+            # maxDepth 0 fetches the documents for the first level
+            # of downstream builds, which give the second level, etc.
+            lookup['maxDepth'] = max(0, max_depth-2)
+        pipeline = [{'$match': {'_id': root_key}},
+                    {'$graphLookup': lookup},
+                    {'$project': {'down': 1, 'tree._id': 1, 'tree.down': 1}}]
+        down_map = {}
+        for doc in coll.aggregate(pipeline):
+            down_map[doc['_id']] = doc.get('down') or []
+            for tdoc in doc.get('tree', []):
+                down_map[tdoc['_id']] = tdoc.get('down') or []
+        return down_map
+
+    def _build_downstream(self, *, key, down_map, depth, max_depth, path):
+        """
+        Construct the nested downstream list for key from the
+        pre-fetched down_map.  A key already on the current path
+        (a cycle) is reported, but not expanded.
+        """
+        if max_depth is not None and depth >= max_depth:
             return None
-        for downkey in doc.get('down'):
-            job_name, bnum = downkey.split(':')
+        rtn = []
+        for downkey in down_map.get(key) or []:
+            job_name, bnum = downkey.rsplit(':', 1)
+            downstream = None
+            if downkey in path:
+                self.logger.warning("downstream cycle at {} from {}".format(downkey, key))
+            else:
+                downstream = self._build_downstream(key=downkey,
+                                                    down_map=down_map,
+                                                    depth=depth+1,
+                                                    max_depth=max_depth,
+                                                    path=path | set([downkey]))
             rtn.append({'job_name': job_name,
                         'build_number': bnum,
-                        'downstream': self._get_downstream(job_name=job_name, bnum=bnum)})
+                        'downstream': downstream})
         if not len(rtn):
             return None
         return rtn
 
-    def downstream_jobs(self, *, job_name, bnum):
-        return {'downstream': self._get_downstream(job_name=job_name, bnum=bnum)}
+    def downstream_jobs(self, *, job_name, bnum, max_depth=None, mode='bfs'):
+        """
+        Return the tree of builds downstream of the given build:
+            {'downstream': [{'job_name': <name>,
+                             'build_number': <bnum>,
+                             'downstream': [...] or None}, ...] or None}
+
+        max_depth limits the number of levels returned (None for no limit).
+        mode "bfs" issues one query per tree level, "graph" a single
+        $graphLookup aggregation.
+        """
+        if mode not in JenkinsAllJobIndex.DOWNSTREAM_MODES:
+            raise ValueError("unknown downstream mode: {}".format(mode))
+        if max_depth is not None and max_depth < 1:
+            raise ValueError("max_depth must be at least 1")
+
+        root_key = "{}:{}".format(job_name, bnum)
+        if mode == 'graph':
+            down_map = self._downstream_map_graph(root_key=root_key, max_depth=max_depth)
+        else:
+            down_map = self._downstream_map_bfs(root_key=root_key, max_depth=max_depth)
+        return {'downstream': self._build_downstream(key=root_key,
+                                                     down_map=down_map,
+                                                     depth=0,
+                                                     max_depth=max_depth,
+                                                     path=set([root_key]))}
 
 
 class JenkinsJobDataCollection(object):
@@ -180,9 +519,13 @@ class JenkinsJobDataCollection(object):
     def _no_data(self, *, doc):
         return not doc or 'NODATA' in doc
 
-    def store_data(self, *, bnum, data, is_done, is_reparse):
+    def store_data(self, *, bnum, data, is_done, is_reparse, wbuf=None):
         """
         Store the passed data, or no-data marker if data is None
+
+        If a MongoDBWriteBuffer is passed via wbuf, the data write is
+        added to the buffer and it is the caller's responsibility to flush.
+        No-data markers are always written immediately.
         """
         if data is None:
             try:
@@ -198,6 +541,12 @@ class JenkinsJobDataCollection(object):
                                       .format(self.job_name, bnum))
             return
 
+        if wbuf is not None:
+            doc = dict(data)
+            doc['_id'] = bnum
+            wbuf.replace_one(coll=self.coll, filter={'_id': bnum}, doc=doc, upsert=True)
+            return
+
         data['_id'] = bnum
         self.coll.find_one_and_replace({'_id':bnum}, data, upsert=True)
         data.pop('_id')
@@ -212,6 +561,18 @@ class JenkinsJobDataCollection(object):
         self.logger.debug("return match")
         return doc
 
+    def get_data_many(self, *, bnums):
+        """
+        Return {<bnum>: <data>, ...} for those of the given builds
+        having data, with one query.
+        """
+        rtn = {}
+        for doc in self.coll.find({'_id': {'$in': list(bnums)}}):
+            if self._no_data(doc=doc):
+                continue
+            rtn[doc['_id']] = doc
+        return rtn
+
     def get_data_by_build(self):
         self.logger.debug("start")
         rtn = {}
@@ -233,19 +594,19 @@ class JenkinsHostDataCollection(object):
         self.db = jmdb.jenkins_db()
         self.logger = logging.getLogger(__name__)
         self.host_name = host_name
-        self.coll = self.db.collection("host_{}".format(host_name))
-        self.coll.create_index([('job_name', pymongo.ASCENDING),
-                               ('build_number', pymongo.ASCENDING)],
-                               unique=True)
+        self.coll = jmdb.host_data_collection(host_name=host_name)
 
     def _no_data(self, *, doc):
         return not doc or 'NODATA' in doc
 
-    def store_data(self, *, job_name, bnum, data, is_done, is_reparse):
+    def store_data(self, *, job_name, bnum, data, is_done, is_reparse, wbuf=None):
         """
         Store the data. :)
 
         N.B. is_done is here for consistency, but not presently used.
+
+        If a MongoDBWriteBuffer is passed via wbuf, the write is added
+        to the buffer and it is the caller's responsibility to flush.
         """
         if not data or is_reparse:
             return
@@ -268,6 +629,11 @@ class JenkinsHostDataCollection(object):
                 'end_time_ms': end_time_ms,
                 'result': result}
 
+        if wbuf is not None:
+            wbuf.replace_one(coll=self.coll,
+                             filter={'job_name':job_name, 'build_number': bnum},
+                             doc=data, upsert=True)
+            return
         self.coll.find_one_and_replace({'job_name':job_name, 'build_number': bnum},
                                        data, upsert=True)
 
@@ -280,15 +646,75 @@ class JenkinsJobMetaCollection(object):
                      'type': EnvConfiguration.NUMBER,
                      'default': 3}}
 
+    # Jobs whose all_builds document has been migrated to the
+    # build status collection by this process.
+    _migrated = set()
+    _migrated_lock = threading.Lock()
+
     def __init__(self, *, job_name, jmdb):
         self.db = jmdb.jenkins_db()
         self.logger = logging.getLogger(__name__)
         self.job_name = job_name
         self.coll = self.db.collection("job_{}_meta".format(job_name))
+        self.status_coll = jmdb.build_status_collection()
+        self._migrated_key = "{}:{}".format(jmdb._db_name, job_name)
         cfg = EnvConfiguration(JenkinsJobMetaCollection.ENV_PARAMS)
         self.retry_max = cfg.get('JENKINS_AGGREGATOR_UPDATE_RETRY_MAX')
 
-    def index_data(self, *, bnum, data, is_done, is_reparse):
+    def _status_key(self, *, bnum):
+        return "{}:{}".format(self.job_name, bnum)
+
+    def _status_update(self, *, bnum, done, updated_ms=None):
+        """
+        Return the build status collection update for the build.
+        """
+        if updated_ms is None:
+            updated_ms = int(time.time()*1000)
+        try:
+            int_bnum = int(bnum)
+        except ValueError:
+            # e.g. test mode build "numbers"
+            int_bnum = None
+        return {'$set': {'job_name': self.job_name,
+                         'build_number': str(bnum),
+                         'bnum': int_bnum,
+                         'done': done,
+                         'updated_ms': updated_ms}}
+
+    def _migrate_all_builds(self):
+        """
+        Builds with final data were formerly tracked in a single per-job
+        "all_builds" document holding an array of every such build number.
+        On first use, move them to the build status collection (and drop
+        the array).
+        """
+        with JenkinsJobMetaCollection._migrated_lock:
+            if self._migrated_key in JenkinsJobMetaCollection._migrated:
+                return
+        doc = self.coll.find_one({'_id': 'all_builds'}, projection={'migrated': 1})
+        if doc and not doc.get('migrated', False):
+            doc = self.coll.find_one({'_id': 'all_builds'})
+            builds = doc.get('builds', [])
+            self.logger.info("migrating {} builds of {} to build status"
+                             .format(len(builds), self.job_name))
+            wbuf = MongoDBWriteBuffer()
+            for bnum in builds:
+                # Don't disturb any status already recorded.
+                update = self._status_update(bnum=bnum, done=True, updated_ms=0)
+                update = {'$setOnInsert': update['$set']}
+                wbuf.update_one(coll=self.status_coll,
+                                filter={'_id': self._status_key(bnum=bnum)},
+                                update=update, upsert=True)
+                if wbuf.op_count() >= 1000:
+                    wbuf.flush()
+            wbuf.flush()
+            self.coll.update_one({'_id': 'all_builds'},
+                                 {'$set': {'migrated': True},
+                                  '$unset': {'builds': ''}})
+        with JenkinsJobMetaCollection._migrated_lock:
+            JenkinsJobMetaCollection._migrated.add(self._migrated_key)
+
+    def index_data(self, *, bnum, data, is_done, is_reparse, wbuf=None):
         """
         Extract certain meta-data from the data set and "index".
         This is largly for the purpose of dashboard time efficiency.
@@ -297,28 +723,39 @@ class JenkinsJobMetaCollection(object):
 
         is_reparse is here for consistency with other similar
         index/store methods, but is not presently used.
+
+        If a MongoDBWriteBuffer is passed via wbuf, writes are added to
+        the buffer and it is the caller's responsibility to flush.
+        Otherwise, writes are applied before returning.
         """
+        flush = wbuf is None
+        if flush:
+            wbuf = MongoDBWriteBuffer()
+
         if is_done:
             self.logger.info("processing completed build {}:{}"
                              .format(self.job_name, bnum))
-            # Add to all_builds list when complete
-            self.coll.find_one_and_update({'_id': 'all_builds'},
-                                          {'$addToSet': {'builds': bnum}},
-                                          upsert = True)
-
         else:
             self.logger.info("processing incomplete build {}:{}"
                              .format(self.job_name, bnum))
 
+        # Record build status (completed builds are no longer pending)
+        wbuf.update_one(coll=self.status_coll,
+                        filter={'_id': self._status_key(bnum=bnum)},
+                        update=self._status_update(bnum=bnum, done=is_done),
+                        upsert=True)
+
         # Remove any retry entry
-        self.cancel_retry(bnum=bnum)
+        self.cancel_retry(bnum=bnum, wbuf=wbuf)
 
         # Remove any reparse entry
-        self.cancel_reparse(bnum=bnum)
+        self.cancel_reparse(bnum=bnum, wbuf=wbuf)
 
         if not data:
             self.logger.error("empty data for {}:{}"
                              .format(self.job_name, bnum))
+            if flush:
+                wbuf.flush()
             return # Nothing more to do.
 
         # If we have branch data, add to the builds-by-branch list(s)
@@ -326,30 +763,37 @@ class JenkinsJobMetaCollection(object):
         for repo, branch in git_branches.items():
 
             # Add repo to all repos list
-            self.coll.find_one_and_update({'_id': 'all_repos'},
-                                          {'$addToSet': {'repos': repo}},
-                                          upsert = True)
+            wbuf.update_one(coll=self.coll,
+                            filter={'_id': 'all_repos'},
+                            update={'$addToSet': {'repos': repo}},
+                            upsert=True)
 
             # Add branch to list of branches for the repo
             key = MongoDB.encode_key("{}_branches".format(repo))
-            self.coll.find_one_and_update({'_id': key},
-                                          {'$addToSet': {'branches': branch}},
-                                          upsert = True)
+            wbuf.update_one(coll=self.coll,
+                            filter={'_id': key},
+                            update={'$addToSet': {'branches': branch}},
+                            upsert=True)
 
             # Add build to the list of builds for the repo/branch pair
             key = MongoDB.encode_key("{}_{}_builds".format(repo, branch))
-            self.coll.find_one_and_update({'_id': key},
-                                          {'$addToSet': {'builds': bnum}},
-                                           upsert = True)
+            wbuf.update_one(coll=self.coll,
+                            filter={'_id': key},
+                            update={'$addToSet': {'builds': bnum}},
+                            upsert=True)
 
         # _add_to_meta_set is a list of key/val pairs.  The key will define a document,
         # and the val will be added to the 'values' set in that document iff it is not
         # already present.
         add_to_meta_set = data.pop('_add_to_meta_set', [])
         for key,val in add_to_meta_set:
-            self.coll.find_one_and_update({'_id': key},
-                                          {'$addToSet': {'values': val}},
-                                          upsert = True)
+            wbuf.update_one(coll=self.coll,
+                            filter={'_id': key},
+                            update={'$addToSet': {'values': val}},
+                            upsert=True)
+
+        if flush:
+            wbuf.flush()
 
     def store_data(self, *, key, data):
         """
@@ -377,20 +821,99 @@ class JenkinsJobMetaCollection(object):
         here so we will continue to monitor status until they return a
         final result.
         """
-        doc = self.coll.find_one({'_id': 'all_builds'})
+        self._migrate_all_builds()
+        docs = self.status_coll.find({'job_name': self.job_name, 'done': True},
+                                     projection={'_id': 0, 'build_number': 1})
+        return sorted([doc['build_number'] for doc in docs])
+
+    def completed_builds(self, *, builds):
+        """
+        Return the set of the given build numbers for which we have final data.
+        """
+        self._migrate_all_builds()
+        keys = [self._status_key(bnum=bnum) for bnum in builds]
+        docs = self.status_coll.find({'_id': {'$in': keys}, 'done': True},
+                                     projection={'_id': 0, 'build_number': 1})
+        return set([doc['build_number'] for doc in docs])
+
+    def latest_build(self):
+        """
+        Return the highest build number for which we have final data (or None).
+        """
+        self._migrate_all_builds()
+        doc = self.status_coll.find_one({'job_name': self.job_name,
+                                         'done': True,
+                                         'bnum': {'$ne': None}},
+                                        projection={'_id': 0, 'build_number': 1},
+                                        sort=[('bnum', pymongo.DESCENDING)])
         if not doc:
-            return []
-        return sorted(doc.get('builds', []))
+            return None
+        return doc['build_number']
+
+    def _done_watermark(self):
+        """
+        Highest build number at or below which every build has final data
+        (or None if not yet known).
+        """
+        doc = self.coll.find_one({'_id': 'done_watermark'})
+        if not doc:
+            return None
+        return doc.get('bnum', None)
 
-    def pending_builds(self, *, first, last):
+    def _set_done_watermark(self, *, bnum):
+        # Only ever moves up (builds with final data never become pending).
+        self.coll.update_one({'_id': 'done_watermark'},
+                             {'$max': {'bnum': bnum}}, upsert=True)
+
+    def pending_builds(self, *, first, last, limit=None):
         """
         Return list of pending (no recorded result) build numbers between
-        first and last (inclusive)
+        first and last (inclusive), highest first, up to limit (if given).
+
+        Completed builds at or below the job's done watermark are not
+        examined; above it, completed build numbers are walked down from
+        last (one indexed query) and the gaps returned.  The common case
+        of a few new builds costs about as many index keys as new builds.
         """
-        build_range = set([str(i) for i in range(first, last+1)])
-        completed_builds = set(self.all_builds())
-        return sorted([str(i) for i in (build_range-completed_builds)],
-                      key=nat_sort, reverse=True)
+        self._migrate_all_builds()
+        first = int(first)
+        last = int(last)
+        watermark = self._done_watermark()
+        lo = first
+        if watermark is not None:
+            lo = max(lo, watermark+1)
+
+        pending = []
+
+        def _add_gap(above, below):
+            # Builds strictly between below and above are pending.
+            for bnum in range(above-1, below, -1):
+                if limit is not None and len(pending) >= limit:
+                    return
+                pending.append(str(bnum))
+
+        docs = self.status_coll.find({'job_name': self.job_name,
+                                      'done': True,
+                                      'bnum': {'$gte': lo, '$lte': last}},
+                                     projection={'_id': 0, 'bnum': 1},
+                                     sort=[('bnum', pymongo.DESCENDING)])
+        above = last+1
+        for doc in docs:
+            if limit is not None and len(pending) >= limit:
+                return pending
+            _add_gap(above, doc['bnum'])
+            above = doc['bnum']
+        _add_gap(above, lo-1)
+        if limit is not None and len(pending) >= limit:
+            return pending
+
+        # Walked all the way down, so everything below the lowest
+        # pending build is done.
+        if pending:
+            self._set_done_watermark(bnum=int(pending[-1])-1)
+        else:
+            self._set_done_watermark(bnum=last)
+        return pending
 
     def schedule_retry(self, *, bnum):
         """
@@ -426,10 +949,15 @@ class JenkinsJobMetaCollection(object):
         # and allow the next update pass to make another attempt.
         return True
 
-    def cancel_retry(self, *, bnum):
+    def cancel_retry(self, *, bnum, wbuf=None):
         """
         Remove the build from the retry set.
         """
+        if wbuf is not None:
+            wbuf.update_one(coll=self.coll,
+                            filter={'_id': 'retry'},
+                            update={'$unset': {str(bnum):""}})
+            return
         self.coll.find_one_and_update(
                     {'_id': 'retry'}, {'$unset': {str(bnum):""}})
 
@@ -463,9 +991,9 @@ class JenkinsJobMetaCollection(object):
                     break
             return(sorted(rtn))
 
-        all_builds = self.all_builds()
+        completed = self.completed_builds(builds=builds)
         for bnum in builds:
-            if bnum not in all_builds:
+            if bnum not in completed:
                 # We haven't parsed in the first place.
                 # No reparse needed.
                 continue
@@ -476,10 +1004,15 @@ class JenkinsJobMetaCollection(object):
                         return_document = ReturnDocument.AFTER)
         return
 
-    def cancel_reparse(self, *, bnum):
+    def cancel_reparse(self, *, bnum, wbuf=None):
         """
         Remove the build from the reparse set.
         """
+        if wbuf is not None:
+            wbuf.update_one(coll=self.coll,
+                            filter={'_id': 'reparse'},
+                            update={'$unset': {str(bnum): ""}})
+            return
         self.coll.find_one_and_update(
                         {'_id': 'reparse'}, {'$unset': {str(bnum): ""}})
 
@@ -572,6 +1105,9 @@ class JenkinsAggregatorBase(ABC):
                                 console log to the update_build() method
                                 as the value of the "log" parameter.
                                 Default is False.
+
+        N.B.: update_build() for aggregators requesting the log is called
+              in its own thread, concurrently with other such aggregators.
         """
         self.logger = logging.getLogger(__name__)
         # XXXrs - The job name is not reliable since when we configure
@@ -589,7 +1125,10 @@ class JenkinsAggregatorBase(ABC):
         Required Parameters:
             jbi:  JenkinsBuildInfo instance (if not available will be passed as None)
             log:  the associated console log if requested via send_log_to_update
-                  initializer parameter.  Will be set to None if not requested.
+                  initializer parameter, as an iterable of lines (without line
+                  endings) that is streamed from Jenkins and may be iterated
+                  only once.  Will be set to None if not requested or not
+                  available.
 
         Returns:
             Data structure to be associated with the build number (if any).
@@ -707,31 +1246,15 @@ class JenkinsJobPostprocessor(JenkinsPostprocessorBase):
         self.jmdb = JenkinsMongoDB()
         self.alljob = JenkinsAllJobIndex(jmdb=self.jmdb)
 
-    def _job_stats(self, *, builds):
-        self.logger.info("start")
+    def _job_stats(self, *, counts):
+        """
+        Summarize a period's BuildWindows.result_stats() counts.
+        """
         rtn = {'build_cnt': 0, 'pass_avg_duration_s': 0, 'pass_pct': 0}
-        builds = builds.get('builds', None)
-        if not builds:
-            return rtn
-        build_cnt = 0
-        pass_cnt = 0
-        fail_cnt = 0
-        pass_total_duration_ms = 0
-        for bld in builds:
-            job_name = bld.get('job_name', None)
-            if not job_name or job_name != self.job_name:
-                continue
-            build_cnt += 1
-            result = bld.get('result', None)
-            if not result or result == 'ABORTED':
-                continue
-            elif result == 'FAILURE':
-                fail_cnt += 1
-                continue
-            elif result != 'SUCCESS':
-                continue
-            pass_cnt += 1
-            pass_total_duration_ms += bld.get('duration_ms', 0)
+        build_cnt = counts['build_cnt']
+        pass_cnt = counts['pass_cnt']
+        fail_cnt = counts['fail_cnt']
+        pass_total_duration_ms = counts['pass_total_duration_ms']
         rtn['build_cnt'] = build_cnt
         if not pass_cnt:
             return rtn
@@ -756,10 +1279,13 @@ class JenkinsJobPostprocessor(JenkinsPostprocessorBase):
                        {'label': 'prev_7d', 'start': now-(day_ms*14), 'end': now-(day_ms*7)-1},
                        {'label': 'last_30d', 'start': now-(day_ms*30), 'end': now},
                        {'label': 'prev_30d', 'start': now-(day_ms*60), 'end': now-(day_ms*30)-1}]
+            # All periods are summarized from a single fetch.
+            windows = BuildWindows.fetch(alljob=self.alljob,
+                                         job_name=self.job_name,
+                                         periods=periods)
+            counts = windows.result_stats()
             for period in periods:
-                builds = self.alljob.builds_by_time(start_time_ms = period['start'],
-                                                    end_time_ms = period['end'])
-                stats = self._job_stats(builds=builds)
+                stats = self._job_stats(counts=counts[period['label']])
                 bch[period['label']] = stats['build_cnt']
                 pph[period['label']] = stats['pass_pct']
                 pdh[period['label']] = stats['pass_avg_duration_s']
@@ -822,7 +1348,8 @@ class Plugins(object):
                     self.byjob.setdefault(job_name, []).append(cls)
 
     def by_job(self, *, job_name):
-        plugins = self.byjob.get(job_name, [])
+        # Copy so as not to side-effect the registered list.
+        plugins = list(self.byjob.get(job_name, []))
         plugins.extend(self.byjob.get('__ALL__', []))
         self.logger.info("plugins by_job {}: {}".format(job_name, plugins))
         return plugins
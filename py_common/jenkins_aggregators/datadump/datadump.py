@@ -7,11 +7,16 @@
 # Please refer to the included "COPYING" file for terms and conditions
 # regarding the use and redistribution of this software.
 
+import concurrent.futures
 import datetime
+import glob
+import gzip
 import json
 import logging
 import os
 import sys
+import tempfile
+import time
 
 sys.path.append(os.environ.get('XLRINFRADIR', ''))
 
@@ -31,28 +36,194 @@ logger = logging.getLogger(__name__)
 JMDB = JenkinsMongoDB()
 DB = JMDB.jenkins_db().db
 
+STATE_FILE = 'state.json'
+
+def job_collections():
+    """
+    Return list of (job_name, collection_name) of all per-job data collections.
+    """
+    rtn = []
+    for cname in DB.list_collection_names():
+        if cname.startswith('job_') and not cname.endswith('_meta'):
+            namefields = cname.split('_')
+            namefields.pop(0)
+            rtn.append(("_".join(namefields), cname))
+    return rtn
+
+def _atomic_open(*, path, mode):
+    """
+    Open a temporary file alongside path.  Returns (file, tmp_path),
+    rename tmp_path to path once complete.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.chmod(tmp_path, 0o644) # as for a plain open()
+    return os.fdopen(fd, mode), tmp_path
+
+def dump_job(*, outdir, jobname, cname):
+    """
+    Write all of the job's data to a single <jobname>.json
+    """
+    data = {}
+
+    for doc in DB[cname].find({}):
+        data[doc.get('_id')] = doc
+
+    outfile = os.path.join(outdir, "{}.json".format(jobname))
+    with open(outfile, "w+") as fp:
+        logger.info("writing: {}".format(outfile))
+        fp.write(json.dumps(data))
+    return len(data)
+
+
+class IncrementalJobDump(object):
+    """
+    Incremental dump of a job's data to <outdir>/<jobname>/ as a series
+    of gzip compressed JSON Lines segments (one build document per line):
+
+        000000.jsonl.gz     all builds as of the first run
+        000001.jsonl.gz     builds added/changed since
+        ...
+        state.json          {'hwm_ms': <high-water mark>, 'segments': <count>}
+
+    A build changed again appears again in a later segment, so readers
+    should take the last occurrence of each build.
+
+    Changes are found by the per-build updated_ms of the build status
+    collection.  Only changes at least lag_sec old are included so that
+    writes still buffered by the updater aren't missed.
+
+    A segment and the state are only committed (renamed into place)
+    once the segment is complete, so an interrupted dump is simply
+    re-done by the next run.
+    """
+    def __init__(self, *, outdir, jobname, cname, lag_sec, batch_size):
+        self.logger = logging.getLogger(__name__)
+        self.jobdir = os.path.join(outdir, jobname)
+        self.jobname = jobname
+        self.coll = DB[cname]
+        self.lag_sec = lag_sec
+        self.batch_size = batch_size
+        os.makedirs(self.jobdir, exist_ok=True)
+
+    def _state_path(self):
+        return os.path.join(self.jobdir, STATE_FILE)
+
+    def _load_state(self):
+        try:
+            with open(self._state_path()) as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            return None
+
+    def _save_state(self, *, state):
+        fp, tmp_path = _atomic_open(path=self._state_path(), mode='w')
+        with fp:
+            json.dump(state, fp)
+        os.rename(tmp_path, self._state_path())
+
+    def _changed_docs(self, *, since_ms, until_ms):
+        """
+        Generator yielding the job's documents for builds updated
+        in (since_ms, until_ms], fetched batch_size at a time.
+        """
+        status = JMDB.build_status_collection().find(
+                        {'job_name': self.jobname,
+                         'updated_ms': {'$gt': since_ms, '$lte': until_ms}},
+                        projection={'_id': 0, 'build_number': 1})
+        batch = []
+        for doc in status:
+            batch.append(doc['build_number'])
+            if len(batch) >= self.batch_size:
+                yield from self.coll.find({'_id': {'$in': batch}})
+                batch = []
+        if batch:
+            yield from self.coll.find({'_id': {'$in': batch}})
+
+    def dump(self):
+        """
+        Write a new segment if anything has changed.
+        Returns the number of builds written.
+        """
+        # Clean up after any interrupted run
+        for path in glob.glob(os.path.join(self.jobdir, '*.tmp')):
+            os.unlink(path)
+
+        until_ms = int((time.time()-self.lag_sec)*1000)
+        state = self._load_state()
+        if state is None:
+            # First run, everything.
+            state = {'hwm_ms': None, 'segments': 0}
+            docs = self.coll.find({})
+        else:
+            if until_ms <= state['hwm_ms']:
+                return 0
+            docs = self._changed_docs(since_ms=state['hwm_ms'], until_ms=until_ms)
+
+        outfile = os.path.join(self.jobdir, "{:06d}.jsonl.gz".format(state['segments']))
+        fp, tmp_path = _atomic_open(path=outfile, mode='wb')
+        count = 0
+        try:
+            with fp, gzip.GzipFile(fileobj=fp, mode='wb') as gz:
+                for doc in docs:
+                    gz.write(json.dumps(doc).encode('utf-8'))
+                    gz.write(b'\n')
+                    count += 1
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+        if count:
+            self.logger.info("writing: {} ({} builds)".format(outfile, count))
+            os.rename(tmp_path, outfile)
+            state['segments'] += 1
+        else:
+            os.unlink(tmp_path)
+        state['hwm_ms'] = until_ms
+        self._save_state(state=state)
+        return count
+
+
 if __name__ == "__main__":
 
     import argparse
     argParser = argparse.ArgumentParser()
     argParser.add_argument('--outdir', required=True, type=str,
                                 help='path to directory where per-job data should be written')
+    argParser.add_argument('--incremental', action='store_true',
+                                help='write only builds added/changed since the last run,'
+                                     ' as compressed JSON Lines segments')
+    argParser.add_argument('--workers', default=4, type=int,
+                                help='number of jobs to process concurrently')
+    argParser.add_argument('--lag_sec', default=600, type=int,
+                                help='(incremental) ignore changes more recent than this')
+    argParser.add_argument('--batch_size', default=500, type=int,
+                                help='(incremental) builds per data fetch')
     args = argParser.parse_args()
 
     os.makedirs(args.outdir, exist_ok=True)
 
-    for cname in DB.list_collection_names():
-        if cname.startswith('job_') and not cname.endswith('_meta'):
-            namefields = cname.split('_')
-            namefields.pop(0)
-            jobname = "_".join(namefields)
-
-            data = {}
-
-            for doc in DB[cname].find({}):
-                data[doc.get('_id')] = doc
+    def _dump(jobname, cname):
+        if args.incremental:
+            return IncrementalJobDump(outdir=args.outdir, jobname=jobname, cname=cname,
+                                      lag_sec=args.lag_sec,
+                                      batch_size=args.batch_size).dump()
+        return dump_job(outdir=args.outdir, jobname=jobname, cname=cname)
 
-            outfile = os.path.join(args.outdir, "{}.json".format(jobname))
-            with open(outfile, "w+") as fp:
-                logger.info("writing: {}".format(outfile))
-                fp.write(json.dumps(data))
+    run_start = time.time()
+    jobs = job_collections()
+    builds = 0
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {executor.submit(_dump, jobname, cname): jobname
+                   for jobname, cname in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                builds += future.result()
+            except Exception:
+                # Carry on with the others, a re-run picks up where this left off.
+                logger.exception("exception dumping {}".format(futures[future]))
+                failed += 1
+    logger.info("{} jobs ({} failed), {} builds in {:.1f}s"
+                .format(len(jobs), failed, builds, time.time()-run_start))
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# Copyright 2020 Xcalar, Inc. All rights reserved.
+#
+# No use, or distribution, of this source code is permitted in any form or
+# means without a valid, written license agreement with Xcalar, Inc.
+# Please refer to the included "COPYING" file for terms and conditions
+# regarding the use and redistribution of this software.
+
+"""
+Compare builds_active_between() against a scan of every builds-by-time
+collection (the previous implementation) using a synthetic data set.
+
+Populating writes to the database named by JENKINS_DB_NAME, which must
+be set explicitly so that a real Jenkins host database is never touched.
+"""
+
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+
+if __name__ == '__main__':
+    sys.path.append(os.environ.get('XLRINFRADIR', ''))
+
+from py_common.env_configuration import EnvConfiguration
+from py_common.jenkins_aggregators import JenkinsAllJobIndex
+from py_common.mongo import JenkinsMongoDB
+
+DAY_MS = 24*3600*1000
+
+
+def populate(*, jmdb, years, builds_per_day, jobs, max_duration_hr):
+    """
+    Fill builds-by-time collections with synthetic builds spanning
+    the requested number of years, ending now.
+    """
+    now_ms = int(time.time()*1000)
+    start_ms = now_ms - int(years*365*DAY_MS)
+    interval_ms = int(DAY_MS/builds_per_day)
+    bnums = {}
+    batches = {}
+    count = 0
+    for t_ms in range(start_ms, now_ms, interval_ms):
+        job_name = "bench_job_{}".format(random.randrange(jobs))
+        bnum = bnums.get(job_name, 0) + 1
+        bnums[job_name] = bnum
+        # Mostly short builds, with the occasional long one.
+        if random.random() < 0.01:
+            duration_ms = random.randrange(3600*1000, int(max_duration_hr*3600*1000))
+        else:
+            duration_ms = random.randrange(60*1000, 3600*1000)
+        coll = jmdb.builds_by_time_collection(time_ms=t_ms)
+        batch = batches.setdefault(coll.name, (coll, []))[1]
+        batch.append({'_id': "{}:{}".format(job_name, bnum),
+                      'job_name': job_name,
+                      'build_number': str(bnum),
+                      'start_time_ms': t_ms,
+                      'end_time_ms': t_ms+duration_ms,
+                      'built_on': "bench_host_{}".format(random.randrange(20)),
+                      'result': 'SUCCESS'})
+        if len(batch) >= 1000:
+            coll.insert_many(batch, ordered=False)
+            count += len(batch)
+            batch.clear()
+    for coll, batch in batches.values():
+        if batch:
+            coll.insert_many(batch, ordered=False)
+            count += len(batch)
+    return count
+
+
+def scan_all(*, jmdb, start_time_ms, end_time_ms):
+    """
+    The previous builds_active_between(): query every time collection.
+    """
+    query = {'$and': [{'start_time_ms': {'$lte': end_time_ms}},
+                      {'end_time_ms': {'$gte': start_time_ms}}]}
+    builds = []
+    for coll in jmdb.all_builds_by_time_collections():
+        for doc in coll.find(query):
+            doc.pop('_id')
+            builds.append(doc)
+    return builds
+
+
+def timed(func, **kwargs):
+    start = time.time()
+    result = func(**kwargs)
+    return time.time()-start, result
+
+
+if __name__ == '__main__':
+
+    cfg = EnvConfiguration({'LOG_LEVEL': {'default': logging.WARN}})
+
+    # It's log, it's log... :)
+    logging.basicConfig(
+                    level=cfg.get('LOG_LEVEL'),
+                    format="'%(asctime)s - %(threadName)s - %(funcName)s - %(levelname)s - %(message)s",
+                    handlers=[logging.StreamHandler()])
+    logger = logging.getLogger(__name__)
+
+    argParser = argparse.ArgumentParser(
+                    description="Benchmark builds_active_between() against a"
+                                " full scan of all builds-by-time collections.")
+    argParser.add_argument('--populate', action='store_true',
+                           help='populate synthetic builds before benchmarking')
+    argParser.add_argument('--years', default=3, type=float,
+                           help='years of synthetic builds to populate')
+    argParser.add_argument('--builds_per_day', default=500, type=int,
+                           help='synthetic builds per day')
+    argParser.add_argument('--jobs', default=50, type=int,
+                           help='number of synthetic job names')
+    argParser.add_argument('--windows', default=20, type=int,
+                           help='number of random query windows')
+    argParser.add_argument('--window_hr', default=24, type=float,
+                           help='query window length in hours')
+    args = argParser.parse_args()
+
+    if not os.environ.get('JENKINS_DB_NAME'):
+        argParser.error("JENKINS_DB_NAME must be set explicitly")
+
+    jmdb = JenkinsMongoDB()
+    alljob_idx = JenkinsAllJobIndex(jmdb=jmdb)
+
+    if args.populate:
+        start = time.time()
+        count = populate(jmdb=jmdb, years=args.years,
+                         builds_per_day=args.builds_per_day,
+                         jobs=args.jobs,
+                         max_duration_hr=alljob_idx.max_duration_ms/(3600*1000))
+        print("populated {} builds in {:.1f}s".format(count, time.time()-start))
+
+    now_ms = int(time.time()*1000)
+    earliest_ms = now_ms - int(args.years*365*DAY_MS)
+    window_ms = int(args.window_hr*3600*1000)
+
+    scan_times = []
+    indexed_times = []
+    for i in range(args.windows):
+        start_ms = random.randrange(earliest_ms, now_ms-window_ms)
+        end_ms = start_ms+window_ms
+        scan_t, scan_builds = timed(scan_all, jmdb=jmdb,
+                                    start_time_ms=start_ms, end_time_ms=end_ms)
+        idx_t, idx_result = timed(alljob_idx.builds_active_between,
+                                  start_time_ms=start_ms, end_time_ms=end_ms)
+        scan_keys = set((b['job_name'], b['build_number']) for b in scan_builds)
+        idx_keys = set((b['job_name'], b['build_number']) for b in idx_result['builds'])
+        if scan_keys != idx_keys:
+            print("MISMATCH window {}-{}: scan {} indexed {}"
+                  .format(start_ms, end_ms, len(scan_keys), len(idx_keys)))
+        scan_times.append(scan_t)
+        indexed_times.append(idx_t)
+
+    for name, times in [('full scan', scan_times), ('indexed', indexed_times)]:
+        print("{:>10}: min {:.3f}s median {:.3f}s max {:.3f}s"
+              .format(name, min(times), statistics.median(times), max(times)))
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# Copyright 2020 Xcalar, Inc. All rights reserved.
+#
+# No use, or distribution, of this source code is permitted in any form or
+# means without a valid, written license agreement with Xcalar, Inc.
+# Please refer to the included "COPYING" file for terms and conditions
+# regarding the use and redistribution of this software.
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+if __name__ == '__main__':
+    sys.path.append(os.environ.get('XLRINFRADIR', ''))
+
+from py_common.env_configuration import EnvConfiguration
+from py_common.mongo import JenkinsMongoDB
+
+if __name__ == '__main__':
+
+    cfg = EnvConfiguration({'LOG_LEVEL': {'default': logging.WARN}})
+
+    # It's log, it's log... :)
+    logging.basicConfig(
+                    level=cfg.get('LOG_LEVEL'),
+                    format="'%(asctime)s - %(threadName)s - %(funcName)s - %(levelname)s - %(message)s",
+                    handlers=[logging.StreamHandler()])
+    logger = logging.getLogger(__name__)
+
+    argParser = argparse.ArgumentParser(
+                    description="Ensure required indexes exist on all builds-by-time,"
+                                " build status and per-host collections.")
+    args = argParser.parse_args()
+
+    jmdb = JenkinsMongoDB()
+    start = time.time()
+    names = jmdb.ensure_all_indexes()
+    for name in names:
+        print("indexed: {}".format(name))
+    print("{} collections in {:.1f}s".format(len(names), time.time()-start))
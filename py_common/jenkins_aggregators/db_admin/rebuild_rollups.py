@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# Copyright 2020 Xcalar, Inc. All rights reserved.
+#
+# No use, or distribution, of this source code is permitted in any form or
+# means without a valid, written license agreement with Xcalar, Inc.
+# Please refer to the included "COPYING" file for terms and conditions
+# regarding the use and redistribution of this software.
+
+"""
+(Re)build the per-job hourly/daily rollups from the builds-by-time
+collections.  Needed once for builds indexed before rollups were
+maintained on ingest.
+
+The updater should be stopped while this runs, otherwise builds
+ingested during the rebuild may be lost.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+if __name__ == '__main__':
+    sys.path.append(os.environ.get('XLRINFRADIR', ''))
+
+from py_common.env_configuration import EnvConfiguration
+from py_common.mongo import JenkinsMongoDB, MongoDBWriteBuffer
+from py_common.jenkins_aggregators import JenkinsAllJobIndex
+
+
+def add_build(*, rollups, bld):
+    """
+    Accumulate a completed build into the in-memory rollup documents.
+    """
+    inc = JenkinsAllJobIndex.rollup_inc(result=bld['result'],
+                                        duration_ms=bld.get('duration_ms'))
+    for granularity, size_ms in JenkinsAllJobIndex.ROLLUP_GRANULARITY_MS:
+        bucket_ms = bld['start_time_ms'] - (bld['start_time_ms'] % size_ms)
+        key = JenkinsAllJobIndex.rollup_key(job_name=bld['job_name'],
+                                            granularity=granularity,
+                                            bucket_ms=bucket_ms)
+        doc = rollups.setdefault(key, {'_id': key,
+                                       'job_name': bld['job_name'],
+                                       'granularity': granularity,
+                                       'bucket_ms': bucket_ms,
+                                       'builds': [],
+                                       'results': {}})
+        # Counted builds, see JenkinsAllJobIndex._rollup_build()
+        doc['builds'].append(str(bld['build_number']))
+        for path, val in inc.items():
+            # results.<result>.<field>
+            _, result, field = path.split('.')
+            res = doc['results'].setdefault(result, {})
+            res[field] = res.get(field, 0) + val
+
+
+if __name__ == '__main__':
+
+    cfg = EnvConfiguration({'LOG_LEVEL': {'default': logging.WARN}})
+
+    # It's log, it's log... :)
+    logging.basicConfig(
+                    level=cfg.get('LOG_LEVEL'),
+                    format="'%(asctime)s - %(threadName)s - %(funcName)s - %(levelname)s - %(message)s",
+                    handlers=[logging.StreamHandler()])
+    logger = logging.getLogger(__name__)
+
+    argParser = argparse.ArgumentParser(
+                    description="Rebuild job rollups from the builds-by-time collections."
+                                " Stop the updater first.")
+    argParser.add_argument("--job", default=[], type=str, action='append', dest='jobs',
+                                help="only rebuild this (these) job(s)", metavar="name")
+    argParser.add_argument("--do_rebuild", action="store_true",
+                                help="do the rebuild")
+    args = argParser.parse_args()
+
+    jmdb = JenkinsMongoDB()
+    query = {'result': {'$ne': 'PENDING'}}
+    if args.jobs:
+        query['job_name'] = {'$in': args.jobs}
+    projection = {'_id': 0, 'job_name': 1, 'build_number': 1, 'start_time_ms': 1,
+                  'duration_ms': 1, 'result': 1}
+
+    start = time.time()
+    rollups = {}
+    builds = 0
+    for coll in jmdb.all_builds_by_time_collections():
+        for bld in coll.find(query, projection):
+            if bld.get('start_time_ms') is None or bld.get('result') is None:
+                continue
+            add_build(rollups=rollups, bld=bld)
+            builds += 1
+    print("{} builds -> {} rollups in {:.1f}s"
+          .format(builds, len(rollups), time.time()-start))
+
+    if not args.do_rebuild:
+        print("would rebuild {} rollups".format(len(rollups)))
+        sys.exit(0)
+
+    coll = jmdb.job_rollup_collection()
+    delete = {}
+    if args.jobs:
+        delete = {'job_name': {'$in': args.jobs}}
+    res = coll.delete_many(delete)
+    print("deleted {} rollups".format(res.deleted_count))
+
+    wbuf = MongoDBWriteBuffer()
+    for key, doc in rollups.items():
+        wbuf.replace_one(coll=coll, filter={'_id': key}, doc=doc, upsert=True)
+        if wbuf.op_count() >= 1000:
+            wbuf.flush()
+    wbuf.flush()
+    print("rebuilt {} rollups in {:.1f}s".format(len(rollups), time.time()-start))
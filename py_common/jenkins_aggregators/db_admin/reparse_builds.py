@@ -100,9 +100,9 @@ if __name__ == '__main__':
             raise ValueError("{} is not an active job".format(job_name))
 
         meta_coll = JenkinsJobMetaCollection(job_name=job_name, jmdb=jmdb)
-        all_builds = meta_coll.all_builds()
+        completed = meta_coll.completed_builds(builds=args.builds)
         for bnum in args.builds:
-            if bnum not in all_builds:
+            if bnum not in completed:
                 raise ValueError("{} is not a valid build number".format(bnum))
 
         # See if user wants to proceed
@@ -7,11 +7,16 @@
 # Please refer to the included "COPYING" file for terms and conditions
 # regarding the use and redistribution of this software.
 
+import concurrent.futures
 from datetime import datetime, timezone
+from dateutil.relativedelta import relativedelta
+import gzip
 import json
 import logging
 import os
 import sys
+import tempfile
+import threading
 
 sys.path.append(os.environ.get('XLRINFRADIR', ''))
 
@@ -32,29 +37,213 @@ logger = logging.getLogger(__name__)
 
 JMDB = JenkinsMongoDB()
 
+# sub-blocks to extract from build data if they exist
+
+SUB_BLOCKS = ['compile_options',
+              'analyzed_cores',
+              'functest_subtests',
+              'pytest_subtests',
+              'test_jdbc_subtests',
+              'xc_test_harness_subtests',
+              'xd_unit_test_testcases',
+              'xd_func_test_testcases',
+              'xd_test_suite_testcases',
+              'expserver_test_testcases',
+              'tpchTest',
+              'tpcdsTest',
+              'coverage'] # XXXrs coverage takes different forms...
+
+FORMATS = ['json', 'jsonl.gz']
+
 job_data_collections = {}
+job_data_collections_lock = threading.Lock()
 def get_job_data_collection(*, job_name):
-    if job_name not in job_data_collections:
-        job_data_collections[job_name] = JenkinsJobDataCollection(job_name=job_name, jmdb=JMDB)
-    return job_data_collections[job_name]
-
-def write_data(*, outdir, year, month, day=None, data):
-    for key,item in data.items():
-        if day is not None:
-            os.makedirs(os.path.join(outdir, year, month, day), exist_ok=True)
-            outfile = os.path.join(outdir, year, month, day, "{}.json".format(key))
-        else:
-            os.makedirs(os.path.join(outdir, year, month), exist_ok=True)
-            outfile = os.path.join(outdir, year, month, "{}.json".format(key))
-        logger.info("writing incremental: {}".format(outfile))
-        with open(outfile, "w+") as fp:
-            fp.write(json.dumps(item))
+    with job_data_collections_lock:
+        if job_name not in job_data_collections:
+            job_data_collections[job_name] = JenkinsJobDataCollection(job_name=job_name, jmdb=JMDB)
+        return job_data_collections[job_name]
+
+def split_build(*, build_data):
+    """
+    Split a build's data into its sub-blocks.
+    Returns list of (data_type, data), the remaining build data last.
+    """
+    rtn = []
+    for sub in SUB_BLOCKS:
+        if sub not in build_data:
+            continue
+        if sub == 'analyzed_cores':
+            fixed = {}
+            for key,item in build_data[sub].items():
+                key = MongoDB.decode_key(key)
+                fixed[key] = item
+            build_data[sub] = fixed
+        rtn.append((sub, build_data.pop(sub)))
+    rtn.append(('builds', build_data))
+    return rtn
+
+def _atomic_open(*, path, binary=False):
+    """
+    Open a temporary file alongside path.  Returns (file, tmp_path),
+    rename tmp_path to path once complete.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.chmod(tmp_path, 0o644) # as for a plain open()
+    return os.fdopen(fd, 'wb' if binary else 'w'), tmp_path
+
+
+class PeriodWriter(object):
+    """
+    Writes one period's data, one file per data type, to the period's
+    directory.  Files are written to temporaries and renamed into place
+    on close() so readers never see partial output.
+
+    Formats:
+        json:       <data_type>.json holding {<job_name>: {<build_number>: <data>}}
+                    (accumulated in memory until close())
+        jsonl.gz:   <data_type>.jsonl.gz with one line per build:
+                    {"job_name": <name>, "build_number": <bnum>, "data": <data>}
+                    (streamed as produced)
+    """
+    def __init__(self, *, outdir, fmt):
+        self.logger = logging.getLogger(__name__)
+        self.outdir = outdir
+        self.fmt = fmt
+        self.data = {}
+        self.files = {} # data_type -> (gzip file, file, tmp_path)
+        os.makedirs(outdir, exist_ok=True)
+
+    def _path(self, *, data_type):
+        return os.path.join(self.outdir, "{}.{}".format(data_type, self.fmt))
+
+    def add(self, *, data_type, job_name, build_number, data):
+        if self.fmt == 'json':
+            self.data.setdefault(data_type, {}).setdefault(job_name, {})[build_number] = data
+            return
+        if data_type not in self.files:
+            fp, tmp_path = _atomic_open(path=self._path(data_type=data_type), binary=True)
+            self.files[data_type] = (gzip.GzipFile(fileobj=fp, mode='wb'), fp, tmp_path)
+        gz = self.files[data_type][0]
+        line = json.dumps({'job_name': job_name,
+                           'build_number': build_number,
+                           'data': data})
+        gz.write(line.encode('utf-8'))
+        gz.write(b'\n')
+
+    def close(self):
+        for data_type, item in self.data.items():
+            outfile = self._path(data_type=data_type)
+            self.logger.info("writing incremental: {}".format(outfile))
+            fp, tmp_path = _atomic_open(path=outfile)
+            with fp:
+                json.dump(item, fp)
+            os.rename(tmp_path, outfile)
+        self.data = {}
+        for data_type, (gz, fp, tmp_path) in self.files.items():
+            outfile = self._path(data_type=data_type)
+            self.logger.info("writing incremental: {}".format(outfile))
+            gz.close()
+            fp.close()
+            os.rename(tmp_path, outfile)
+        self.files = {}
+
+    def abort(self):
+        for data_type, (gz, fp, tmp_path) in self.files.items():
+            fp.close()
+            os.unlink(tmp_path)
+        self.files = {}
+        self.data = {}
+
+
+def periods(*, start, end, daily):
+    """
+    Split [start, end) into day (or month) periods.
+    Returns list of (period_start, period_end) datetimes.
+    """
+    step = relativedelta(days=1) if daily else relativedelta(months=1)
+    rtn = []
+    cur = start
+    while cur < end:
+        nxt = cur + step
+        rtn.append((cur, min(nxt, end)))
+        cur = nxt
+    return rtn
+
+def period_dir(*, outdir, start, daily):
+    """
+    Layout of output directory will be:
+        /some/root/<year>/<month>/<data_type>.json
+        or
+        /some/root/<year>/<month>/<day>/<data_type>.json
+    """
+    parts = [outdir, "{}".format(start.year), "{:02d}".format(start.month)]
+    if daily:
+        parts.append("{:02d}".format(start.day))
+    return os.path.join(*parts)
+
+def export_period(*, outdir, start, end, daily, fmt, batch_size):
+    """
+    Export the data of all builds started in [start, end).
+
+    Builds are read in start time order and their data fetched in
+    batches, with one query per job per batch.
+    Returns the number of builds exported.
+    """
+    alljob = JenkinsAllJobIndex(jmdb=JMDB)
+    builds = alljob.iter_builds_by_time(start_time_ms=int(start.timestamp()*1000),
+                                        end_time_ms=int(end.timestamp()*1000),
+                                        projection={'job_name': 1, 'build_number': 1},
+                                        sort=True)
+
+    writer = None
+    exported = 0
+
+    def _flush(batch):
+        nonlocal writer, exported
+        by_job = {}
+        for binfo in batch:
+            by_job.setdefault(binfo['job_name'], []).append(binfo['build_number'])
+        found = {}
+        for job_name, bnums in by_job.items():
+            jdc = get_job_data_collection(job_name=job_name)
+            found[job_name] = jdc.get_data_many(bnums=bnums)
+        for binfo in batch:
+            job_name = binfo['job_name']
+            build_number = binfo['build_number']
+            build_data = found[job_name].get(build_number, None)
+            if not build_data:
+                continue
+            if writer is None:
+                writer = PeriodWriter(outdir=period_dir(outdir=outdir, start=start, daily=daily),
+                                      fmt=fmt)
+            for data_type, data in split_build(build_data=build_data):
+                writer.add(data_type=data_type, job_name=job_name,
+                           build_number=build_number, data=data)
+            exported += 1
+
+    try:
+        batch = []
+        for binfo in builds:
+            batch.append(binfo)
+            if len(batch) >= batch_size:
+                _flush(batch)
+                batch = []
+        if batch:
+            _flush(batch)
+    except Exception:
+        if writer is not None:
+            writer.abort()
+        raise
+
+    if writer is not None:
+        writer.close()
+    logger.info("{} - {}: exported {} builds".format(start, end, exported))
+    return exported
 
 if __name__ == "__main__":
 
     import argparse
     import time
-    from dateutil.relativedelta import relativedelta
 
     argParser = argparse.ArgumentParser()
     argParser.add_argument('--outdir', required=True, type=str,
@@ -65,6 +254,12 @@ if __name__ == "__main__":
                                 help='incremental period is monthly')
     argParser.add_argument('--prior', default=0, type=int,
                                 help='process for this many additional prior intervals')
+    argParser.add_argument('--format', default='json', choices=FORMATS, dest='fmt',
+                                help='output format (jsonl.gz streams, with flat memory use)')
+    argParser.add_argument('--workers', default=4, type=int,
+                                help='number of periods to process concurrently')
+    argParser.add_argument('--batch_size', default=500, type=int,
+                                help='builds per data fetch')
     args = argParser.parse_args()
 
 
@@ -97,133 +292,40 @@ if __name__ == "__main__":
                      hour=0, minute=0, second=0,
                      tzinfo=timezone.utc)
     logger.debug("start: {}".format(start))
-    start_ts = start.timestamp()
-    logger.debug("start_ts: {}".format(start_ts))
 
     # End is now
     end = datetime(now.year, now.month, now.day,
                    hour=now.hour, minute=now.minute, second=now.second,
                    tzinfo=timezone.utc)
     logger.debug("end: {}".format(end))
-    end_ts = end.timestamp()
-    logger.debug("end_ts: {}".format(end_ts))
-
-    """
-    Layout of output directory will be:
-        /some/root/<year>/<month>/<data_type>.json
-        or
-        /some/root/<year>/<month>/<day>/<data_type>.json
-
-        <data_type> is:
-            - builds - basic per-build data
-            - tpchTest - TPC-H test performance data
-            - functest_subtests - Functional test sub-test data
-            - and so on...
-
-        Data in all files are keyed by job_name and build_number.
-    """
 
     """
-    Use the start/end time to query for the list of completed builds.
-    Each entry looks like:
-
-        {'build_number': '3734',
-         'built_on': 'jenkins-slave-el7-n12-1',
-         'job_name': 'PrecheckinVerifyTrigger',
-         'result': 'SUCCESS',
-         'start_time_ms': 1599249540937,
-         'duration_ms': 67,
-         'end_time_ms': 1599249541004}
+    <data_type> is:
+        - builds - basic per-build data
+        - tpchTest - TPC-H test performance data
+        - functest_subtests - Functional test sub-test data
+        - and so on...
 
+    Data in all files are keyed by job_name and build_number.
     """
-    alljob = JenkinsAllJobIndex(jmdb=JMDB)
-    builds = alljob.builds_by_time(
-                        start_time_ms=(start_ts*1000),
-                        end_time_ms=(end_ts*1000))
-    blist = builds.get('builds', None)
-    if not blist:
+    run_start = time.time()
+    plist = periods(start=start, end=end, daily=args.daily)
+    workers = max(1, min(args.workers, len(plist)))
+    logger.info("{} periods, {} workers".format(len(plist), workers))
+
+    exported = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(export_period, outdir=args.outdir,
+                                   start=pstart, end=pend,
+                                   daily=args.daily, fmt=args.fmt,
+                                   batch_size=args.batch_size)
+                   for pstart, pend in plist]
+        for future in concurrent.futures.as_completed(futures):
+            # Any exception is re-raised here.
+            exported += future.result()
+
+    if not exported:
         logger.info("No builds in time period")
-        sys.exit(0)
-    logger.info("Processing {} builds".format(len(blist)))
-
-    # sub-blocks to extract from build data if they exist
-
-    sub_blocks = ['compile_options',
-                  'analyzed_cores',
-                  'functest_subtests',
-                  'pytest_subtests',
-                  'test_jdbc_subtests',
-                  'xc_test_harness_subtests',
-                  'xd_unit_test_testcases',
-                  'xd_func_test_testcases',
-                  'xd_test_suite_testcases',
-                  'expserver_test_testcases',
-                  'tpchTest',
-                  'tpcdsTest',
-                  'coverage'] # XXXrs coverage takes different forms...
-
-    cur_year = None
-    cur_month = None
-    cur_day = None
-    cur_data = {}
-    flush = False
-
-    # Sort the build list by start time
-    for binfo in sorted(blist, key=lambda d: d['start_time_ms']):
-        ts_ms = binfo.get('start_time_ms', None)
-        if not ts_ms:
-            continue
-
-        dt = datetime.fromtimestamp(ts_ms/1000, tz=timezone.utc)
-        year = "{}".format(dt.year)
-        month = "{:02d}".format(dt.month)
-        day = "{:02d}".format(dt.day)
-
-        if not cur_year:
-            cur_year = year
-        flush = year != cur_year
-
-        if not cur_month:
-            cur_month = month
-        flush = month != cur_month
-
-        if args.daily:
-            if not cur_day:
-                cur_day = day
-            flush = cur_day != day
-
-        if flush and cur_data:
-            write_data(outdir=args.outdir,
-                       year=cur_year,
-                       month=cur_month,
-                       day=cur_day,
-                       data=cur_data)
-            cur_year = year
-            cur_month = month
-            if args.daily:
-                cur_day = day
-            cur_data = {}
-            flush = False
-
-        job_name = binfo.pop('job_name')
-        jdc = get_job_data_collection(job_name=job_name)
-        build_number = binfo.pop('build_number')
-        build_data = jdc.get_data(bnum=build_number)
-
-        for sub in sub_blocks:
-            if sub in build_data:
-                if sub == 'analyzed_cores':
-                    fixed = {}
-                    for key,item in build_data[sub].items():
-                        key = MongoDB.decode_key(key)
-                        fixed[key] = item
-                    build_data[sub] = fixed
-                cur_data.setdefault(sub, {}).setdefault(job_name, {})[build_number] = build_data.pop(sub)
-        cur_data.setdefault('builds', {}).setdefault(job_name, {})[build_number] = build_data
-
-    if cur_data:
-        write_data(outdir=args.outdir,
-                   year=cur_year,
-                   month=cur_month,
-                   day=cur_day,
-                   data=cur_data)
+    else:
+        logger.info("Exported {} builds in {:.1f}s"
+                    .format(exported, time.time()-run_start))
@@ -41,7 +41,7 @@ class CompileOptionsLogParser(JenkinsAggregatorBase):
         """
         options = {}
 
-        for lnum, line in enumerate(log.splitlines()):
+        for lnum, line in enumerate(log):
 
             # 104.033 COMPILE_OPTION: ENABLE_ASSERTIONS support is OFF
 
@@ -99,5 +99,5 @@ if __name__ == '__main__':
             print(log)
         else:
             print("checking job: {} build: {} result: {}".format(job_name, build_number, result))
-            data = parser.update_build(jbi=jbi, log=jbi.console())
+            data = parser.update_build(jbi=jbi, log=jbi.console_lines())
             pprint(data)
@@ -54,7 +54,7 @@ class CoreAnalyzerLogParser(JenkinsAggregatorBase):
         cores = {}
         cur_core = None
 
-        for lnum, line in enumerate(log.splitlines()):
+        for lnum, line in enumerate(log):
 
             fields = line.split()
             if len(fields) < 4:
@@ -203,5 +203,5 @@ if __name__ == '__main__':
             print(log)
         else:
             print("checking job: {} build: {} result: {}".format(job_name, build_number, result))
-            data = parser.update_build(jbi=jbi, log=jbi.console())
+            data = parser.update_build(jbi=jbi, log=jbi.console_lines())
             pprint(data)
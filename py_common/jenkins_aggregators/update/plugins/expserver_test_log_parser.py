@@ -70,7 +70,7 @@ class ExpServerTestLogParser(JenkinsAggregatorBase):
         collect_fail_list = False
         collect_fail_num = None
 
-        for lnum, line in enumerate(log.splitlines()):
+        for lnum, line in enumerate(log):
 
             if collect_fail_list:
                 fields = line.split()
@@ -292,5 +292,5 @@ if __name__ == '__main__':
             print(log)
         else:
             print("checking job: {} build: {} result: {}".format(job_name, build_number, result))
-            data = parser.update_build(jbi=jbi, log=jbi.console())
+            data = parser.update_build(jbi=jbi, log=jbi.console_lines())
             pprint(data)
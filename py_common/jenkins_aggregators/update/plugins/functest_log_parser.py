@@ -54,7 +54,7 @@ class FuncTestLogParser(JenkinsAggregatorBase):
         subtest_data = {}
         cur_subtest = None
 
-        for lnum, line in enumerate(log.splitlines()):
+        for lnum, line in enumerate(log):
 
             fields = line.split()
             if len(fields) < 3:
@@ -172,5 +172,5 @@ if __name__ == '__main__':
             print(log)
         else:
             print("checking job: {} build: {} result: {}".format(job_name, build_number, result))
-            data = parser.update_build(jbi=jbi, log=jbi.console())
+            data = parser.update_build(jbi=jbi, log=jbi.console_lines())
             pprint(data)
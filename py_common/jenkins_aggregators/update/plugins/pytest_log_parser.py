@@ -44,7 +44,7 @@ class PyTestLogParser(JenkinsAggregatorBase):
         past_start_marker = False
         past_durations_marker = False
         subtest_data = {}
-        for lnum, line in enumerate(log.splitlines()):
+        for lnum, line in enumerate(log):
             '''
             3339.573  ============================= test session starts ==============================
             '''
@@ -218,5 +218,5 @@ if __name__ == '__main__':
             print(log)
         else:
             print("checking job: {} build: {} result: {}".format(job_name, build_number, result))
-            data = parser.update_build(jbi=jbi, log=jbi.console())
+            data = parser.update_build(jbi=jbi, log=jbi.console_lines())
             pprint(data)
@@ -53,7 +53,7 @@ class TestJdbcLogParser(JenkinsAggregatorBase):
 
         subtest_data = {}
 
-        for lnum, line in enumerate(log.splitlines()):
+        for lnum, line in enumerate(log):
 
             if "======" not in line:
                 continue
@@ -143,5 +143,5 @@ if __name__ == '__main__':
             print(log)
         else:
             print("checking job: {} build: {} result: {}".format(job_name, build_number, result))
-            data = parser.update_build(jbi=jbi, log=jbi.console())
+            data = parser.update_build(jbi=jbi, log=jbi.console_lines())
             pprint(data)
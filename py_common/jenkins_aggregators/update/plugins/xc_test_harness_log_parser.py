@@ -151,7 +151,7 @@ class XcTestHarnessLogParser(JenkinsAggregatorBase):
 
         saw_start_marker = False
         subtest_data = {}
-        for line in log.splitlines():
+        for line in log:
 
             # Look for test completion signatures
             """
@@ -238,5 +238,5 @@ if __name__ == '__main__':
         jbi = JenkinsBuildInfo(job_name=job_name, build_number=build_number, japi=japi)
         result = jbi.result()
         print("checking job: {} build: {} result: {}".format(job_name, build_number, result))
-        data = parser.update_build(jbi=jbi, log=jbi.console())
+        data = parser.update_build(jbi=jbi, log=jbi.console_lines())
         pprint(data)
@@ -68,7 +68,7 @@ class XDFuncTestLogParser(JenkinsAggregatorBase):
         self.start_time_ms = jbi.start_time_ms()
 
         user_to_cur_testcase = {}
-        for lnum, line in enumerate(log.splitlines()):
+        for lnum, line in enumerate(log):
             fields = line.split()
 
             if len(fields) < 5:
@@ -239,5 +239,5 @@ if __name__ == '__main__':
             print(log)
         else:
             print("checking job: {} build: {} result: {}".format(job_name, build_number, result))
-            data = parser.update_build(jbi=jbi, log=jbi.console())
+            data = parser.update_build(jbi=jbi, log=jbi.console_lines())
             pprint(data)
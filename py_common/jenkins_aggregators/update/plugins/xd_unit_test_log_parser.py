@@ -50,7 +50,7 @@ class XDUnitTestLogParser(JenkinsAggregatorBase):
         self.start_time_ms = jbi.start_time_ms()
 
         testcase_data = {}
-        for lnum, line in enumerate(log.splitlines()):
+        for lnum, line in enumerate(log):
             '''
             631.088 JSHandle:[XDUnitTest] (3259) ColSchemaSection Test/_removeList should work: begin
             631.191 JSHandle:[XDUnitTest] (3259) ColSchemaSection Test/_removeList should work: pass(0.1s)
@@ -147,5 +147,5 @@ if __name__ == '__main__':
             print(log)
         else:
             print("checking job: {} build: {} result: {}".format(job_name, build_number, result))
-            data = parser.update_build(jbi=jbi, log=jbi.console())
+            data = parser.update_build(jbi=jbi, log=jbi.console_lines())
             pprint(data)
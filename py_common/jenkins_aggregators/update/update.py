@@ -8,14 +8,19 @@
 # regarding the use and redistribution of this software.
 
 from abc import ABC, abstractmethod
+import concurrent.futures
+import copy
 import json
 import logging
+import multiprocessing
 import os
 import pprint
+import queue
 from pymongo.errors import DuplicateKeyError
 from pymongo import ReturnDocument
 import signal
 import sys
+import threading
 import time
 
 sys.path.append(os.environ.get('XLRINFRADIR', ''))
@@ -33,9 +38,49 @@ from py_common.jenkins_aggregators import PostprocessorPlugins
 from py_common.jenkins_aggregators.update.alerting import AlertManager
 from py_common.jenkins_api import JenkinsApi
 from py_common.mongo import JenkinsMongoDB, MongoDBKeepAliveLock, MongoDBKALockTimeout
+from py_common.mongo import MongoDBWriteBuffer
 from py_common.sorts import nat_sort
 
 
+class ConsoleLogFeed(object):
+    """
+    Iterable of console log lines handed to a single aggregator's
+    update_build() as its "log" parameter.  Lines arrive in chunks
+    through a bounded queue, so a producer feeding several aggregators
+    is held back by the slowest of them, bounding memory use.
+
+    The feed may be iterated only once.
+    """
+    _END = object()
+
+    def __init__(self, *, max_chunks):
+        self.queue = queue.Queue(maxsize=max_chunks)
+        self.ended = False
+
+    def put(self, chunk):
+        self.queue.put(chunk)
+
+    def end(self):
+        self.queue.put(ConsoleLogFeed._END)
+
+    def __iter__(self):
+        while not self.ended:
+            chunk = self.queue.get()
+            if chunk is ConsoleLogFeed._END:
+                self.ended = True
+                break
+            yield from chunk
+
+    def drain(self):
+        """
+        Discard anything the consumer did not read so that
+        the producer is never blocked by a finished consumer.
+        """
+        while not self.ended:
+            if self.queue.get() is ConsoleLogFeed._END:
+                self.ended = True
+
+
 class JenkinsJobAggregators(object):
     """
     Controller class for set of aggregators for a job.
@@ -48,7 +93,23 @@ class JenkinsJobAggregators(object):
                   'JENKINS_AGGREGATOR_UPDATE_FREQ_SEC':
                     {'required': True,
                      'type': EnvConfiguration.NUMBER,
-                     'default': 300} }
+                     'default': 300},
+                  'JENKINS_AGGREGATOR_UPDATE_BUILD_WORKERS':
+                    {'required': True,
+                     'type': EnvConfiguration.NUMBER,
+                     'default': 1},
+                  'JENKINS_AGGREGATOR_UPDATE_WRITE_BATCH':
+                    {'required': True,
+                     'type': EnvConfiguration.NUMBER,
+                     'default': 1},
+                  'JENKINS_AGGREGATOR_LOG_CHUNK_LINES':
+                    {'required': True,
+                     'type': EnvConfiguration.NUMBER,
+                     'default': 1000},
+                  'JENKINS_AGGREGATOR_LOG_QUEUE_CHUNKS':
+                    {'required': True,
+                     'type': EnvConfiguration.NUMBER,
+                     'default': 8} }
 
     def __init__(self, *, jenkins_host, job_name, jmdb,
                           aggregator_plugins=None,
@@ -67,6 +128,7 @@ class JenkinsJobAggregators(object):
         self.logger = logging.getLogger(__name__)
         self.jenkins_host = jenkins_host
         self.job_name = job_name
+        self.jmdb = jmdb
         self.aggregator_plugins = aggregator_plugins
         self.postprocessor_plugins = postprocessor_plugins
 
@@ -78,11 +140,86 @@ class JenkinsJobAggregators(object):
         #         time has passed.
         self.freq_sec = cfg.get('JENKINS_AGGREGATOR_UPDATE_FREQ_SEC')
 
+        # Maximum number of builds of this job processed concurrently.
+        self.build_workers = max(1, int(cfg.get('JENKINS_AGGREGATOR_UPDATE_BUILD_WORKERS')))
+
+        # Number of successfully processed builds whose DB writes are
+        # batched together before being flushed.
+        self.write_batch = max(1, int(cfg.get('JENKINS_AGGREGATOR_UPDATE_WRITE_BATCH')))
+        self.wbuf = MongoDBWriteBuffer()
+
+        # Console log lines are dispatched to log-consuming aggregators
+        # in chunks of log_chunk_lines, with at most log_queue_chunks
+        # chunks outstanding per aggregator.
+        self.log_chunk_lines = max(1, int(cfg.get('JENKINS_AGGREGATOR_LOG_CHUNK_LINES')))
+        self.log_queue_chunks = max(1, int(cfg.get('JENKINS_AGGREGATOR_LOG_QUEUE_CHUNKS')))
+
         self.job_data_coll = JenkinsJobDataCollection(job_name=job_name, jmdb=jmdb)
         self.job_meta_coll = JenkinsJobMetaCollection(job_name=job_name, jmdb=jmdb)
         self.alljob_idx = JenkinsAllJobIndex(jmdb=jmdb)
         self.japi = JenkinsApi(host=self.jenkins_host)
 
+    def _run_log_aggregators(self, *, jbi, aggregators, params):
+        """
+        Make a single streaming pass over the build's console log,
+        feeding every line to all of the given (log-consuming)
+        aggregators, each of which runs in its own thread.
+
+        Returns a dictionary keyed by id(aggregator) of (data, exception)
+        tuples.  Exceptions raised while reading the log are propagated
+        to the caller (any aggregator results are then discarded).
+        """
+        results = {}
+        lines = jbi.console_lines()
+        if lines is None:
+            # No log available, aggregators get None (as they always have).
+            for agg in aggregators:
+                try:
+                    self.logger.info('calling aggregator: {}'.format(agg.agg_name))
+                    results[id(agg)] = (agg.update_build(log=None, **params), None)
+                except Exception as e:
+                    results[id(agg)] = (None, e)
+            return results
+
+        def run(agg, feed):
+            try:
+                self.logger.info('calling aggregator: {}'.format(agg.agg_name))
+                results[id(agg)] = (agg.update_build(log=feed, **params), None)
+            except Exception as e:
+                results[id(agg)] = (None, e)
+            finally:
+                feed.drain()
+
+        feeds = []
+        threads = []
+        for agg in aggregators:
+            feed = ConsoleLogFeed(max_chunks=self.log_queue_chunks)
+            thread = threading.Thread(target=run, args=(agg, feed),
+                                      name="{}-{}".format(agg.agg_name, jbi.build_number))
+            thread.daemon = True
+            thread.start()
+            feeds.append(feed)
+            threads.append(thread)
+
+        self.logger.info("stream log")
+        try:
+            chunk = []
+            for line in lines:
+                chunk.append(line)
+                if len(chunk) >= self.log_chunk_lines:
+                    for feed in feeds:
+                        feed.put(chunk)
+                    chunk = []
+            if chunk:
+                for feed in feeds:
+                    feed.put(chunk)
+        finally:
+            for feed in feeds:
+                feed.end()
+            for thread in threads:
+                thread.join()
+        return results
+
     def _update_build(self, *, bnum, is_reparse=False, test_mode=False, test_data_path=None):
         """
         Call all aggregators on the build.  Consolidate results
@@ -172,20 +309,25 @@ class JenkinsJobAggregators(object):
             #
             # N.B.: We only run custom aggregators on completed builds to
             # preserve earlier semantics.
+            #
+            # Plug-in instances are shared across builds (and across jobs
+            # for __ALL__ plug-ins) and some stash per-build state on self,
+            # so give each build its own shallow copy in case builds are
+            # being processed concurrently.
             if self.aggregator_plugins:
-                aggregators.extend(self.aggregator_plugins)
+                aggregators.extend([copy.copy(agg) for agg in self.aggregator_plugins])
 
-        send_log = False
-        for aggregator in aggregators:
-            if aggregator.send_log_to_update:
-                send_log = True
-                break
+        log_aggregators = [agg for agg in aggregators if agg.send_log_to_update]
 
-        console_log = None
-        if send_log:
+        log_results = {}
+        if log_aggregators:
             try:
-                self.logger.info("get log")
-                console_log = jbi.console()
+                log_results = self._run_log_aggregators(
+                                    jbi=jbi,
+                                    aggregators=log_aggregators,
+                                    params={'jbi': jbi,
+                                            'is_reparse': is_reparse,
+                                            'test_mode': test_mode})
             except Exception as e:
                 self.logger.exception("exception processing bnum: {}".format(bnum))
                 if not is_reparse and not self.job_meta_coll.schedule_retry(bnum=bnum):
@@ -198,14 +340,17 @@ class JenkinsJobAggregators(object):
         merged_data = {}
         for agg in aggregators:
             try:
-                params =  {'jbi': jbi,
-                           'log': None,
-                           'is_reparse': is_reparse,
-                           'test_mode': test_mode}
                 if agg.send_log_to_update:
-                    params['log'] = console_log
-                self.logger.info('calling aggregator: {}'.format(agg.agg_name))
-                data = agg.update_build(**params) or {}
+                    # Already run by the log dispatcher.
+                    data, exc = log_results[id(agg)]
+                    if exc is not None:
+                        raise exc
+                    data = data or {}
+                else:
+                    self.logger.info('calling aggregator: {}'.format(agg.agg_name))
+                    data = agg.update_build(jbi=jbi, log=None,
+                                            is_reparse=is_reparse,
+                                            test_mode=test_mode) or {}
 
             except JenkinsAggregatorDataUpdateTemporaryError as e:
                 # Subclass update_build() encountered a temporary error
@@ -240,18 +385,29 @@ class JenkinsJobAggregators(object):
         #         might want custom post-aggregation "indexers" that
         #         are paired with the "aggregators".
         #
+        # All writes for the build are collected in a write buffer and
+        # only handed off to the (batched) job write buffer once every
+        # step has succeeded, preserving all or nothing.
 
+        wbuf = MongoDBWriteBuffer()
         self.job_meta_coll.index_data(bnum=bnum, data=merged_data,
-                                      is_done=is_done, is_reparse=is_reparse)
+                                      is_done=is_done, is_reparse=is_reparse,
+                                      wbuf=wbuf)
         self.job_data_coll.store_data(bnum=bnum, data=merged_data,
-                                      is_done=is_done, is_reparse=is_reparse)
+                                      is_done=is_done, is_reparse=is_reparse,
+                                      wbuf=wbuf)
         self.alljob_idx.index_data(job_name=self.job_name,
                                    bnum=bnum, data=merged_data,
-                                   is_done=is_done, is_reparse=is_reparse)
+                                   is_done=is_done, is_reparse=is_reparse,
+                                   wbuf=wbuf)
 
-        host_data_coll = JenkinsHostDataCollection(jmdb=jmdb, host_name=merged_data['built_on'])
+        host_data_coll = JenkinsHostDataCollection(jmdb=self.jmdb, host_name=merged_data['built_on'])
         host_data_coll.store_data(job_name=self.job_name, bnum=bnum, data=merged_data,
-                                  is_done=is_done, is_reparse=is_reparse)
+                                  is_done=is_done, is_reparse=is_reparse,
+                                  wbuf=wbuf)
+
+        if self.wbuf.merge(wbuf=wbuf) >= self.write_batch:
+            self.wbuf.flush()
         self.logger.debug("end")
         return True
 
@@ -259,7 +415,7 @@ class JenkinsJobAggregators(object):
         postprocessors = [JenkinsJobPostprocessor(jenkins_host=self.jenkins_host, job_name=self.job_name)]
         if not default_only:
             if self.postprocessor_plugins:
-                postprocessors.extend(self.postprocessor_plugins)
+                postprocessors.extend([copy.copy(pp) for pp in self.postprocessor_plugins])
         for pproc in postprocessors:
             try:
                 data = pproc.update_job(test_mode=test_mode)
@@ -277,11 +433,43 @@ class JenkinsJobAggregators(object):
         self.logger.info("test_data_path: {}".format(test_data_path))
         self.logger.info("is_reparse: {}".format(is_reparse))
         updated = 0
-        for bnum in builds:
-            if self._update_build(bnum=bnum, test_mode=test_mode,
-                                  test_data_path=test_data_path,
-                                  is_reparse=is_reparse):
-                updated += 1
+        if not test_mode and len(builds) > 1:
+            # Fetch all the build data at once rather than build by build.
+            self.japi.prefetch_build_info(job_name=self.job_name, build_numbers=builds)
+        try:
+            if test_mode or self.build_workers == 1 or len(builds) < 2:
+                for bnum in builds:
+                    if self._update_build(bnum=bnum, test_mode=test_mode,
+                                          test_data_path=test_data_path,
+                                          is_reparse=is_reparse):
+                        updated += 1
+            else:
+                # Builds are independent of one another so can be processed
+                # concurrently.  The caller holds the job's process lock.
+                max_workers = min(self.build_workers, len(builds))
+                self.logger.info("processing {} builds with {} workers"
+                                 .format(len(builds), max_workers))
+                with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = [executor.submit(self._update_build,
+                                               bnum=bnum,
+                                               is_reparse=is_reparse)
+                               for bnum in builds]
+                    errors = []
+                    for future in concurrent.futures.as_completed(futures):
+                        try:
+                            if future.result():
+                                updated += 1
+                        except Exception as e:
+                            self.logger.exception("exception updating build")
+                            errors.append(e)
+                # As for the serial case, a failed build fails the update.
+                if errors:
+                    raise errors[0]
+        finally:
+            # Write out anything still batched (builds that completed
+            # successfully) before post-processing or bailing.
+            self.wbuf.flush()
+
         if updated:
             self.logger.debug("{} builds updated, call postprocessors".format(updated))
             self._postprocess_job(test_mode=test_mode)
@@ -293,23 +481,26 @@ class JenkinsJobAggregators(object):
     def update_builds(self, *, test_builds=None,
                                test_data_path=None,
                                force_default_job_update=False):
+        """
+        Returns the number of builds updated (including reparse).
+        """
         self.logger.info("start")
 
         if test_builds:
-            self._do_updates(builds=test_builds,
-                             test_mode=True,
-                             test_data_path=test_data_path)
-            return
+            return self._do_updates(builds=test_builds,
+                                    test_mode=True,
+                                    test_data_path=test_data_path)
 
         jobinfo = self.japi.get_job_info(job_name=self.job_name)
         jenkins_first = jobinfo.first_build_number()
         jenkins_last = jobinfo.last_build_number()
         if not jenkins_first or not jenkins_last:
             self.logger.error("missing first or last build for job {}".format(self.job_name))
-            return
+            return 0
 
-        pending = self.job_meta_coll.pending_builds(first=jenkins_first, last=jenkins_last)
-        updated = self._do_updates(builds=pending[:self.builds_max], force_default_job_update=force_default_job_update)
+        pending = self.job_meta_coll.pending_builds(first=jenkins_first, last=jenkins_last,
+                                                    limit=self.builds_max)
+        updated = self._do_updates(builds=pending, force_default_job_update=force_default_job_update)
 
         extra = self.builds_max - updated
 
@@ -317,7 +508,8 @@ class JenkinsJobAggregators(object):
         if extra > 0:
             reparse = self.job_meta_coll.reparse(rtnmax=extra)
             if reparse:
-                self._do_updates(builds=reparse, is_reparse=True)
+                updated += self._do_updates(builds=reparse, is_reparse=True)
+        return updated
 
 # MAIN -----
 
@@ -325,7 +517,10 @@ cfg = EnvConfiguration({'LOG_LEVEL': {'default': logging.INFO},
                         'JENKINS_HOST': {'default': None},
                         'JENKINS_DB_NAME': {'default': None},
                         'UPDATE_JOB_LIST': {'default': None},
-                        'ALL_JOB_UPDATE_FREQ_HR': {'default': 24}})
+                        'ALL_JOB_UPDATE_FREQ_HR': {'default': 24},
+                        'UPDATE_WORKERS': {'type': EnvConfiguration.NUMBER,
+                                           'default': 1},
+                        'UPDATE_WORKER_MODE': {'default': 'thread'}})
 
 # It's log, it's log... :)
 logging.basicConfig(level=cfg.get('LOG_LEVEL'),
@@ -354,6 +549,112 @@ if len(args.test_builds):
     if not cfg.get('JENKINS_DB_NAME'):
         raise ValueError("test mode requires JENKINS_DB_NAME")
 
+worker_mode = cfg.get('UPDATE_WORKER_MODE')
+if worker_mode not in ['thread', 'process']:
+    raise ValueError("UPDATE_WORKER_MODE must be one of \"thread\" or \"process\"")
+workers = max(1, int(cfg.get('UPDATE_WORKERS')))
+if test_mode:
+    workers = 1
+logger.info("workers: {} mode: {}".format(workers, worker_mode))
+
+jenkins_host=cfg.get('JENKINS_HOST')
+if not jenkins_host:
+    raise ValueError("JENKINS_HOST not defined")
+logger.info("using jenkins_host {}".format(jenkins_host))
+
+# "process" worker mode workers set up their own JenkinsMongoDB and
+# plugins (which hold MongoClients), since MongoClient instances must
+# not be shared across a fork.
+_worker_setup = None
+
+def _get_worker_setup():
+    global _worker_setup
+    if _worker_setup is None:
+        _worker_setup = {'jmdb': JenkinsMongoDB(),
+                         'aggregator_plugins': AggregatorPlugins(),
+                         'postprocessor_plugins': PostprocessorPlugins()}
+    return _worker_setup
+
+
+def update_job(*, job_name, force_default_job_update, in_worker_process=False):
+    """
+    Update a single job under the protection of the job's process lock.
+
+    Returns the number of builds updated, or None if the lock could
+    not be obtained.
+
+    May run in a worker thread or (forked) worker process.  Processes
+    are forked before the main process creates any MongoClient, and
+    use only their own (see _get_worker_setup()).
+    """
+    if in_worker_process:
+        setup = _get_worker_setup()
+        job_jmdb = setup['jmdb']
+        job_aggregator_plugins = setup['aggregator_plugins']
+        job_postprocessor_plugins = setup['postprocessor_plugins']
+    else:
+        job_jmdb = jmdb
+        job_aggregator_plugins = aggregator_plugins
+        job_postprocessor_plugins = postprocessor_plugins
+
+    logger.info("process {}".format(job_name))
+
+    # Try to obtain the process lock
+    process_lock_name = "{}_process_lock".format(job_name)
+    process_lock_meta = {"reason": "locked by JenkinsJobAggregators for update_builds()"}
+    process_lock = MongoDBKeepAliveLock(db=job_jmdb.jenkins_db(), name=process_lock_name)
+    try:
+        process_lock.lock(meta=process_lock_meta)
+    except MongoDBKALockTimeout as e:
+        logger.info("timeout acquiring {}".format(process_lock_name))
+        return None
+
+    # XXXrs - FUTURE - context manager for keep-alive lock
+    try:
+        jja = JenkinsJobAggregators(jenkins_host=jenkins_host,
+                                    job_name=job_name, jmdb=job_jmdb,
+                                    aggregator_plugins=job_aggregator_plugins.by_job(job_name=job_name),
+                                    postprocessor_plugins=job_postprocessor_plugins.by_job(job_name=job_name))
+        updated = jja.update_builds(test_builds=args.test_builds,
+                                    test_data_path=args.test_data_path,
+                                    force_default_job_update=force_default_job_update)
+        if updated or force_default_job_update:
+            # Let readers know cached results are now stale.
+            job_jmdb.change_stamp(bump=True)
+        for stats in jja.japi.cache_stats():
+            logger.info("{} cache stats: {}".format(job_name, stats))
+        return updated
+    finally:
+        process_lock.unlock()
+
+
+def _start_process_executor(*, workers):
+    """
+    Return a ProcessPoolExecutor with its worker processes started.
+
+    Workers must be forked (the default start method only on Linux):
+    under spawn or forkserver each would re-run this script.
+    """
+    ctx = multiprocessing.get_context('fork')
+    try:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                          mp_context=ctx)
+    except TypeError:
+        # Python < 3.7 has no mp_context, and always forks on POSIX.
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    # Workers may be started on demand, so give each something to do.
+    for future in [executor.submit(os.getpid) for i in range(workers)]:
+        future.result()
+    return executor
+
+executor = None
+if workers > 1:
+    if worker_mode == 'process':
+        executor = _start_process_executor(workers=workers)
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+# Main process MongoClient(s) only after any worker processes are started.
 jmdb = JenkinsMongoDB()
 logger.info("jmdb {}".format(jmdb))
 
@@ -364,71 +665,77 @@ except Exception:
     logger.error("Exception while clearing expired alerts",
                  exc_info=True)
 
-process_lock = None
-try:
-    aggregator_plugins = AggregatorPlugins()
-    postprocessor_plugins = PostprocessorPlugins()
-
-    jenkins_host=cfg.get('JENKINS_HOST')
-    if not jenkins_host:
-        raise ValueError("JENKINS_HOST not defined")
-    logger.info("using jenkins_host {}".format(jenkins_host))
-
-    force_default_job_update = False
-    job_list = args.update_jobs
-    if not job_list:
-        logger.info("no job list, fetching all known jobs")
-        japi = JenkinsApi(host=jenkins_host)
-        job_list = japi.list_jobs()
-
-        # Update the active jobs and active hosts lists in the DB
-        logger.info("updating active jobs list in DB")
-        jmdb.active_jobs(job_list=job_list)
-        logger.info("updating active hosts list in DB")
-        jmdb.active_hosts(host_list=japi.list_hosts())
-
-        # Since we're doing the full list, see if we need to force
-        # a default update of job stats.  A force update will ensure the
-        # job stats are maintained even if there are no recent builds for
-        # that job. (ENG-8959)
-        ts = jmdb.all_job_update_ts()
-        if int(time.time()) > ts:
-            force_default_job_update = True
-
-    logger.info("job list: {}".format(job_list))
-    logger.info("force_default_job_update: {}"
-                .format(force_default_job_update))
-
+aggregator_plugins = AggregatorPlugins()
+postprocessor_plugins = PostprocessorPlugins()
+
+force_default_job_update = False
+job_list = args.update_jobs
+if not job_list:
+    logger.info("no job list, fetching all known jobs")
+    japi = JenkinsApi(host=jenkins_host)
+    job_list = japi.list_jobs()
+
+    # Update the active jobs and active hosts lists in the DB
+    logger.info("updating active jobs list in DB")
+    prev_jobs = jmdb.active_jobs()
+    jmdb.active_jobs(job_list=job_list)
+    logger.info("updating active hosts list in DB")
+    host_list = japi.list_hosts()
+    prev_hosts = jmdb.active_hosts()
+    jmdb.active_hosts(host_list=host_list)
+    if set(prev_jobs) != set(job_list) or set(prev_hosts) != set(host_list):
+        jmdb.change_stamp(bump=True)
+
+    # Since we're doing the full list, see if we need to force
+    # a default update of job stats.  A force update will ensure the
+    # job stats are maintained even if there are no recent builds for
+    # that job. (ENG-8959)
+    ts = jmdb.all_job_update_ts()
+    if int(time.time()) > ts:
+        force_default_job_update = True
+
+logger.info("job list: {}".format(job_list))
+logger.info("force_default_job_update: {}"
+            .format(force_default_job_update))
+
+run_start = time.time()
+builds_updated = 0
+jobs_updated = 0
+jobs_skipped = 0
+
+if executor is None:
     for job_name in job_list:
-        logger.info("process {}".format(job_name))
-
-        # Try to obtain the process lock
-        process_lock_name = "{}_process_lock".format(job_name)
-        process_lock_meta = {"reason": "locked by JenkinsJobAggregators for update_builds()"}
-        process_lock = MongoDBKeepAliveLock(db=jmdb.jenkins_db(), name=process_lock_name)
-        try:
-            process_lock.lock(meta=process_lock_meta)
-        except MongoDBKALockTimeout as e:
-            logger.info("timeout acquiring {}".format(process_lock_name))
+        updated = update_job(job_name=job_name,
+                             force_default_job_update=force_default_job_update)
+        if updated is None:
+            jobs_skipped += 1
             continue
-
-        jja = JenkinsJobAggregators(jenkins_host=jenkins_host,
-                                    job_name=job_name, jmdb=jmdb,
-                                    aggregator_plugins=aggregator_plugins.by_job(job_name=job_name),
-                                    postprocessor_plugins=postprocessor_plugins.by_job(job_name=job_name))
-        jja.update_builds(test_builds=args.test_builds,
-                          test_data_path=args.test_data_path,
-                          force_default_job_update=force_default_job_update)
-        process_lock.unlock()
-
-    if force_default_job_update:
-        next_force = int(time.time() + (cfg.get('ALL_JOB_UPDATE_FREQ_HR')*3600))
-        logger.info("set next force_default_job_update: {}".format(next_force))
-        jmdb.all_job_update_ts(ts=next_force)
-
-
-except Exception as e:
-    # XXXrs - FUTURE - context manager for keep-alive lock
-    if process_lock is not None:
-        process_lock.unlock()
-    raise
+        jobs_updated += 1
+        builds_updated += updated
+else:
+    with executor:
+        futures = {executor.submit(update_job,
+                                   job_name=job_name,
+                                   force_default_job_update=force_default_job_update,
+                                   in_worker_process=(worker_mode == 'process')): job_name
+                   for job_name in job_list}
+        for future in concurrent.futures.as_completed(futures):
+            # Any exception is re-raised here, as with serial processing.
+            updated = future.result()
+            if updated is None:
+                jobs_skipped += 1
+                continue
+            jobs_updated += 1
+            builds_updated += updated
+
+if force_default_job_update:
+    next_force = int(time.time() + (cfg.get('ALL_JOB_UPDATE_FREQ_HR')*3600))
+    logger.info("set next force_default_job_update: {}".format(next_force))
+    jmdb.all_job_update_ts(ts=next_force)
+
+elapsed = time.time()-run_start
+rate = 0
+if elapsed > 0:
+    rate = builds_updated/elapsed
+logger.info("updated {} builds in {} jobs ({} jobs skipped) in {:.1f}s: {:.2f} builds/sec"
+            .format(builds_updated, jobs_updated, jobs_skipped, elapsed, rate))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# Copyright 2020 Xcalar, Inc. All rights reserved.
+#
+# No use, or distribution, of this source code is permitted in any form or
+# means without a valid, written license agreement with Xcalar, Inc.
+# Please refer to the included "COPYING" file for terms and conditions
+# regarding the use and redistribution of this software.
+
+"""
+Statistics over multiple (typically overlapping) time windows of a job's
+builds, computed from a single fetch of the widest span.
+
+Periods are dictionaries {'label': <label>, 'start': <ms>, 'end': <ms>}
+selecting builds with start <= start_time_ms < end, the same as
+JenkinsAllJobIndex.builds_by_time().
+"""
+
+import bisect
+import logging
+import os
+import statistics
+import sys
+
+if __name__ == '__main__':
+    sys.path.append(os.environ.get('XLRINFRADIR', ''))
+
+
+class BuildWindows(object):
+    """
+    A job's builds spanning a set of periods, sorted by start time,
+    with each period's builds available as a slice.
+    """
+    def __init__(self, *, periods, builds):
+        """
+        Required parameters:
+            periods:    list of period dictionaries
+            builds:     builds (as from builds_by_time()) spanning the periods
+        """
+        self.logger = logging.getLogger(__name__)
+        self.periods = periods
+        self.builds = sorted(builds, key=lambda b: b['start_time_ms'])
+        self.starts = [b['start_time_ms'] for b in self.builds]
+        self.bounds = {}
+        for period in periods:
+            self.bounds[period['label']] = (bisect.bisect_left(self.starts, period['start']),
+                                            bisect.bisect_left(self.starts, period['end']))
+
+    @classmethod
+    def fetch(cls, *, alljob, job_name, periods):
+        """
+        Fetch the job's builds for all periods with one query.
+        """
+        start = min([p['start'] for p in periods])
+        end = max([p['end'] for p in periods])
+        builds = alljob.builds_by_time(start_time_ms=start, end_time_ms=end,
+                                       job_names=[job_name])
+        return cls(periods=periods, builds=builds.get('builds', []))
+
+    def window(self, *, label):
+        """
+        Return the builds in the labeled period.
+        """
+        lo, hi = self.bounds[label]
+        return self.builds[lo:hi]
+
+    def _prefix_sums(self, *, func):
+        sums = [0]
+        for bld in self.builds:
+            sums.append(sums[-1] + func(bld))
+        return sums
+
+    def result_stats(self):
+        """
+        Return per-period build result counts and durations:
+            {<label>: {'build_cnt': <all builds>,
+                       'pass_cnt': <SUCCESS builds>,
+                       'fail_cnt': <FAILURE builds>,
+                       'pass_total_duration_ms': <sum of SUCCESS durations>}, ...}
+
+        Computed from prefix sums, so each period costs O(1) after
+        a single pass over the builds.
+        """
+        passes = self._prefix_sums(func=lambda b: b.get('result') == 'SUCCESS')
+        fails = self._prefix_sums(func=lambda b: b.get('result') == 'FAILURE')
+        pass_durs = self._prefix_sums(
+                        func=lambda b: (b.get('duration_ms') or 0) if b.get('result') == 'SUCCESS' else 0)
+        rtn = {}
+        for label, (lo, hi) in self.bounds.items():
+            rtn[label] = {'build_cnt': hi-lo,
+                          'pass_cnt': passes[hi]-passes[lo],
+                          'fail_cnt': fails[hi]-fails[lo],
+                          'pass_total_duration_ms': pass_durs[hi]-pass_durs[lo]}
+        return rtn
+
+    def value_stats(self, *, values):
+        """
+        Summarize per-build named values over each period.
+
+        Required parameters:
+            values: function called once per build, returning a dictionary
+                    of name: value (or None to skip the build)
+
+        Returns:
+            {<name>: {<label>: {'count': <builds with a value>,
+                                'mean': <mean>,
+                                'stdev': <sample stdev> (only if count > 1),
+                                'min': <min>,
+                                'max': <max>}, ...}, ...}
+
+        Values are gathered once per build no matter how many periods
+        include it, grouped by name in build order so that each period's
+        values are a slice.  Means and deviations are computed with the
+        statistics module (exactly, so independent of ordering) to match
+        results of summarizing each period's builds separately.
+        """
+        by_name = {}
+        for idx, bld in enumerate(self.builds):
+            for name, val in (values(bld) or {}).items():
+                idxs, vals = by_name.setdefault(name, ([], []))
+                idxs.append(idx)
+                vals.append(val)
+
+        rtn = {}
+        for name, (idxs, vals) in by_name.items():
+            for label, (lo, hi) in self.bounds.items():
+                # Period's builds [lo, hi) -> this name's values
+                vlist = vals[bisect.bisect_left(idxs, lo):bisect.bisect_left(idxs, hi)]
+                if not vlist:
+                    continue
+                summary = {'count': len(vlist),
+                           'mean': statistics.mean(vlist),
+                           'min': min(vlist),
+                           'max': max(vlist)}
+                if len(vlist) > 1:
+                    summary['stdev'] = statistics.stdev(vlist)
+                rtn.setdefault(name, {})[label] = summary
+        return rtn
+
+
+# In-line "unit test"
+if __name__ == '__main__':
+    periods = [{'label': 'all', 'start': 0, 'end': 100},
+               {'label': 'early', 'start': 0, 'end': 50},
+               {'label': 'late', 'start': 50, 'end': 100}]
+    builds = [{'build_number': str(i), 'start_time_ms': t, 'result': r, 'duration_ms': d}
+              for i, (t, r, d) in enumerate([(90, 'SUCCESS', 10), (10, 'FAILURE', 20),
+                                             (50, 'SUCCESS', 30), (49, 'ABORTED', None),
+                                             (100, 'SUCCESS', 40)])]
+    bw = BuildWindows(periods=periods, builds=builds)
+    rs = bw.result_stats()
+    assert rs['all'] == {'build_cnt': 4, 'pass_cnt': 2, 'fail_cnt': 1, 'pass_total_duration_ms': 40}
+    assert rs['early'] == {'build_cnt': 2, 'pass_cnt': 0, 'fail_cnt': 1, 'pass_total_duration_ms': 0}
+    assert [b['start_time_ms'] for b in bw.window(label='late')] == [50, 90]
+
+    vs = bw.value_stats(values=lambda b: {'dur': b['duration_ms']} if b['duration_ms'] else None)
+    assert vs['dur']['all'] == {'count': 3, 'mean': 20, 'min': 10, 'max': 30,
+                                'stdev': statistics.stdev([10, 20, 30])}
+    assert 'stdev' not in vs['dur']['early']
+
+    # Agrees with summarizing each period's builds separately.
+    import random
+    rnd = random.Random(42)
+    many = [{'start_time_ms': rnd.randint(0, 999), 'v': rnd.random()*1e6+1e9,
+             'w': rnd.randint(-5, 5) if rnd.random() < 0.5 else None} for i in range(500)]
+    mperiods = [{'label': str(i), 'start': s, 'end': s+w}
+                for i, (s, w) in enumerate([(rnd.randint(0, 900), rnd.randint(1, 400))
+                                            for j in range(50)])]
+    mbw = BuildWindows(periods=mperiods, builds=many)
+    mvs = mbw.value_stats(values=lambda b: {k: b[k] for k in ['v', 'w'] if b[k] is not None})
+    for period in mperiods:
+        for name in ['v', 'w']:
+            vlist = [b[name] for b in mbw.window(label=period['label']) if b[name] is not None]
+            got = mvs.get(name, {}).get(period['label'], None)
+            if not vlist:
+                assert got is None
+                continue
+            expect = {'count': len(vlist), 'mean': statistics.mean(vlist),
+                      'min': min(vlist), 'max': max(vlist)}
+            if len(vlist) > 1:
+                expect['stdev'] = statistics.stdev(vlist)
+            assert got == expect
+    print("A-OK!")
@@ -7,6 +7,8 @@
 # Please refer to the included "COPYING" file for terms and conditions
 # regarding the use and redistribution of this software.
 
+import concurrent.futures
+import hashlib
 import json
 import logging
 import os
@@ -15,6 +17,7 @@ import re
 import requests
 import subprocess
 import sys
+import threading
 import time
 
 if __name__ == '__main__':
@@ -23,8 +26,11 @@ if __name__ == '__main__':
 # XXXrs - some magic to silence unwanted (?) security chatter...
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from urllib3.util.retry import Retry
+from requests.adapters import HTTPAdapter
 
 from py_common.env_configuration import EnvConfiguration
+from py_common.jenkins_api_cache import JenkinsBuildDiskCache, LRUTTLCache, iter_text_lines
 """
 CONFIG = EnvConfiguration({'JENKINS_HOST':     {'required': True,
                                                 'default': 'jenkins.int.xcalar.com'},
@@ -65,19 +71,90 @@ class JenkinsApiError(Exception):
     pass
 
 class JenkinsREST(object):
+
+    ENV_CONFIG = {'JENKINS_API_POOL_SIZE': {'required': True,
+                                            'type': EnvConfiguration.NUMBER,
+                                            'default': 16},
+                  'JENKINS_API_RETRIES': {'required': True,
+                                          'type': EnvConfiguration.NUMBER,
+                                          'default': 3},
+                  'JENKINS_API_RETRY_BACKOFF': {'required': True,
+                                                'type': EnvConfiguration.NUMBER,
+                                                'default': 0.5},
+                  'JENKINS_API_TIMEOUT_SEC': {'required': True,
+                                              'type': EnvConfiguration.NUMBER,
+                                              'default': 300}}
+
+    # One pooled (keep-alive) session per process, shared by all instances.
+    _session = None
+    _session_lock = threading.Lock()
+
     def __init__(self, *, host, url_root):
         self.logger = logging.getLogger(__name__)
         self.host = host
         self.url_root=url_root
-
-    def cmd(self, *, uri):
+        cfg = EnvConfiguration(JenkinsREST.ENV_CONFIG)
+        self.pool_size = int(cfg.get('JENKINS_API_POOL_SIZE'))
+        self.retries = int(cfg.get('JENKINS_API_RETRIES'))
+        self.backoff = cfg.get('JENKINS_API_RETRY_BACKOFF')
+        self.timeout = cfg.get('JENKINS_API_TIMEOUT_SEC')
+
+    def session(self):
+        with JenkinsREST._session_lock:
+            if JenkinsREST._session is None:
+                # Retry connection failures and (idempotent GET) server errors
+                # with exponential backoff.
+                retry = Retry(total=self.retries,
+                              backoff_factor=self.backoff,
+                              status_forcelist=[500, 502, 503, 504],
+                              raise_on_status=False)
+                adapter = HTTPAdapter(pool_connections=self.pool_size,
+                                      pool_maxsize=self.pool_size,
+                                      max_retries=retry)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.verify = False # XXXrs disable verify!
+                JenkinsREST._session = session
+            return JenkinsREST._session
+
+    def cmd(self, *, uri, params=None):
         url = "{}{}".format(self.url_root, uri)
-        self.logger.debug("GET URL: {}".format(url))
-        response = requests.get(url, verify=False) # XXXrs disable verify!
+        self.logger.debug("GET URL: {} params: {}".format(url, params))
+        response = self.session().get(url, params=params, timeout=self.timeout)
         if response.status_code != 200:
             return None
         return response.text
 
+    def stream(self, *, uri, params=None):
+        """
+        Issue a streaming GET.  Returns the (open) response, or None
+        on failure.  Caller is responsible for consuming or closing
+        the response.
+        """
+        url = "{}{}".format(self.url_root, uri)
+        self.logger.debug("GET (stream) URL: {} params: {}".format(url, params))
+        response = self.session().get(url, params=params, stream=True, timeout=self.timeout)
+        if response.status_code != 200:
+            response.close()
+            return None
+        if response.encoding is None:
+            response.encoding = 'utf-8'
+        return response
+
+    @staticmethod
+    def iter_lines(*, response, chunk_size=65536):
+        """
+        Generator yielding the lines of a streaming response's text,
+        split exactly as str.splitlines() would split the full text,
+        without ever holding more than a chunk (plus one line) in memory.
+        """
+        try:
+            yield from iter_text_lines(response.iter_content(chunk_size=chunk_size,
+                                                             decode_unicode=True))
+        finally:
+            response.close()
+
 class JenkinsJobInfo(object):
     def __init__(self, *, job_name, japi):
         self.logger = logging.getLogger(__name__)
@@ -121,14 +198,21 @@ class JenkinsBuildInfo(object):
     repo_from_branch_key_pat = re.compile(r"\A(.*)_GIT_BRANCH\Z")
     commit_sha_pat = re.compile(r"\A[0-9a-f]{40}\Z")
 
-    def __init__(self, *, job_name, build_number, japi, test_data=None):
+    def __init__(self, *, job_name, build_number, japi, test_data=None, data=None):
+        """
+        If data is passed (e.g. prefetched by JenkinsApi.get_build_data_many())
+        it is used in place of an initial load.
+        """
         self.logger = logging.getLogger(__name__)
         self.job_name = job_name
         self.build_number = build_number
         self.build_url = "{}/job/{}/{}".format(japi.url_root, job_name, build_number)
         self.japi = japi
         self.test_data = test_data
-        self.load()
+        if data:
+            self.data = data
+        else:
+            self.load()
 
     def load(self):
         if self.test_data:
@@ -236,10 +320,51 @@ class JenkinsBuildInfo(object):
 
         N.B.: assumes timestamp plugin in use
         """
+        cache = self.japi.disk_cache
+        text = cache.get_text(job_name=self.job_name,
+                              build_number=self.build_number,
+                              kind='console')
+        if text is not None:
+            return text
         text = self.japi.rest.cmd(uri="/job/{}/{}/timestamps/?appendlog"
                                       .format(self.job_name, self.build_number))
+        if text is not None and self._is_complete():
+            cache.put_text(job_name=self.job_name,
+                           build_number=self.build_number,
+                           kind='console', text=text)
         return text
 
+    def console_lines(self):
+        """
+        Streaming form of console().  Returns an iterator over the lines
+        of the timestamped console log (equivalent to console().splitlines())
+        or None if the log is not available.  The log is read from Jenkins
+        incrementally as the iterator is consumed.
+        """
+        cache = self.japi.disk_cache
+        lines = cache.get_lines(job_name=self.job_name,
+                                build_number=self.build_number,
+                                kind='console')
+        if lines is not None:
+            return lines
+        response = self.japi.rest.stream(uri="/job/{}/{}/timestamps/?appendlog"
+                                             .format(self.job_name, self.build_number))
+        if response is None:
+            return None
+        lines = JenkinsREST.iter_lines(response=response)
+        if cache.enabled and self._is_complete():
+            lines = cache.tee_lines(job_name=self.job_name,
+                                    build_number=self.build_number,
+                                    kind='console', lines=lines)
+        return lines
+
+    def _is_complete(self):
+        """
+        Is the build known to be complete (without refreshing)?
+        Only completed builds are immutable, and so cacheable.
+        """
+        return not self.data.get('building', True)
+
     def upstream(self):
         """
         Returns a list of dictionaries identifying upstream build(s):
@@ -286,13 +411,59 @@ class JenkinsBuildInfo(object):
 
 
 class JenkinsApi(object):
+
+    # Only the build data used by JenkinsBuildInfo are requested.
+    # Set JENKINS_API_BUILD_TREE empty to request everything.
+    ENV_CONFIG = {'JENKINS_API_BUILD_TREE':
+                    {'default': 'building,builtOn,timestamp,duration,result,number,'
+                                'actions[parameters[name,value],'
+                                'causes[upstreamProject,upstreamBuild]]'},
+                  'JENKINS_API_BUILD_CACHE_SIZE':
+                    {'required': True,
+                     'type': EnvConfiguration.NUMBER,
+                     'default': 1000},
+                  'JENKINS_API_BUILD_CACHE_DONE_TTL_SEC':
+                    {'required': True,
+                     'type': EnvConfiguration.NUMBER,
+                     'default': 86400},
+                  'JENKINS_API_BUILD_CACHE_PENDING_TTL_SEC':
+                    {'required': True,
+                     'type': EnvConfiguration.NUMBER,
+                     'default': 60},
+                  'JENKINS_API_JOB_CACHE_SIZE':
+                    {'required': True,
+                     'type': EnvConfiguration.NUMBER,
+                     'default': 256},
+                  'JENKINS_API_JOB_CACHE_TTL_SEC':
+                    {'required': True,
+                     'type': EnvConfiguration.NUMBER,
+                     'default': 300}}
+
     def __init__(self, *, host):
         self.logger = logging.getLogger(__name__)
         self.host = host
         self.url_root="https://{}".format(host)
         self.rest = JenkinsREST(host=host, url_root=self.url_root)
-        self.job_info_cache = {}
-        self.build_info_cache = {}
+        self.disk_cache = JenkinsBuildDiskCache(host=host)
+        cfg = EnvConfiguration(JenkinsApi.ENV_CONFIG)
+        self.build_tree = cfg.get('JENKINS_API_BUILD_TREE')
+        # Cached build data are as filtered by the tree, so key on it too.
+        self.build_cache_kind = 'build'
+        if self.build_tree:
+            self.build_cache_kind = "build:{}".format(
+                    hashlib.sha1(self.build_tree.encode('utf-8')).hexdigest())
+
+        # Completed builds don't change, so can be cached for a long time.
+        # Builds in progress (and job info, which changes as builds are
+        # started) only briefly.
+        self.build_done_ttl = cfg.get('JENKINS_API_BUILD_CACHE_DONE_TTL_SEC')
+        self.build_pending_ttl = cfg.get('JENKINS_API_BUILD_CACHE_PENDING_TTL_SEC')
+        self.build_info_cache = LRUTTLCache(name='build_info',
+                                            max_entries=cfg.get('JENKINS_API_BUILD_CACHE_SIZE'),
+                                            default_ttl=self.build_pending_ttl)
+        self.job_info_cache = LRUTTLCache(name='job_info',
+                                          max_entries=cfg.get('JENKINS_API_JOB_CACHE_SIZE'),
+                                          default_ttl=cfg.get('JENKINS_API_JOB_CACHE_TTL_SEC'))
 
     def list_jobs(self):
         jobs = []
@@ -338,18 +509,92 @@ class JenkinsApi(object):
             return jji
             return None
         jji = JenkinsJobInfo(job_name=job_name, japi=self)
-        self.job_info_cache[job_name] = jji
+        self.job_info_cache.put(job_name, jji)
         self.logger.debug("return: {}".format(jji))
         return jji
 
     def get_build_data(self, *, job_name, build_number):
         """
         Return dictionary of available build data from REST_API.
+        Data for completed builds are cached on disk (if enabled).
         """
-        text = self.rest.cmd(uri="/job/{}/{}/api/json".format(job_name, build_number))
+        text = self.disk_cache.get_text(job_name=job_name,
+                                        build_number=build_number,
+                                        kind=self.build_cache_kind)
+        if text:
+            return json.loads(text)
+        params = None
+        if self.build_tree:
+            params = {'tree': self.build_tree}
+        text = self.rest.cmd(uri="/job/{}/{}/api/json".format(job_name, build_number),
+                             params=params)
         if not text:
             return None
-        return json.loads(text)
+        data = json.loads(text)
+        if not data.get('building', True):
+            self.disk_cache.put_text(job_name=job_name,
+                                     build_number=build_number,
+                                     kind=self.build_cache_kind, text=text)
+        return data
+
+    def get_build_data_many(self, *, job_name, build_numbers, max_workers=None):
+        """
+        Fetch build data for multiple builds concurrently.
+
+        Returns dictionary of build number to build data (or None
+        if the data could not be fetched).
+        """
+        if max_workers is None:
+            max_workers = self.rest.pool_size
+        max_workers = max(1, min(max_workers, len(build_numbers)))
+        rtn = {}
+        if not build_numbers:
+            return rtn
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self.get_build_data,
+                                       job_name=job_name,
+                                       build_number=bnum): bnum
+                       for bnum in build_numbers}
+            for future in concurrent.futures.as_completed(futures):
+                bnum = futures[future]
+                try:
+                    rtn[bnum] = future.result()
+                except Exception:
+                    self.logger.exception("exception fetching job: {} build: {}"
+                                          .format(job_name, bnum))
+                    rtn[bnum] = None
+        return rtn
+
+    def prefetch_build_info(self, *, job_name, build_numbers):
+        """
+        Fetch data for multiple builds concurrently and populate
+        the build info cache so that subsequent get_build_info()
+        calls need not go to Jenkins.  Builds whose data could not
+        be fetched are skipped (and will be fetched on demand).
+        """
+        todo = [bnum for bnum in build_numbers
+                if "{}:{}".format(job_name, bnum) not in self.build_info_cache]
+        data = self.get_build_data_many(job_name=job_name, build_numbers=todo)
+        for bnum, bdata in data.items():
+            if not bdata:
+                continue
+            self._cache_build_info(jbi=JenkinsBuildInfo(job_name=job_name,
+                                                        build_number=bnum,
+                                                        japi=self,
+                                                        data=bdata))
+        self.logger.debug("prefetched {} of {} builds"
+                          .format(len([d for d in data.values() if d]), len(todo)))
+
+    def _cache_build_info(self, *, jbi):
+        key = "{}:{}".format(jbi.job_name, jbi.build_number)
+        ttl = self.build_done_ttl if jbi._is_complete() else self.build_pending_ttl
+        self.build_info_cache.put(key, jbi, ttl=ttl)
+
+    def cache_stats(self):
+        """
+        Return list of in-memory cache statistics dictionaries.
+        """
+        return [self.build_info_cache.stats(), self.job_info_cache.stats()]
 
     def get_build_info(self, *, job_name, build_number, test_data=None):
         """
@@ -365,7 +610,7 @@ class JenkinsApi(object):
                                build_number=build_number,
                                japi=self,
                                test_data=test_data)
-        self.build_info_cache[key] = jbi
+        self._cache_build_info(jbi=jbi)
         self.logger.debug("return info: {}".format(jbi))
         return jbi
 
@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 Xcalar, Inc. All rights reserved.
+#
+# No use, or distribution, of this source code is permitted in any form or
+# means without a valid, written license agreement with Xcalar, Inc.
+# Please refer to the included "COPYING" file for terms and conditions
+# regarding the use and redistribution of this software.
+
+from collections import OrderedDict
+import codecs
+import gzip
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+if __name__ == '__main__':
+    sys.path.append(os.environ.get('XLRINFRADIR', ''))
+
+from py_common.env_configuration import EnvConfiguration
+
+# zstandard is preferred (faster, smaller) but optional.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def iter_text_lines(chunks):
+    """
+    Generator yielding the lines of the text delivered as an iterable
+    of string chunks, split exactly as str.splitlines() would split the
+    full text, without holding more than a chunk (plus one line) in memory.
+    """
+    pending = ''
+    for chunk in chunks:
+        if not chunk:
+            continue
+        lines = (pending+chunk).splitlines(keepends=True)
+        # The last line may be incomplete (or be a '\r' whose
+        # '\n' is in the next chunk) so hold it back.
+        pending = lines.pop()
+        for line in lines:
+            yield (line.splitlines() or [''])[0]
+    if pending:
+        yield (pending.splitlines() or [''])[0]
+
+
+def iter_decoded(*, fh, chunk_size=65536):
+    """
+    Generator yielding utf-8 decoded string chunks read from a binary file object.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    while True:
+        data = fh.read(chunk_size)
+        if not data:
+            break
+        yield decoder.decode(data)
+    yield decoder.decode(b'', final=True)
+
+
+class LRUTTLCache(object):
+    """
+    Thread-safe in-memory cache bounded by number of entries and,
+    optionally, by total size (least recently used evicted first) with
+    a per-entry time-to-live.
+    Hit/miss/eviction/expiration counts are kept for logging.
+    """
+    def __init__(self, *, name, max_entries, default_ttl, max_bytes=None, sizeof=len):
+        """
+        Optional parameters:
+            max_bytes:  bound on the total sizeof() of cached values
+                        (a value larger than this is not cached)
+            sizeof:     function returning the size of a value
+        """
+        self.name = name
+        self.max_entries = max(1, int(max_entries))
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() # key -> (expires, value, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _remove(self, key):
+        # Caller holds lock
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires, value, size = entry
+            if expires <= time.time():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.default_ttl
+        size = 0
+        if self.max_bytes is not None:
+            size = self.sizeof(value)
+        with self.lock:
+            self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self.entries[key] = (time.time()+ttl, value, size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or \
+                  (self.max_bytes is not None and self.bytes > self.max_bytes):
+                self.bytes -= self.entries.popitem(last=False)[1][2]
+                self.evictions += 1
+
+    def __contains__(self, key):
+        """
+        Membership test (does not count as a hit or miss).
+        """
+        with self.lock:
+            entry = self.entries.get(key, None)
+            return entry is not None and entry[0] > time.time()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {'name': self.name,
+                    'size': len(self.entries),
+                    'bytes': self.bytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'expirations': self.expirations}
+
+
+class _CacheWriter(object):
+    """
+    Incrementally write a compressed cache entry to a temporary file,
+    atomically renamed into place on commit().  Cache write failures are
+    logged and otherwise ignored.
+    """
+    def __init__(self, *, cache, path):
+        self.logger = logging.getLogger(__name__)
+        self.cache = cache
+        self.path = path
+        self.tmp_path = None
+        self.fh = None
+        self.writer = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            self.fh = os.fdopen(fd, 'wb')
+            if zstandard is not None:
+                self.writer = zstandard.ZstdCompressor(level=10).stream_writer(self.fh)
+            else:
+                self.writer = gzip.GzipFile(fileobj=self.fh, mode='wb')
+        except Exception:
+            self.logger.warning("cache write failed: {}".format(path), exc_info=True)
+            self.abort()
+
+    def write(self, text):
+        if self.writer is None:
+            return
+        try:
+            self.writer.write(text.encode('utf-8'))
+        except Exception:
+            self.logger.warning("cache write failed: {}".format(self.path), exc_info=True)
+            self.abort()
+
+    def commit(self):
+        if self.writer is None:
+            return
+        try:
+            if zstandard is not None:
+                self.writer.flush(zstandard.FLUSH_FRAME)
+            else:
+                self.writer.close()
+            self.fh.close()
+            os.replace(self.tmp_path, self.path)
+            self.tmp_path = None
+            self.writer = None
+            self.cache._added(path=self.path)
+        except Exception:
+            self.logger.warning("cache write failed: {}".format(self.path), exc_info=True)
+            self.abort()
+
+    def abort(self):
+        self.writer = None
+        if self.fh is not None:
+            try:
+                self.fh.close()
+            except Exception:
+                pass
+            self.fh = None
+        if self.tmp_path is not None:
+            try:
+                os.unlink(self.tmp_path)
+            except OSError:
+                pass
+            self.tmp_path = None
+
+
+class JenkinsBuildDiskCache(object):
+    """
+    Size-bounded on-disk cache of compressed completed-build data
+    (build JSON, console logs) keyed by job name and build number.
+
+    Completed builds are immutable, so entries never expire; when the
+    cache exceeds its size limit the least recently used entries (by
+    file mtime, refreshed on every hit) are evicted.
+
+    Disabled unless JENKINS_API_CACHE_DIR is set.
+    """
+
+    ENV_CONFIG = {'JENKINS_API_CACHE_DIR': {'required': False},
+                  'JENKINS_API_CACHE_MAX_MB': {'required': True,
+                                               'type': EnvConfiguration.NUMBER,
+                                               'default': 4096}}
+
+    # Evict down to this fraction of the maximum size.
+    EVICT_TO = 0.9
+
+    # Current cache size by directory, shared by all instances in the process.
+    _sizes = {}
+    _sizes_lock = threading.Lock()
+
+    def __init__(self, *, host, cache_dir=None, max_mb=None):
+        self.logger = logging.getLogger(__name__)
+        cfg = EnvConfiguration(JenkinsBuildDiskCache.ENV_CONFIG)
+        if cache_dir is None:
+            cache_dir = cfg.get('JENKINS_API_CACHE_DIR')
+        if max_mb is None:
+            max_mb = cfg.get('JENKINS_API_CACHE_MAX_MB')
+        self.max_bytes = int(max_mb*1024*1024)
+        self.dir = None
+        if cache_dir:
+            self.dir = os.path.join(cache_dir, host)
+        self.suffix = '.zst' if zstandard is not None else '.gz'
+
+    @property
+    def enabled(self):
+        return self.dir is not None
+
+    def _path(self, *, job_name, build_number, kind):
+        key = "{}:{}:{}".format(job_name, build_number, kind)
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.dir, digest[:2], digest+self.suffix)
+
+    def _open(self, *, path):
+        fh = open(path, 'rb')
+        if zstandard is not None:
+            return zstandard.ZstdDecompressor().stream_reader(fh)
+        return gzip.GzipFile(fileobj=fh, mode='rb')
+
+    def _discard(self, *, path):
+        self.logger.warning("discarding bad cache entry: {}".format(path), exc_info=True)
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def _hit(self, *, path):
+        """
+        Open the entry (if present) and mark it recently used.
+        """
+        try:
+            reader = self._open(path=path)
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return reader
+
+    def get_text(self, *, job_name, build_number, kind):
+        """
+        Return the cached text, or None if not cached.
+        """
+        if not self.enabled:
+            return None
+        path = self._path(job_name=job_name, build_number=build_number, kind=kind)
+        reader = self._hit(path=path)
+        if reader is None:
+            return None
+        try:
+            with reader:
+                return ''.join(iter_decoded(fh=reader))
+        except Exception:
+            self._discard(path=path)
+            return None
+
+    def get_lines(self, *, job_name, build_number, kind):
+        """
+        Return an iterator over the lines of the cached text
+        (as from str.splitlines()) or None if not cached.
+        """
+        if not self.enabled:
+            return None
+        path = self._path(job_name=job_name, build_number=build_number, kind=kind)
+        reader = self._hit(path=path)
+        if reader is None:
+            return None
+
+        def lines():
+            try:
+                with reader:
+                    yield from iter_text_lines(iter_decoded(fh=reader))
+            except Exception:
+                # Remove it so that a retry will re-fetch.
+                self._discard(path=path)
+                raise
+        return lines()
+
+    def put_text(self, *, job_name, build_number, kind, text):
+        if not self.enabled:
+            return
+        path = self._path(job_name=job_name, build_number=build_number, kind=kind)
+        writer = _CacheWriter(cache=self, path=path)
+        writer.write(text)
+        writer.commit()
+
+    def tee_lines(self, *, job_name, build_number, kind, lines):
+        """
+        Pass through the given lines, caching them as they go.
+        The entry is only added if the lines are consumed to the end.
+        """
+        if not self.enabled:
+            yield from lines
+            return
+        path = self._path(job_name=job_name, build_number=build_number, kind=kind)
+        writer = _CacheWriter(cache=self, path=path)
+        done = False
+        try:
+            for line in lines:
+                writer.write(line+'\n')
+                yield line
+            writer.commit()
+            done = True
+        finally:
+            if not done:
+                writer.abort()
+
+    def _scan(self):
+        """
+        Return list of (mtime, size, path) for all cache entries.
+        """
+        entries = []
+        for root, dirs, files in os.walk(self.dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _added(self, *, path):
+        """
+        Account for a newly added entry, evicting if over the size limit.
+        """
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with JenkinsBuildDiskCache._sizes_lock:
+            total = JenkinsBuildDiskCache._sizes.get(self.dir, None)
+            if total is None:
+                # First addition by this process, so includes the new entry.
+                total = sum([e[1] for e in self._scan()])
+            else:
+                total += size
+            if total > self.max_bytes:
+                total = self._evict()
+            JenkinsBuildDiskCache._sizes[self.dir] = total
+
+    def _evict(self):
+        """
+        Remove least recently used entries until under the target size.
+        Returns the resulting size.
+
+        N.B.: Re-scans, so also corrects for other processes sharing the cache.
+        """
+        entries = sorted(self._scan())
+        total = sum([e[1] for e in entries])
+        target = int(self.max_bytes*JenkinsBuildDiskCache.EVICT_TO)
+        evicted = 0
+        for mtime, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        self.logger.info("evicted {} entries, cache size now {}".format(evicted, total))
+        return total
+
+
+# In-line "unit test"
+if __name__ == '__main__':
+    import shutil
+
+    logging.basicConfig(level=logging.INFO,
+                        format="'%(asctime)s - %(threadName)s - %(funcName)s - %(levelname)s - %(message)s",
+                        handlers=[logging.StreamHandler(sys.stdout)])
+
+    text = "line one\r\nline two\n\nline\rfour\n"
+    assert list(iter_text_lines([text[i:i+3] for i in range(0, len(text), 3)])) == text.splitlines()
+
+    lru = LRUTTLCache(name='test', max_entries=2, default_ttl=60)
+    lru.put('a', 1)
+    lru.put('b', 2)
+    assert lru.get('a') == 1
+    lru.put('c', 3)     # evicts 'b' (least recently used)
+    assert lru.get('b') is None
+    lru.put('d', 4, ttl=-1)
+    assert lru.get('d') is None
+    assert lru.stats()['hits'] == 1 and lru.stats()['misses'] == 2
+
+    lru = LRUTTLCache(name='test', max_entries=10, default_ttl=60, max_bytes=10)
+    lru.put('a', b'12345')
+    lru.put('b', b'1234')
+    lru.put('c', b'123')        # evicts 'a' (over 10 bytes)
+    assert lru.get('a') is None and lru.get('b') == b'1234'
+    lru.put('d', b'12345678901')    # larger than max_bytes, not cached
+    assert lru.get('d') is None and lru.stats()['bytes'] == 7
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cache = JenkinsBuildDiskCache(host='test.host', cache_dir=tmpdir, max_mb=1)
+        assert cache.get_text(job_name='Job', build_number=1, kind='build') is None
+        cache.put_text(job_name='Job', build_number=1, kind='build', text='{"a": 1}')
+        assert cache.get_text(job_name='Job', build_number=1, kind='build') == '{"a": 1}'
+
+        lines = list(cache.tee_lines(job_name='Job', build_number=1, kind='console',
+                                     lines=iter(text.splitlines())))
+        assert lines == text.splitlines()
+        assert list(cache.get_lines(job_name='Job', build_number=1, kind='console')) == lines
+
+        # Abandoned tee is not cached.
+        gen = cache.tee_lines(job_name='Job', build_number=2, kind='console',
+                              lines=iter(text.splitlines()))
+        next(gen)
+        gen.close()
+        assert cache.get_lines(job_name='Job', build_number=2, kind='console') is None
+
+        # Incompressible data beyond the limit forces eviction.
+        for bnum in range(10, 20):
+            cache.put_text(job_name='Job', build_number=bnum, kind='build',
+                           text=os.urandom(256*1024).hex())
+        assert sum([e[1] for e in cache._scan()]) <= cache.max_bytes
+        print("A-OK!")
+    finally:
+        shutil.rmtree(tmpdir)
@@ -8,6 +8,8 @@
 # regarding the use and redistribution of this software.
 
 import datetime
+import functools
+import hashlib
 import logging
 import os
 import pprint
@@ -16,6 +18,7 @@ import random
 import re
 import statistics
 import sys
+import threading
 import time
 
 if __name__ == '__main__':
@@ -23,14 +26,28 @@ if __name__ == '__main__':
 
 from py_common.env_configuration import EnvConfiguration
 cfg = EnvConfiguration({'LOG_LEVEL': {'default': logging.DEBUG},
-                        'JENKINS_HOST': {'required': True}})
+                        'JENKINS_HOST': {'required': True},
+                        'JDQ_CACHE_TTL_SEC': {'type': EnvConfiguration.NUMBER,
+                                              'default': 300},
+                        'JDQ_CACHE_MAX_ENTRIES': {'type': EnvConfiguration.NUMBER,
+                                                  'default': 512},
+                        'JDQ_CACHE_MAX_BYTES': {'type': EnvConfiguration.NUMBER,
+                                                'default': 256*1024*1024},
+                        'JDQ_CACHE_MAX_ENTRY_BYTES': {'type': EnvConfiguration.NUMBER,
+                                                      'default': 16*1024*1024},
+                        'JDQ_CACHE_STAMP_CHECK_SEC': {'type': EnvConfiguration.NUMBER,
+                                                      'default': 10},
+                        'JDQ_CACHE_TIME_BUCKET_MS': {'type': EnvConfiguration.NUMBER,
+                                                     'default': 60000}})
 
+from py_common.jenkins_api_cache import LRUTTLCache
 from py_common.mongo import JenkinsMongoDB
 from py_common.jenkins_aggregators import JenkinsAllJobIndex
 from py_common.jenkins_aggregators import JenkinsJobDataCollection
 from py_common.jenkins_aggregators import JenkinsJobMetaCollection
 
-from flask import Flask, request, jsonify, json, abort, make_response
+from flask import Flask, Response, request, jsonify, json, abort, make_response
+from flask import stream_with_context
 from flask_cors import CORS, cross_origin
 
 # It's log, it's log... :)
@@ -48,6 +65,189 @@ jenkins_host = cfg.get('JENKINS_HOST')
 jmdb = JenkinsMongoDB()
 jdb = jmdb.jenkins_db()
 
+
+class ResponseCache(object):
+    """
+    Cache of successful responses keyed on endpoint and (normalized)
+    parameters.  Entries expire after a TTL and the whole cache is
+    dropped whenever the updater bumps the DB change stamp, which is
+    checked at most every JDQ_CACHE_STAMP_CHECK_SEC.
+
+    Values are (body, mimetype, etag).  The cache holds at most
+    JDQ_CACHE_MAX_BYTES of bodies, and bodies larger than
+    JDQ_CACHE_MAX_ENTRY_BYTES are not cached at all.
+    """
+    def __init__(self, *, jmdb):
+        self.logger = logging.getLogger(__name__)
+        self.jmdb = jmdb
+        self.cache = LRUTTLCache(name='jdq_responses',
+                                 max_entries=cfg.get('JDQ_CACHE_MAX_ENTRIES'),
+                                 default_ttl=cfg.get('JDQ_CACHE_TTL_SEC'),
+                                 max_bytes=cfg.get('JDQ_CACHE_MAX_BYTES'),
+                                 sizeof=lambda entry: len(entry[0]))
+        self.max_entry_bytes = cfg.get('JDQ_CACHE_MAX_ENTRY_BYTES')
+        self.stamp_check_sec = cfg.get('JDQ_CACHE_STAMP_CHECK_SEC')
+        self.lock = threading.Lock()
+        self.stamp = None
+        self.stamp_checked = 0
+
+    def _check_stamp(self):
+        with self.lock:
+            now = time.time()
+            if now - self.stamp_checked < self.stamp_check_sec:
+                return
+            self.stamp_checked = now
+            stamp = self.jmdb.change_stamp()
+            if stamp != self.stamp:
+                self.logger.info("change stamp {} -> {}, clearing {}"
+                                 .format(self.stamp, stamp, self.cache.stats()))
+                self.cache.clear()
+                self.stamp = stamp
+
+    def get(self, key):
+        """
+        Returns (value, stamp), value None if not cached.
+        """
+        self._check_stamp()
+        return self.cache.get(key), self.stamp
+
+    def put(self, key, value, *, stamp):
+        """
+        Cache value computed as of stamp (as returned by get()) unless
+        the cache has since been invalidated.
+        """
+        if len(value[0]) > self.max_entry_bytes:
+            self.logger.debug("not caching {} byte response {}".format(len(value[0]), key))
+            return
+        with self.lock:
+            if stamp != self.stamp:
+                return
+            self.cache.put(key, value)
+
+response_cache = ResponseCache(jmdb=jmdb)
+
+def _time_arg(name, default):
+    """
+    Return the named time (ms) argument (or default).
+    """
+    try:
+        return int(request.args.get(name, default))
+    except ValueError as e:
+        abort(400, str(e))
+
+def _cache_key(*, time_range):
+    """
+    Key of the request's response: endpoint, arguments and POST body.
+
+    Explicit times are keyed exactly, so a cached response never covers
+    a different range than requested.  A defaulted end time ("now") is
+    keyed by JDQ_CACHE_TIME_BUCKET_MS bucket, so such responses are at
+    most a bucket stale.
+    """
+    args = [(name, request.args.get(name)) for name in sorted(request.args.keys())]
+    if request.method == 'POST':
+        args.append(('body', hashlib.sha1(request.get_data()).hexdigest()))
+    if time_range and 'end_time_ms' not in request.args:
+        bucket_ms = max(1, int(cfg.get('JDQ_CACHE_TIME_BUCKET_MS')))
+        args.append(('end_time_bucket', str(int(time.time()*1000)//bucket_ms)))
+    return (request.path, tuple(args))
+
+def cached(*, time_range=False):
+    """
+    Decorator for GET (or POST, keyed also on the body) endpoints whose
+    result depends only on the request parameters and the DB contents.
+    Set time_range for endpoints taking start_time_ms/end_time_ms
+    (via _time_arg()).
+
+    Responses carry an ETag so that clients re-requesting an unchanged
+    response (If-None-Match) get an empty 304.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = _cache_key(time_range=time_range)
+            entry, stamp = response_cache.get(key)
+            if entry is None:
+                resp = func(*args, **kwargs)
+                if resp.status_code != 200 or resp.is_streamed:
+                    return resp
+                body = resp.get_data()
+                entry = (body, resp.mimetype, hashlib.sha1(body).hexdigest())
+                response_cache.put(key, entry, stamp=stamp)
+            body, mimetype, etag = entry
+            resp = make_response(body)
+            resp.mimetype = mimetype
+            resp.set_etag(etag)
+            resp.headers['Cache-Control'] = 'no-cache'
+            return resp.make_conditional(request)
+        return wrapper
+    return decorator
+
+# Optional ?stream=<format> for endpoints returning many builds:
+#   ndjson: one JSON document per line
+#   json:   the usual response, but sent in chunks as it's generated
+STREAM_FORMATS = ['ndjson', 'json']
+
+def _stream_arg():
+    fmt = request.args.get('stream', None)
+    if fmt is not None and fmt not in STREAM_FORMATS:
+        abort(400, 'stream must be one of {}'.format(STREAM_FORMATS))
+    return fmt
+
+def _stream_response(*, docs, fmt, key=None):
+    """
+    Streamed response of docs (an iterable, typically wrapping a
+    pymongo cursor) so that nothing is accumulated in memory.
+    For the json format, docs are sent as a list under key or, if
+    key is None, as an object keyed by each doc's _id.
+
+    The ndjson format ends with a trailer line {"_end": true, "count": <docs>}
+    or, if anything fails once streaming has started (and so too late for
+    an error status), {"_error": <message>}.  A response without either
+    was cut short.
+    """
+    if fmt == 'ndjson':
+        def generate():
+            count = 0
+            try:
+                for doc in docs:
+                    yield json.dumps(doc) + '\n'
+                    count += 1
+            except Exception as e:
+                logger.exception("streaming {} failed after {} docs".format(request.path, count))
+                yield json.dumps({'_error': str(e)}) + '\n'
+                return
+            yield json.dumps({'_end': True, 'count': count}) + '\n'
+        mimetype = 'application/x-ndjson'
+    else:
+        def generate():
+            if key is not None:
+                yield '{{{}: ['.format(json.dumps(key))
+            else:
+                yield '{'
+            sep = ''
+            for doc in docs:
+                if key is not None:
+                    yield sep + json.dumps(doc)
+                else:
+                    yield '{}{}: {}'.format(sep, json.dumps(str(doc['_id'])), json.dumps(doc))
+                sep = ','
+            yield ']}' if key is not None else '}'
+        mimetype = 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+def _json_arg(name):
+    """
+    Optional JSON encoded argument.
+    """
+    val = request.args.get(name, None)
+    if val is None:
+        return None
+    try:
+        return json.loads(val)
+    except Exception as e:
+        abort(400, str(e))
+
 methods=['GET']
 @app.route('/', methods=methods)
 @cross_origin()
@@ -59,6 +259,7 @@ def test_connection():
 
 @app.route('/jenkins_jobs', methods=methods)
 @cross_origin()
+@cached()
 def jenkins_jobs():
     jobs = []
     for job_name in jmdb.active_jobs():
@@ -70,6 +271,7 @@ def jenkins_jobs():
 
 @app.route('/jenkins_hosts', methods=methods)
 @cross_origin()
+@cached()
 def jenkins_hosts():
     hosts = []
     for host_name in jmdb.active_hosts():
@@ -99,6 +301,7 @@ def _get_upstream(*, job_name, build_number):
 
 @app.route('/jenkins_upstream', methods=methods)
 @cross_origin()
+@cached()
 def jenkins_upstream():
     """
     """
@@ -123,6 +326,7 @@ def _get_downstream(*, job_name, bnum, coll):
 
 @app.route('/jenkins_downstream', methods=methods)
 @cross_origin()
+@cached()
 def jenkins_downstream():
     """
     """
@@ -134,12 +338,23 @@ def jenkins_downstream():
     if not build_number:
         abort(400, 'missing upstream build_number')
 
-    alljob_idx = JenkinsAllJobIndex(jmdb=jmdb)
-    downstream = alljob_idx.downstream_jobs(job_name=job_name, bnum=build_number)
+    max_depth = request.args.get('max_depth', None)
+    mode = request.args.get('mode', 'bfs')
+    try:
+        if max_depth is not None:
+            max_depth = int(max_depth)
+        alljob_idx = JenkinsAllJobIndex(jmdb=jmdb)
+        downstream = alljob_idx.downstream_jobs(job_name=job_name,
+                                                bnum=build_number,
+                                                max_depth=max_depth,
+                                                mode=mode)
+    except ValueError as e:
+        abort(400, str(e))
     return make_response(jsonify(downstream))
 
 @app.route('/jenkins_find_builds', methods=methods)
 @cross_origin()
+@cached()
 def jenkins_find_builds():
     job_name = request.args.get('job_name', None)
     if not job_name:
@@ -158,43 +373,166 @@ def jenkins_find_builds():
     except Exception as e:
         abort(400, str(e))
 
+    fmt = _stream_arg()
+    try:
+        if fmt:
+            return _stream_response(docs=_iter_job_builds(job_name=job_name,
+                                                          query=query, proj=proj),
+                                    fmt=fmt)
+        found = _find_job_builds(job_name=job_name, query=query, proj=proj)
+        return make_response(jsonify(found))
+    except Exception as e:
+        abort(400, str(e))
+
+def _iter_job_builds(*, job_name, query, proj):
+    """
+    Generator yielding the job's builds matching query.
+    """
+    args = {}
+    if proj:
+        args['projection'] = proj
+    # XXXrs - assumes collection name! Fix!
+    for doc in jdb.db["job_{}".format(job_name)].find(query, **args):
+        logger.debug('doc: {}'.format(pprint.pformat(doc)))
+        doc['build_url'] = "http://{}/job/{}/{}/"\
+                           .format(jenkins_host, job_name, doc['_id'])
+        yield doc
+
+def _find_job_builds(*, job_name, query, proj):
+    """
+    Returns {<build_number>: <build data>, ...} of the job's builds
+    matching query.
+    """
+    return {doc['_id']: doc for doc in _iter_job_builds(job_name=job_name,
+                                                        query=query, proj=proj)}
+
+@app.route('/jenkins_builds_batch', methods=['GET', 'POST'])
+@cross_origin()
+@cached()
+def jenkins_builds_batch():
+    """
+    Find builds of many jobs with one request.  Parameters (JSON body
+    if POST, else JSON encoded args):
+        builds:     list of [job_name, build_number] pairs
+        job_names:  list of job names, each searched with...
+        query:      shared query (optional, default all builds)
+        projection: shared projection (optional)
+    At least one of builds or job_names is required.  Specific builds
+    are found with one $in query per job.
+
+    Returns {<job_name>: {<build_number>: <build data>, ...}, ...}
+    """
+    if request.method == 'POST':
+        params = request.get_json(silent=True) or {}
+    else:
+        params = {}
+        try:
+            for name in ['builds', 'job_names', 'query', 'projection']:
+                if name in request.args:
+                    params[name] = json.loads(request.args.get(name))
+        except Exception as e:
+            abort(400, str(e))
+
+    builds = params.get('builds', None) or []
+    job_names = params.get('job_names', None) or []
+    query = params.get('query', None) or {}
+    proj = params.get('projection', None) or {}
+    if not builds and not job_names:
+        abort(400, 'missing builds or job_names')
+    if not isinstance(builds, list) or not isinstance(job_names, list):
+        abort(400, 'builds and job_names must be lists')
+
+    by_job = {}
+    for item in builds:
+        try:
+            job_name, bnum = item
+        except (TypeError, ValueError):
+            abort(400, 'invalid build {}'.format(item))
+        by_job.setdefault(job_name, set()).add(str(bnum))
+
     try:
         found = {}
-        args = {}
-        if proj:
-            args['projection'] = proj
-        # XXXrs - assumes collection name! Fix!
-        for doc in jdb.db["job_{}".format(job_name)].find(query, **args):
-            logger.debug('doc: {}'.format(pprint.pformat(doc)))
-            doc['build_url'] = "http://{}/job/{}/{}/"\
-                               .format(jenkins_host, job_name, doc['_id'])
-            found[doc['_id']] = doc
+        for job_name, bnums in by_job.items():
+            found[job_name] = _find_job_builds(job_name=job_name,
+                                               query={'_id': {'$in': sorted(bnums)}},
+                                               proj=proj)
+        for job_name in job_names:
+            job_found = found.setdefault(job_name, {})
+            job_found.update(_find_job_builds(job_name=job_name, query=query, proj=proj))
         return make_response(jsonify(found))
     except Exception as e:
         abort(400, str(e))
 
 @app.route('/jenkins_builds_by_time', methods=methods)
 @cross_origin()
+@cached(time_range=True)
 def jenkins_builds_by_time():
-    start_time_ms = int(request.args.get('start_time_ms', 0))
-    end_time_ms = int(request.args.get('end_time_ms', time.time()*1000))
+    start_time_ms = _time_arg('start_time_ms', 0)
+    end_time_ms = _time_arg('end_time_ms', time.time()*1000)
+    projection = _json_arg('projection')
+    fmt = _stream_arg()
     alljob_idx = JenkinsAllJobIndex(jmdb=jmdb)
-    return make_response(jsonify(alljob_idx.builds_by_time(
-                                    start_time_ms=start_time_ms,
-                                    end_time_ms=end_time_ms)))
+    builds = alljob_idx.iter_builds_by_time(start_time_ms=start_time_ms,
+                                            end_time_ms=end_time_ms,
+                                            projection=projection)
+    if fmt:
+        return _stream_response(docs=builds, fmt=fmt, key='builds')
+    return make_response(jsonify({'builds': list(builds)}))
 
 @app.route('/jenkins_builds_active_between', methods=methods)
 @cross_origin()
+@cached(time_range=True)
 def jenkins_builds_active_between():
-    start_time_ms = int(request.args.get('start_time_ms', 0))
-    end_time_ms = int(request.args.get('end_time_ms', time.time()*1000))
+    start_time_ms = _time_arg('start_time_ms', 0)
+    end_time_ms = _time_arg('end_time_ms', time.time()*1000)
+    projection = _json_arg('projection')
+    fmt = _stream_arg()
+    alljob_idx = JenkinsAllJobIndex(jmdb=jmdb)
+    builds = alljob_idx.iter_builds_active_between(start_time_ms=start_time_ms,
+                                                   end_time_ms=end_time_ms,
+                                                   projection=projection)
+    if fmt:
+        return _stream_response(docs=builds, fmt=fmt, key='builds')
+    return make_response(jsonify({'builds': list(builds)}))
+
+def _job_names_arg():
+    """
+    Optional JSON list of job names.
+    """
+    job_names = _json_arg('job_names')
+    if job_names is None:
+        return None
+    if not isinstance(job_names, list):
+        abort(400, 'job_names must be a list')
+    return job_names
+
+@app.route('/jenkins_job_stats', methods=methods)
+@cross_origin()
+@cached(time_range=True)
+def jenkins_job_stats():
+    start_time_ms = _time_arg('start_time_ms', 0)
+    end_time_ms = _time_arg('end_time_ms', time.time()*1000)
+    alljob_idx = JenkinsAllJobIndex(jmdb=jmdb)
+    return make_response(jsonify(alljob_idx.job_stats(
+                                    start_time_ms=start_time_ms,
+                                    end_time_ms=end_time_ms,
+                                    job_names=_job_names_arg())))
+
+@app.route('/jenkins_job_rollup_stats', methods=methods)
+@cross_origin()
+@cached(time_range=True)
+def jenkins_job_rollup_stats():
+    start_time_ms = _time_arg('start_time_ms', 0)
+    end_time_ms = _time_arg('end_time_ms', time.time()*1000)
     alljob_idx = JenkinsAllJobIndex(jmdb=jmdb)
-    return make_response(jsonify(alljob_idx.builds_active_between(
+    return make_response(jsonify(alljob_idx.rollup_stats(
                                     start_time_ms=start_time_ms,
-                                    end_time_ms=end_time_ms)))
+                                    end_time_ms=end_time_ms,
+                                    job_names=_job_names_arg())))
 
 @app.route('/jenkins_job_parameters', methods=methods)
 @cross_origin()
+@cached()
 def jenkins_job_parameters():
     job_name = request.args.get('job_name', None)
     if not job_name:
@@ -204,12 +542,11 @@ def jenkins_job_parameters():
     # names and return.
 
     # N.B.: this will give latest completed job, not latest job seen which may
-    #       still be in progress, and is not yet in the "all_builds" list.
-    all_builds = JenkinsJobMetaCollection(job_name=job_name, jmdb=jmdb).all_builds()
-    if not all_builds:
+    #       still be in progress, and is not yet marked done.
+    latest_bnum = JenkinsJobMetaCollection(job_name=job_name, jmdb=jmdb).latest_build()
+    if not latest_bnum:
         return make_response(jsonify({}))
 
-    latest_bnum = sorted([int(n) for n in all_builds])[-1]
     latest = JenkinsJobDataCollection(job_name=job_name, jmdb=jmdb).get_data(bnum=str(latest_bnum))
     if not latest:
         return make_response(jsonify({}))
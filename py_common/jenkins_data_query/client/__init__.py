@@ -7,36 +7,227 @@
 # Please refer to the included "COPYING" file for terms and conditions
 # regarding the use and redistribution of this software.
 
+import concurrent.futures
+import contextlib
+import copy
 import json
 import logging
 import os
 import requests
+from requests.adapters import HTTPAdapter
 import sys
+import threading
 
 if __name__ == '__main__':
     sys.path.append(os.environ.get('XLRINFRADIR', ''))
 
 from py_common.env_configuration import EnvConfiguration
 
+
+class _InFlight(object):
+    """
+    A request being issued on behalf of (possibly) several callers.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+class JDQClientStreamError(Exception):
+    """
+    A streamed response failed, or ended early, on the server side.
+    """
+    pass
+
+
 class JDQClient(object):
+    """
+    Client for the Jenkins data query (JDQ) service.
+
+    Requests use a pooled (keep-alive) session and identical concurrent
+    requests are coalesced into one.  Within a scope() identical requests
+    are issued only once, and batch() issues calls concurrently.
+    """
+
+    ENV_CONFIG = {'JDQ_CLIENT_POOL_SIZE': {'required': True,
+                                           'type': EnvConfiguration.NUMBER,
+                                           'default': 16},
+                  'JDQ_CLIENT_WORKERS': {'required': True,
+                                         'type': EnvConfiguration.NUMBER,
+                                         'default': 8},
+                  'JDQ_CLIENT_TIMEOUT_SEC': {'required': True,
+                                             'type': EnvConfiguration.NUMBER,
+                                             'default': 120}}
 
     def __init__(self, * , host, port):
         self.logger = logging.getLogger(__name__)
         self.url_root="http://{}:{}".format(host, port)
         self.logger.debug(self.url_root)
+        cfg = EnvConfiguration(JDQClient.ENV_CONFIG)
+        pool_size = int(cfg.get('JDQ_CLIENT_POOL_SIZE'))
+        self.workers = int(cfg.get('JDQ_CLIENT_WORKERS'))
+        self.timeout = cfg.get('JDQ_CLIENT_TIMEOUT_SEC')
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.verify = False # XXXrs disable verify!
+
+        self.inflight = {}
+        self.inflight_lock = threading.Lock()
+        self.local = threading.local()
+        self.executor = None
+        self.executor_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def scope(self):
+        """
+        Context manager within which (in this thread, and in batch()
+        calls made from it) each distinct request is issued only once
+        and its result re-used.  Scopes nest (the outermost wins).
+        """
+        if getattr(self.local, 'memo', None) is not None:
+            yield
+            return
+        self.local.memo = {}
+        try:
+            yield
+        finally:
+            self.local.memo = None
+
+    def _get_executor(self):
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+            return self.executor
+
+    def batch(self, calls):
+        """
+        Issue calls (zero-argument callables, typically lambdas wrapping
+        client methods) concurrently.  Returns their results in order.
+        Any exception is re-raised in the caller.
+        """
+        calls = list(calls)
+        if len(calls) < 2 or getattr(self.local, 'in_batch', False):
+            # Nested batches run serially (avoids exhausting the pool).
+            return [call() for call in calls]
+        memo = getattr(self.local, 'memo', None)
 
-    def _cmd(self, *, uri, params=None):
+        def _run(call):
+            # Share the caller's scope (if any)
+            self.local.memo = memo
+            self.local.in_batch = True
+            try:
+                return call()
+            finally:
+                self.local.memo = None
+                self.local.in_batch = False
+
+        executor = self._get_executor()
+        futures = [executor.submit(_run, call) for call in calls]
+        return [future.result() for future in futures]
+
+    def _get(self, *, uri, params=None, data=None):
+        """
+        GET, or POST if there's (JSON) data.
+        """
         url = "{}{}".format(self.url_root, uri)
-        self.logger.debug("GET URL: {}".format(url))
-        if params:
-            self.logger.debug("GET PARAMS: {}".format(params))
-            response = requests.get(url, params=params, verify=False) # XXXrs disable verify!
+        if data is not None:
+            self.logger.debug("POST URL: {}".format(url))
+            response = self.session.post(url, params=params, json=data, timeout=self.timeout)
         else:
-            response = requests.get(url, verify=False) # XXXrs disable verify!
+            self.logger.debug("GET URL: {}".format(url))
+            if params:
+                self.logger.debug("GET PARAMS: {}".format(params))
+            response = self.session.get(url, params=params, timeout=self.timeout)
         if response.status_code != 200:
             return None
         return response.json()
 
+    def _iter(self, *, uri, params=None):
+        """
+        Generator yielding the documents of a streamed (NDJSON) response
+        as they arrive.  Not coalesced or memoized.
+
+        Raises requests.HTTPError if the server fails the request, and
+        JDQClientStreamError if the response reports a failure (or lacks
+        its trailer) after streaming started, so that failure can't be
+        mistaken for no (or all the) data.
+        """
+        params = dict(params or {})
+        params['stream'] = 'ndjson'
+        url = "{}{}".format(self.url_root, uri)
+        self.logger.debug("GET (stream) URL: {} params: {}".format(url, params))
+        response = self.session.get(url, params=params, stream=True, timeout=self.timeout)
+        try:
+            if response.status_code != 200:
+                self.logger.error("GET (stream) {} status {}"
+                                  .format(url, response.status_code))
+                response.raise_for_status()
+                # Not an error status, but still not what we asked for.
+                raise requests.HTTPError("GET (stream) {} status {}"
+                                         .format(url, response.status_code),
+                                         response=response)
+            count = 0
+            for line in response.iter_lines(chunk_size=65536):
+                if not line:
+                    continue
+                doc = json.loads(line.decode('utf-8'))
+                if '_error' in doc:
+                    raise JDQClientStreamError("GET (stream) {} failed after {} docs: {}"
+                                               .format(url, count, doc['_error']))
+                if doc.get('_end', False) is True:
+                    if doc.get('count') != count:
+                        raise JDQClientStreamError("GET (stream) {} got {} of {} docs"
+                                                   .format(url, count, doc.get('count')))
+                    return
+                count += 1
+                yield doc
+            raise JDQClientStreamError("GET (stream) {} ended early after {} docs"
+                                       .format(url, count))
+        finally:
+            response.close()
+
+    def _cmd(self, *, uri, params=None, data=None):
+        key = (uri, tuple(sorted([(k, str(v)) for k, v in (params or {}).items()])))
+        if data is not None:
+            key += (json.dumps(data, sort_keys=True),)
+
+        memo = getattr(self.local, 'memo', None)
+        if memo is not None and key in memo:
+            # Callers own their results, so hand out copies.
+            return copy.deepcopy(memo[key])
+
+        with self.inflight_lock:
+            call = self.inflight.get(key, None)
+            owner = call is None
+            if owner:
+                call = _InFlight()
+                self.inflight[key] = call
+
+        if owner:
+            try:
+                call.result = self._get(uri=uri, params=params, data=data)
+            except Exception as e:
+                call.exception = e
+            finally:
+                with self.inflight_lock:
+                    self.inflight.pop(key, None)
+                call.done.set()
+        else:
+            self.logger.debug("coalesced: {}".format(key))
+            call.done.wait()
+
+        if call.exception is not None:
+            raise call.exception
+        if memo is not None:
+            memo[key] = call.result
+        # call.result is shared with coalesced callers (still copying it)
+        # and the memo, so even the owner gets a copy it may mutate.
+        return copy.deepcopy(call.result)
+
     def job_names(self):
         """
         Returns list of all active job names.
@@ -77,8 +268,12 @@ class JDQClient(object):
         params = {'job_name': job_name, 'build_number': bnum}
         return self._cmd(uri = '/jenkins_upstream', params = params)
 
-    def downstream(self, *, job_name, bnum):
+    def downstream(self, *, job_name, bnum, max_depth=None, mode=None):
         params = {'job_name': job_name, 'build_number': bnum}
+        if max_depth is not None:
+            params['max_depth'] = max_depth
+        if mode is not None:
+            params['mode'] = mode
         return self._cmd(uri = '/jenkins_downstream', params = params)
 
     def find_builds(self, *, job_name, query, projection=None):
@@ -89,6 +284,38 @@ class JDQClient(object):
         rtn = self._cmd(uri = '/jenkins_find_builds', params = params)
         return rtn
 
+    def iter_find_builds(self, *, job_name, query, projection=None):
+        """
+        Generator form of find_builds() yielding each build's data
+        (build number is the '_id') as it arrives.
+        """
+        params = {'job_name': job_name, 'query': json.dumps(query)}
+        if projection is not None:
+            params['projection'] = json.dumps(projection)
+        return self._iter(uri = '/jenkins_find_builds', params = params)
+
+    def find_builds_batch(self, *, builds=None, job_names=None, query=None, projection=None):
+        """
+        Find builds of many jobs with one request:
+            builds:     iterable of (job_name, build_number) pairs
+            job_names:  iterable of job names, each searched with query
+            query:      shared query for job_names (default all builds)
+            projection: shared projection
+        Returns {<job_name>: {<build_number>: <build data>, ...}, ...}
+        """
+        data = {}
+        if builds:
+            data['builds'] = [[job_name, str(bnum)] for job_name, bnum in builds]
+        if job_names:
+            data['job_names'] = list(job_names)
+        if query is not None:
+            data['query'] = query
+        if projection is not None:
+            data['projection'] = projection
+        if not data.get('builds') and not data.get('job_names'):
+            return {}
+        return self._cmd(uri = '/jenkins_builds_batch', data = data)
+
     def builds_by_time(self, *, start_time_ms, end_time_ms):
         params = {'start_time_ms': start_time_ms, 'end_time_ms': end_time_ms}
         return self._cmd(uri = '/jenkins_builds_by_time', params = params)
@@ -97,6 +324,44 @@ class JDQClient(object):
         params = {'start_time_ms': start_time_ms, 'end_time_ms': end_time_ms}
         return self._cmd(uri = '/jenkins_builds_active_between', params = params)
 
+    def iter_builds_by_time(self, *, start_time_ms, end_time_ms, projection=None):
+        """
+        Generator form of builds_by_time() yielding builds as they arrive.
+        """
+        params = {'start_time_ms': start_time_ms, 'end_time_ms': end_time_ms}
+        if projection is not None:
+            params['projection'] = json.dumps(projection)
+        return self._iter(uri = '/jenkins_builds_by_time', params = params)
+
+    def iter_builds_active_between(self, *, start_time_ms, end_time_ms, projection=None):
+        """
+        Generator form of builds_active_between() yielding builds as they arrive.
+        """
+        params = {'start_time_ms': start_time_ms, 'end_time_ms': end_time_ms}
+        if projection is not None:
+            params['projection'] = json.dumps(projection)
+        return self._iter(uri = '/jenkins_builds_active_between', params = params)
+
+    def job_stats(self, *, start_time_ms, end_time_ms, job_names=None):
+        """
+        Returns server-side summary (per job, per result) of builds started
+        in the time period.  See JenkinsAllJobIndex.job_stats()
+        """
+        params = {'start_time_ms': start_time_ms, 'end_time_ms': end_time_ms}
+        if job_names is not None:
+            params['job_names'] = json.dumps(list(job_names))
+        return self._cmd(uri = '/jenkins_job_stats', params = params)
+
+    def job_rollup_stats(self, *, start_time_ms, end_time_ms, job_names=None):
+        """
+        As job_stats(), but for completed builds only and computed from
+        pre-aggregated rollups.  See JenkinsAllJobIndex.rollup_stats()
+        """
+        params = {'start_time_ms': start_time_ms, 'end_time_ms': end_time_ms}
+        if job_names is not None:
+            params['job_names'] = json.dumps(list(job_names))
+        return self._cmd(uri = '/jenkins_job_rollup_stats', params = params)
+
 if __name__ == '__main__':
     import pprint
     import time
@@ -9,6 +9,7 @@
 
 import copy
 import datetime
+import functools
 import logging
 import os
 import pytz
@@ -63,6 +64,18 @@ def test_connection():
     """
     return "Connection check A-OK!"
 
+def jdq_scoped(func):
+    """
+    Decorator running a request handler within a JDQClient scope, so
+    repeated identical JDQ queries made while handling one request
+    are issued only once.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with jdq_client.scope():
+            return func(*args, **kwargs)
+    return wrapper
+
 def _parse_multi(multi):
     if '|' in multi:
         return [s.replace('\.', '.') for s in multi.strip('()').split('|')]
@@ -70,6 +83,7 @@ def _parse_multi(multi):
 
 @app.route('/search', methods=methods)
 @cross_origin()
+@jdq_scoped
 def find_metrics():
     """
     /search used by the find metric options on the query tab in panels and variables.
@@ -97,8 +111,10 @@ def find_metrics():
     elif 'parameter_names:' in target:
         pfx, jobs = target.split(':')
         job_names = _parse_multi(jobs)
-        for job_name in job_names:
-            for p_name in jdq_client.parameter_names(job_name=job_name):
+        calls = [functools.partial(jdq_client.parameter_names, job_name=job_name)
+                 for job_name in job_names]
+        for p_names in jdq_client.batch(calls):
+            for p_name in p_names:
                 if p_name not in values:
                     values.append(p_name)
     else:
@@ -209,13 +225,19 @@ def _timeserie_results(*, target, from_ms, to_ms):
 
 def _all_jobs_table(*, from_ms, to_ms):
 
-    # Only show info for active jobs...
-    active_jobs = jdq_client.job_names()
-
     # XXXrs - FUTURE will store end_time_ms so may have a query
     #         to show all builds overlapping time frame, not just
     #         starting in time frame.
-    resp = jdq_client.builds_by_time(start_time_ms=from_ms, end_time_ms=to_ms)
+    #
+    # Counts and durations are summarized by the server from rollups.
+    # Only completed builds are included, which is all that's reported.
+    #
+    # Only show info for active jobs...
+    active_jobs, resp = jdq_client.batch([
+                            jdq_client.job_names,
+                            functools.partial(jdq_client.job_rollup_stats,
+                                              start_time_ms=from_ms,
+                                              end_time_ms=to_ms)])
     job_info = {}
     job_info_empty = {'pass_cnt':0,
                       'pass_total_duration_ms':0,
@@ -225,22 +247,22 @@ def _all_jobs_table(*, from_ms, to_ms):
                       'fail_avg_duration_s':0,
                       'abort_cnt':0}
 
-    for bld in resp['builds']:
-        job_name = bld.get('job_name')
+    for row in resp['stats']:
+        job_name = row.get('job_name')
         if job_name not in active_jobs:
             continue
 
         jinfo = job_info.setdefault(job_name, copy.deepcopy(job_info_empty))
 
-        result = bld.get('result', 'MISSING')
+        result = row.get('result', 'MISSING')
         if result == 'SUCCESS':
-            jinfo['pass_cnt'] += 1
-            jinfo['pass_total_duration_ms'] += bld.get('duration_ms', 0)
+            jinfo['pass_cnt'] += row['count']
+            jinfo['pass_total_duration_ms'] += row['total_duration_ms']
         elif result == 'FAILURE':
-            jinfo['fail_cnt'] += 1
-            jinfo['fail_total_duration_ms'] += bld.get('duration_ms', 0)
+            jinfo['fail_cnt'] += row['count']
+            jinfo['fail_total_duration_ms'] += row['total_duration_ms']
         elif result == 'ABORTED':
-            jinfo['abort_cnt'] += 1
+            jinfo['abort_cnt'] += row['count']
 
     # Calculate the averages
     for job_name, info in job_info.items():
@@ -437,16 +459,16 @@ def _job_table(*, job_names, parameter_names, from_ms, to_ms):
     query = {'$and': [{'start_time_ms':{'$gt': from_ms}},
                       {'start_time_ms':{'$lt': to_ms}}]}
 
+    projection = {'start_time_ms': 1,
+                  'duration_ms': 1,
+                  'built_on': 1,
+                  'host_metrics': 1,
+                  'result': 1,
+                  'parameters': 1}
+    found = jdq_client.find_builds_batch(job_names=job_names, query=query,
+                                         projection=projection) or {}
     for job_name in job_names:
-        resp = jdq_client.find_builds(job_name=job_name,
-                                      query=query,
-                                      projection={'start_time_ms': 1,
-                                                  'duration_ms': 1,
-                                                  'built_on': 1,
-                                                  'host_metrics': 1,
-                                                  'result': 1,
-                                                  'parameters': 1})
-        for bnum,item in resp.items():
+        for bnum,item in found.get(job_name, {}).items():
             duration_s = int(item.get('duration_ms', 0)/1000)
             (avg_idle, avg_user, avg_system) = _host_metrics(item=item)
             vals = [job_name,
@@ -483,19 +505,20 @@ def _downstream_jobs_table(*, job_name, build_number):
     ds_items = down.get('downstream', [])
     if not ds_items:
         return [{"columns": columns, "rows": rows, "type" : "table"}]
+    projection = {'duration_ms': 1,
+                  'start_time_ms': 1,
+                  'built_on': 1,
+                  'host_metrics': 1,
+                  'result': 1}
+    found = jdq_client.find_builds_batch(builds=[(item.get('job_name'), item.get('build_number'))
+                                                 for item in ds_items],
+                                         projection=projection) or {}
     for item in ds_items:
         name = item.get('job_name')
         bnum = item.get('build_number')
-        detail = jdq_client.find_builds(job_name=name,
-                                        query={'_id': bnum},
-                                        projection={'duration_ms': 1,
-                                                    'start_time_ms': 1,
-                                                    'built_on': 1,
-                                                    'host_metrics': 1,
-                                                    'result': 1})
-        if bnum not in detail:
+        detail = found.get(name, {}).get(bnum, None)
+        if detail is None:
             continue
-        detail = detail[bnum]
         duration_s = int(detail.get('duration_ms', 0)/1000)
         (avg_idle, avg_user, avg_system) = _host_metrics(item=detail)
         vals = [name,
@@ -520,8 +543,11 @@ def _host_util_table(*, from_ms, to_ms):
                {"text":"Total Build Time (s)", "type":"number"},
                {"text":"Utilization %", "type":"number"}]
 
-    builds = jdq_client.builds_active_between(
-                        start_time_ms=from_ms, end_time_ms=to_ms)
+    builds, host_names = jdq_client.batch([
+                            functools.partial(jdq_client.builds_active_between,
+                                              start_time_ms=from_ms,
+                                              end_time_ms=to_ms),
+                            jdq_client.host_names])
 
     host_data = {}
     for build in builds['builds']:
@@ -546,7 +572,7 @@ def _host_util_table(*, from_ms, to_ms):
         data['builds'] += 1
         data['build_time_ms'] += (end_ms-start_ms)
 
-    for host in jdq_client.host_names():
+    for host in host_names:
         if host not in host_data:
             rows.append([host, 0, 0, 0])
             continue
@@ -602,6 +628,7 @@ def _host_history_table(*, host_names, from_ms, to_ms):
 
 @app.route('/query', methods=methods)
 @cross_origin(max_age=600)
+@jdq_scoped
 def query_metrics():
     """
     /query should return metrics based on input.
@@ -648,8 +675,11 @@ def query_metrics():
 
     results = []
     if data_format == 'timeserie':
-        for target in req['targets']:
-            results.extend(_timeserie_results(target=target, from_ms=from_ts_ms, to_ms=to_ts_ms))
+        calls = [functools.partial(_timeserie_results, target=target,
+                                   from_ms=from_ts_ms, to_ms=to_ts_ms)
+                 for target in req['targets']]
+        for target_results in jdq_client.batch(calls):
+            results.extend(target_results)
         return jsonify(results)
 
     if data_format != 'table':
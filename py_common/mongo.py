@@ -14,7 +14,9 @@ import threading
 import time
 import uuid
 
-from pymongo import MongoClient, WriteConcern, ReturnDocument
+from pymongo import ASCENDING, MongoClient, WriteConcern, ReturnDocument
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
 from pymongo.errors import ConnectionFailure
 from pymongo.errors import DuplicateKeyError
 
@@ -83,6 +85,126 @@ class MongoDB(object):
         return key.replace('__dot__', '.')
 
 
+class MongoDBWriteBuffer(object):
+    """
+    Accumulates write operations, by collection, to be applied later
+    using one unordered bulk_write() per collection.
+
+    Nothing is written until flush() is called, so a caller can abandon
+    a partially constructed set of writes (e.g. on error) by simply
+    dropping the buffer.  Buffers may be merged into a larger buffer
+    to batch the writes of several units of work (e.g. builds).
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.colls = {}
+        self.ops = {}
+        # Per collection, {index in ops: (filter, update)} of update_once() ops
+        self.once = {}
+        self.merged = 0
+
+    def _add(self, *, coll, op):
+        # Caller holds lock
+        self.colls.setdefault(coll.name, coll)
+        ops = self.ops.setdefault(coll.name, [])
+        ops.append(op)
+        return len(ops)-1
+
+    def update_one(self, *, coll, filter, update, upsert=False):
+        with self.lock:
+            self._add(coll=coll, op=UpdateOne(filter, update, upsert=upsert))
+
+    def update_once(self, *, coll, filter, update):
+        """
+        Upsert that is to be applied at most once: filter must also
+        exclude documents the update has already been applied to (e.g.
+        {'_id': key, 'applied': {'$ne': token}} with update adding token
+        to 'applied').  If it has been applied, the upsert collides with
+        the existing _id and the update is (silently) dropped.
+        """
+        with self.lock:
+            idx = self._add(coll=coll, op=UpdateOne(filter, update, upsert=True))
+            self.once.setdefault(coll.name, {})[idx] = (filter, update)
+
+    def replace_one(self, *, coll, filter, doc, upsert=False):
+        with self.lock:
+            self._add(coll=coll, op=ReplaceOne(filter, doc, upsert=upsert))
+
+    def op_count(self):
+        with self.lock:
+            return sum([len(ops) for ops in self.ops.values()])
+
+    def merge(self, *, wbuf):
+        """
+        Move all operations from wbuf into this buffer.
+        Returns the number of buffers merged so far.
+        """
+        with wbuf.lock:
+            colls = wbuf.colls
+            ops = wbuf.ops
+            once = wbuf.once
+            wbuf.colls = {}
+            wbuf.ops = {}
+            wbuf.once = {}
+        with self.lock:
+            for name, coll in colls.items():
+                self.colls.setdefault(name, coll)
+                my_ops = self.ops.setdefault(name, [])
+                offset = len(my_ops)
+                my_ops.extend(ops[name])
+                my_once = self.once.setdefault(name, {})
+                for idx, item in once.get(name, {}).items():
+                    my_once[offset+idx] = item
+            self.merged += 1
+            return self.merged
+
+    def flush(self):
+        """
+        Apply all buffered operations.
+        """
+        with self.lock:
+            colls = self.colls
+            ops = self.ops
+            once = self.once
+            self.colls = {}
+            self.ops = {}
+            self.once = {}
+            self.merged = 0
+        for name, coll_ops in ops.items():
+            if not coll_ops:
+                continue
+            self.logger.debug("bulk_write {} ops to {}".format(len(coll_ops), name))
+            try:
+                colls[name].bulk_write(coll_ops, ordered=False)
+            except BulkWriteError as e:
+                self._retry_once(coll=colls[name], once=once.get(name, {}), error=e)
+
+    def _retry_once(self, *, coll, once, error):
+        """
+        Handle a bulk write's duplicate key errors from update_once()
+        upserts, re-raising error if anything else failed.
+
+        The collision means either the update was already applied, or
+        the document was inserted (e.g. by another upsert in the same
+        bulk write) after the filter was checked, so each is retried
+        alone: a second collision means it was already applied.
+        """
+        if error.details.get('writeConcernErrors'):
+            raise error
+        retry = []
+        for werr in error.details.get('writeErrors', []):
+            if werr.get('code') != 11000 or werr.get('index') not in once:
+                raise error
+            retry.append(once[werr['index']])
+        for filter, update in retry:
+            try:
+                coll.update_one(filter, update, upsert=True)
+            except DuplicateKeyError:
+                self.logger.debug("already applied: {}".format(filter))
+
+
 class MongoDBKALockDoubleLock(Exception):
     pass
 
@@ -239,6 +361,25 @@ class JenkinsMongoDB(object):
     ENV_CONFIG = {'JENKINS_HOST':    {'required': False},
                   'JENKINS_DB_NAME': {'required': False}}
 
+    # Required indexes, as (keys, options) pairs, by collection type.
+    BUILDS_BY_TIME_INDEXES = [([('job_name', ASCENDING), ('build_number', ASCENDING)],
+                               {'unique': True}),
+                              ([('start_time_ms', ASCENDING), ('end_time_ms', ASCENDING)], {}),
+                              ([('end_time_ms', ASCENDING)], {})]
+
+    HOST_DATA_INDEXES = [([('job_name', ASCENDING), ('build_number', ASCENDING)],
+                          {'unique': True})]
+
+    JOB_ROLLUP_INDEXES = [([('granularity', ASCENDING), ('bucket_ms', ASCENDING), ('job_name', ASCENDING)], {})]
+
+    BUILD_STATUS_INDEXES = [([('job_name', ASCENDING), ('done', ASCENDING), ('bnum', ASCENDING)], {}),
+                            ([('job_name', ASCENDING), ('updated_ms', ASCENDING)], {})]
+
+    # Names of collections for which indexes have been ensured
+    # by this process (shared across instances).
+    _indexed = set()
+    _indexed_lock = threading.Lock()
+
     def __init__(self):
         cfg = EnvConfiguration(JenkinsMongoDB.ENV_CONFIG)
         # Explicitly pass a DB name to override the default based
@@ -260,6 +401,43 @@ class JenkinsMongoDB(object):
             self._db = MongoDB(db_name=self._db_name)
         return self._db
 
+    def ensure_indexes(self, *, coll, indexes, force=False):
+        """
+        Create the given indexes on the collection if this process
+        has not already done so.  create_index() is a no-op if the index
+        exists, but still costs a server round trip, so only do it once.
+        """
+        key = "{}:{}".format(self._db_name, coll.name)
+        with JenkinsMongoDB._indexed_lock:
+            if key in JenkinsMongoDB._indexed and not force:
+                return
+        for keys, options in indexes:
+            coll.create_index(keys, **options)
+        with JenkinsMongoDB._indexed_lock:
+            JenkinsMongoDB._indexed.add(key)
+
+    def ensure_all_indexes(self):
+        """
+        Ensure the required indexes on all existing collections.
+        Returns the list of collection names processed.
+        """
+        db = self.jenkins_db()
+        names = []
+        for name in db.collection_names():
+            if name.startswith('_builds_by_time_'):
+                indexes = JenkinsMongoDB.BUILDS_BY_TIME_INDEXES
+            elif name.startswith('host_'):
+                indexes = JenkinsMongoDB.HOST_DATA_INDEXES
+            elif name == '_build_status':
+                indexes = JenkinsMongoDB.BUILD_STATUS_INDEXES
+            elif name == '_job_rollups':
+                indexes = JenkinsMongoDB.JOB_ROLLUP_INDEXES
+            else:
+                continue
+            self.ensure_indexes(coll=db.collection(name), indexes=indexes, force=True)
+            names.append(name)
+        return names
+
     def _time_idx(self, *, time_ms):
         """
         Time-based collection names take the form:
@@ -288,10 +466,46 @@ class JenkinsMongoDB(object):
     def builds_by_time_collection(self, *, time_ms):
         """
         Return the collection associated with the timestamp
+        (with required indexes ensured).
         """
         name = '_builds_by_time_{}'.format(self._time_idx(time_ms=time_ms))
         db = self.jenkins_db()
-        return db.collection(name)
+        coll = db.collection(name)
+        self.ensure_indexes(coll=coll, indexes=JenkinsMongoDB.BUILDS_BY_TIME_INDEXES)
+        return coll
+
+    def host_data_collection(self, *, host_name):
+        """
+        Return the per-host data collection (with required indexes ensured).
+        """
+        coll = self.jenkins_db().collection("host_{}".format(host_name))
+        self.ensure_indexes(coll=coll, indexes=JenkinsMongoDB.HOST_DATA_INDEXES)
+        return coll
+
+    def build_status_collection(self):
+        """
+        Return the per-build status collection (with required indexes ensured).
+
+        Holds one document per known build of every job:
+            {'_id': '<job_name>:<build_number>',
+             'job_name': <job_name>,
+             'build_number': <build_number as string>,
+             'bnum': <build_number as integer>,
+             'done': <True if final data recorded>,
+             'updated_ms': <time of last update>}
+        """
+        coll = self.jenkins_db().collection('_build_status')
+        self.ensure_indexes(coll=coll, indexes=JenkinsMongoDB.BUILD_STATUS_INDEXES)
+        return coll
+
+    def job_rollup_collection(self):
+        """
+        Return the per-job time-bucketed build statistics collection
+        (with required indexes ensured).  See JenkinsAllJobIndex.
+        """
+        coll = self.jenkins_db().collection('_job_rollups')
+        self.ensure_indexes(coll=coll, indexes=JenkinsMongoDB.JOB_ROLLUP_INDEXES)
+        return coll
 
     def builds_by_time_collections(self, *, start_time_ms, end_time_ms):
         """
@@ -371,6 +585,23 @@ class JenkinsMongoDB(object):
             return 0
         return doc.get('ts', 0)
 
+    def change_stamp(self, *, bump=False):
+        """
+        Return the data change stamp, first incrementing it if bump is True.
+        Bumped by the updater whenever it writes build or job data so that
+        readers (e.g. the data query service) can tell cached results are stale.
+        """
+        coll = self.jenkins_db().collection('_jenkins_meta')
+        if bump:
+            doc = coll.find_one_and_update({'_id': 'change_stamp'}, {'$inc':{'stamp': 1}},
+                                           upsert=True, return_document = ReturnDocument.AFTER)
+        else:
+            doc = coll.find_one({'_id': 'change_stamp'})
+
+        if not doc:
+            return 0
+        return doc.get('stamp', 0)
+
     def alert_ttl(self, *, alert_group, alert_id, ttl):
         coll = self.jenkins_db().collection('_jenkins_meta')
         operator = '$set'
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 Xcalar, Inc. All rights reserved.
+#
+# No use, or distribution, of this source code is permitted in any form or
+# means without a valid, written license agreement with Xcalar, Inc.
+# Please refer to the included "COPYING" file for terms and conditions
+# regarding the use and redistribution of this software.
+
+"""
+Benchmark system stats extraction over a synthetic DataflowStatsHistory
+directory:
+
+    jmespath:   json decode, jmespath search per metric per line (as before)
+    planned:    json decode, planned (direct dictionary access) extraction
+    decoder:    planned extraction with the preferred decoder (orjson if installed)
+
+All variants must extract identical points.
+"""
+
+import gzip
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import extract
+from extract import JSONExtract, iter_json_lines
+from findfiles import XcalarStatsFileFinder
+
+def make_stats_dir(*, root, nodes, files, lines, cpus):
+    """
+    Write files x lines of fake system stats per node under
+    <root>/systemStats/<date>/<hour>/<ts>_node<n>_stats.json.gz
+    """
+    rnd = random.Random(1234)
+    ts = 1592702381
+    for fnum in range(files):
+        hourdir = os.path.join(root, "systemStats", "2020-6-20", str(fnum%24))
+        os.makedirs(hourdir, exist_ok=True)
+        for node in range(nodes):
+            path = os.path.join(hourdir, "{}_node{}_stats.json.gz".format(ts, node))
+            with gzip.open(path, 'wt') as fp:
+                for lnum in range(lines):
+                    now = ts+lnum
+                    cpustats = [{'timestamp': now, 'CPU': str(c), 'idle': rnd.random()*100,
+                                 'sys': rnd.random()*10, 'usr': rnd.random()*90,
+                                 'iowait': rnd.random()} for c in range(cpus)]
+                    cpustats.append(dict(cpustats[0], CPU='all'))
+                    doc = {'cpustats': cpustats,
+                           'system_stats': [{'timestamp': now,
+                                             'SystemMemoryUsed': rnd.randint(0, 2**36),
+                                             'SystemMemoryCgXCEUsed': rnd.randint(0, 2**36),
+                                             'SystemMemoryCgXPUUsed': rnd.randint(0, 2**36),
+                                             'SystemSwapUsed': rnd.randint(0, 2**30),
+                                             'XdbUsedBytes': rnd.randint(0, 2**36),
+                                             'SystemNetworkSendBytes': rnd.randint(0, 2**40),
+                                             'SystemNetworkRecvBytes': rnd.randint(0, 2**40)}],
+                           'xcalar_internal_stats': [{'timestamp': now,
+                                                      'XdbMgr_12_numSerializedBytes': rnd.randint(0, 2**30),
+                                                      'XdbMgr_12_numDeserializedBytes': rnd.randint(0, 2**30)}]}
+                    fp.write(json.dumps(doc))
+                    fp.write("\n")
+        ts += lines
+    return ts
+
+def run_jmespath(*, paths, metric_cfgs):
+    je = JSONExtract()
+    rtn = {mid: [] for mid in metric_cfgs}
+    for path in paths:
+        with gzip.open(path, 'rb') as fp:
+            for line in fp:
+                dikt = json.loads(line)
+                for mid, mcfg in metric_cfgs.items():
+                    points = je.extract_xy(xy_expr=mcfg['xy_expr'], dikt=dikt)
+                    if points:
+                        rtn[mid].extend(points)
+    return rtn
+
+def run_planned(*, paths, metric_cfgs, loads):
+    je = JSONExtract()
+    plan = je.plan(metric_cfgs=metric_cfgs)
+    saved = extract.json_loads
+    extract.json_loads = loads
+    try:
+        rtn = {mid: [] for mid in metric_cfgs}
+        for path in paths:
+            for dikt in iter_json_lines(path=path):
+                for mid, func in plan:
+                    points = func(dikt)
+                    if points:
+                        rtn[mid].extend(points)
+        return rtn
+    finally:
+        extract.json_loads = saved
+
+
+if __name__ == "__main__":
+
+    import argparse
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument('--cfg', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         "cfg", "cpu_mem_pag_net.json"),
+                                type=str, help='figure group configuration file')
+    argParser.add_argument('--nodes', default=2, type=int, help='number of nodes')
+    argParser.add_argument('--files', default=10, type=int, help='files per node')
+    argParser.add_argument('--lines', default=300, type=int, help='lines per file')
+    argParser.add_argument('--cpus', default=16, type=int, help='CPUs per node')
+    args = argParser.parse_args()
+
+    with open(args.cfg) as fp:
+        fg_cfg = json.load(fp)
+    metric_cfgs = {}
+    for fcfg in fg_cfg.get('figures', []):
+        for mcfg in fcfg.get('metrics', []):
+            if mcfg.get('source', "_SYSTEM_STATS") == "_SYSTEM_STATS" and 'xy_expr' in mcfg:
+                metric_cfgs[mcfg['xy_expr']] = mcfg
+
+    root = tempfile.mkdtemp()
+    try:
+        end_ts = make_stats_dir(root=root, nodes=args.nodes, files=args.files,
+                                lines=args.lines, cpus=args.cpus)
+        paths = []
+        for node_paths in XcalarStatsFileFinder(dsh=root).system_stats_files(
+                                start_ts=0, end_ts=end_ts).values():
+            paths.extend(node_paths)
+        print("{} files, {} lines, {} metrics".format(len(paths), len(paths)*args.lines,
+                                                      len(metric_cfgs)))
+
+        results = {}
+        for name, func in [('jmespath', lambda: run_jmespath(paths=paths, metric_cfgs=metric_cfgs)),
+                           ('planned', lambda: run_planned(paths=paths, metric_cfgs=metric_cfgs,
+                                                           loads=json.loads)),
+                           ('decoder', lambda: run_planned(paths=paths, metric_cfgs=metric_cfgs,
+                                                           loads=extract.json_loads))]:
+            start = time.time()
+            results[name] = func()
+            print("{:10s} {:.2f}s".format(name, time.time()-start))
+        assert results['planned'] == results['jmespath']
+        assert results['decoder'] == results['jmespath']
+        print("decoder: {}".format("orjson" if extract.orjson else "json"))
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 Xcalar, Inc. All rights reserved.
+#
+# No use, or distribution, of this source code is permitted in any form or
+# means without a valid, written license agreement with Xcalar, Inc.
+# Please refer to the included "COPYING" file for terms and conditions
+# regarding the use and redistribution of this software.
+
+"""
+Reduce a (sorted by x) series to at most max_points points:
+
+    minmax: min and max points of max_points/2 equal-width x buckets
+            (envelope, keeps every spike)
+    lttb:   Largest-Triangle-Three-Buckets (visually representative
+            subset of the original points)
+    mean:   mean x and y of max_points equal-width x buckets
+"""
+
+import numpy as np
+
+METHODS = ['minmax', 'lttb', 'mean']
+
+def _buckets(*, xs, count):
+    """
+    Index of the equal-width x bucket of each point.
+    """
+    span = xs[-1]-xs[0]
+    if span <= 0:
+        return np.zeros(len(xs), dtype=np.int64)
+    idx = ((xs-xs[0])/span*count).astype(np.int64)
+    return np.minimum(idx, count-1)
+
+def minmax(*, xs, ys, max_points):
+    buckets = _buckets(xs=xs, count=max(1, max_points//2))
+    # Sorted by (bucket, y) the first of each bucket is the min, the last the max.
+    order = np.lexsort((ys, buckets))
+    sorted_buckets = buckets[order]
+    firsts = np.append(True, sorted_buckets[1:] != sorted_buckets[:-1])
+    lasts = np.append(sorted_buckets[1:] != sorted_buckets[:-1], True)
+    keep = np.unique(np.concatenate((order[firsts], order[lasts])))
+    return xs[keep], ys[keep]
+
+def mean(*, xs, ys, max_points):
+    buckets = _buckets(xs=xs, count=max_points)
+    counts = np.bincount(buckets)
+    used = counts > 0
+    mean_x = np.bincount(buckets, weights=xs)[used]/counts[used]
+    mean_y = np.bincount(buckets, weights=ys)[used]/counts[used]
+    return mean_x, mean_y
+
+def lttb(*, xs, ys, max_points):
+    if max_points < 3:
+        return minmax(xs=xs, ys=ys, max_points=2)
+    # First and last points are kept, the rest split into equal-count buckets.
+    edges = np.linspace(1, len(xs)-1, max_points-1).astype(np.int64)
+    keep = np.empty(max_points, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = len(xs)-1
+    prev = 0
+    for bnum in range(max_points-2):
+        lo, hi = edges[bnum], edges[bnum+1]
+        # The next bucket's average (or the last point)
+        if bnum+2 < len(edges):
+            nlo, nhi = edges[bnum+1], edges[bnum+2]
+            avg_x = xs[nlo:nhi].mean()
+            avg_y = ys[nlo:nhi].mean()
+        else:
+            avg_x = xs[-1]
+            avg_y = ys[-1]
+        # Pick the point forming the largest triangle with the
+        # previously kept point and the next bucket's average.
+        areas = np.abs((xs[prev]-avg_x)*(ys[lo:hi]-ys[prev])
+                       - (xs[prev]-xs[lo:hi])*(avg_y-ys[prev]))
+        prev = lo+int(np.argmax(areas))
+        keep[bnum+1] = prev
+    return xs[keep], ys[keep]
+
+def reduce_points(*, xs, ys, method, max_points):
+    """
+    Returns (xs, ys) reduced by method to at most max_points
+    points, or as-is if already small enough (or method is None).
+    """
+    if method is None or len(xs) <= max_points:
+        return xs, ys
+    if method == 'minmax':
+        return minmax(xs=xs, ys=ys, max_points=max_points)
+    if method == 'lttb':
+        return lttb(xs=xs, ys=ys, max_points=max_points)
+    if method == 'mean':
+        return mean(xs=xs, ys=ys, max_points=max_points)
+    raise ValueError("unsupported reduce method: {}".format(method))
+
+
+if __name__ == "__main__":
+    import time
+
+    xs = np.arange(1000000, dtype=np.float64)
+    ys = np.sin(xs/10000)
+    ys[123457] = 100  # a spike
+    for method in METHODS:
+        start = time.time()
+        rx, ry = reduce_points(xs=xs, ys=ys, method=method, max_points=2000)
+        print("{:6s} {} points in {:.3f}s".format(method, len(rx), time.time()-start))
+        assert len(rx) <= 2000
+        assert np.all(np.diff(rx) >= 0)
+        if method != 'mean':
+            assert ry.max() == 100, method
+        if method == 'lttb':
+            assert rx[0] == xs[0] and rx[-1] == xs[-1]
+    small_x, small_y = reduce_points(xs=xs[:10], ys=ys[:10], method='lttb', max_points=2000)
+    assert len(small_x) == 10
+    print("A-OK!")
@@ -7,7 +7,18 @@
 # Please refer to the included "COPYING" file for terms and conditions
 # regarding the use and redistribution of this software.
 
+import gzip
+import json
 import jmespath
+import logging
+
+# orjson is preferred (much faster decoding) but optional.
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    json_loads = json.loads
 
 """
 An "xy_expr" expression returns alternating x and y values when iterating over matches...
@@ -27,16 +38,196 @@ the structures "keyed" by each of the key values.
 Both would result in:
         [(<x1>, <y1>), (<x2>, <y2>)]
 """
+
+def iter_json_lines(*, path):
+    """
+    Generator yielding the decoded documents of a (possibly gzip
+    compressed) JSON Lines file.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as fp:
+        for line in fp:
+            if line.strip():
+                yield json_loads(line)
+
+
+class _NotSimple(Exception):
+    pass
+
+def _equals(x, y):
+    # As jmespath: booleans never equal numbers
+    if isinstance(x, bool) != isinstance(y, bool):
+        return False
+    return x == y
+
+def _is_false(value):
+    # As jmespath: 0 is true
+    return (value == '' or value == [] or value == {} or value is None or
+            value is False)
+
+def _compile_node(node):
+    """
+    Compile a parsed jmespath expression node into a function of
+    the current value, with the same semantics as jmespath's
+    TreeInterpreter.  Only the node types seen in practice (field
+    paths, [*] and [?a==`b`] projections and [a, b] multi-selects)
+    are handled, anything else raises _NotSimple.
+    """
+    ntype = node['type']
+    children = node.get('children', [])
+
+    if ntype == 'field':
+        name = node['value']
+        def field(value):
+            if isinstance(value, dict):
+                return value.get(name)
+            return None
+        return field
+
+    if ntype in ('identity', 'current'):
+        return lambda value: value
+
+    if ntype == 'literal':
+        literal = node['value']
+        return lambda value: literal
+
+    if ntype == 'subexpression':
+        funcs = [_compile_node(c) for c in children]
+        def subexpression(value):
+            for func in funcs:
+                value = func(value)
+                if value is None:
+                    return None
+            return value
+        return subexpression
+
+    if ntype == 'multi_select_list':
+        funcs = [_compile_node(c) for c in children]
+        def multi_select_list(value):
+            if value is None:
+                return None
+            return [func(value) for func in funcs]
+        return multi_select_list
+
+    if ntype == 'projection':
+        left, right = [_compile_node(c) for c in children]
+        def projection(value):
+            base = left(value)
+            if not isinstance(base, list):
+                return None
+            rtn = []
+            for item in base:
+                cur = right(item)
+                if cur is not None:
+                    rtn.append(cur)
+            return rtn
+        return projection
+
+    if ntype == 'filter_projection':
+        left, right, cond = [_compile_node(c) for c in children]
+        def filter_projection(value):
+            base = left(value)
+            if not isinstance(base, list):
+                return None
+            rtn = []
+            for item in base:
+                if not _is_false(cond(item)):
+                    cur = right(item)
+                    if cur is not None:
+                        rtn.append(cur)
+            return rtn
+        return filter_projection
+
+    if ntype == 'comparator' and node['value'] in ('eq', 'ne'):
+        lhs, rhs = [_compile_node(c) for c in children]
+        if node['value'] == 'eq':
+            return lambda value: _equals(lhs(value), rhs(value))
+        return lambda value: not _equals(lhs(value), rhs(value))
+
+    raise _NotSimple(ntype)
+
+
 class JSONExtract(object):
 
     def __init__(self):
+        self.logger = logging.getLogger(__name__)
         self._compiled = {'keys(@)': jmespath.compile('keys(@)')}
+        self._fast = {}
 
     def compiled(self, *, expr):
         if expr not in self._compiled:
             self._compiled[expr] = jmespath.compile(expr)
         return self._compiled[expr]
 
+    def fast(self, *, expr):
+        """
+        Return a function of a document evaluating expr by direct
+        dictionary access, or None if expr isn't simple enough.
+        """
+        if expr not in self._fast:
+            try:
+                self._fast[expr] = _compile_node(self.compiled(expr=expr).parsed)
+            except _NotSimple as e:
+                self.logger.debug("not simple ({}): {}".format(e, expr))
+                self._fast[expr] = None
+        return self._fast[expr]
+
+    def searcher(self, *, expr):
+        """
+        Return a function of a document evaluating expr,
+        by the fast path if possible.
+        """
+        func = self.fast(expr=expr)
+        if func is None:
+            func = self.compiled(expr=expr).search
+        return func
+
+    def plan(self, *, metric_cfgs):
+        """
+        Plan extraction of a set of metrics, once, ahead of
+        processing any documents.
+
+        metric_cfgs is a dictionary of metric_id: metric configuration
+        (dictionary with "xy_expr" or "key_expr" and "val_expr").
+
+        Returns a list of (metric_id, func) where func(dikt) returns the
+        same points as extract_xy()/extract_kv() would.
+        """
+        plan = []
+        for metric_id, mcfg in metric_cfgs.items():
+            if 'xy_expr' in mcfg:
+                func = self.searcher(expr=mcfg.get('xy_expr'))
+            elif 'key_expr' in mcfg and 'val_expr' in mcfg:
+                func = self._kv_func(kfunc=self.searcher(expr=mcfg.get('key_expr')),
+                                     vfunc=self.searcher(expr=mcfg.get('val_expr')))
+            else:
+                raise ValueError("invalid metric config: {}".format(mcfg))
+            plan.append((metric_id, func))
+        return plan
+
+    def _kv_func(self, *, kfunc, vfunc):
+        keysfunc = self.compiled(expr='keys(@)')
+        def kv(dikt):
+            keys_doc = kfunc(dikt)
+            if isinstance(keys_doc, dict):
+                keys = list(keys_doc.keys())
+            else:
+                keys = keysfunc.search(keys_doc) # raises as jmespath would
+            return self._kv_points(keys_doc=keys_doc, keys=keys, vfunc=vfunc)
+        return kv
+
+    @staticmethod
+    def _kv_points(*, keys_doc, keys, vfunc):
+        vals = []
+        for key in keys:
+            sub = keys_doc[key]
+            if isinstance(sub, list):
+                for dikt_item in sub:
+                    vals.append([key, vfunc(dikt_item)])
+            else:
+                vals.append([key, vfunc(sub)])
+        return vals
+
     def extract_xy(self, *, xy_expr, dikt):
         expr = self.compiled(expr=xy_expr)
         return expr.search(dikt)
@@ -51,24 +242,13 @@ class JSONExtract(object):
                   and val_expr to extract the value(s) to be returned as the second
                   element in each returned pair(s)
         '''
-        vals = []
-
         kexpr = self.compiled(expr=key_expr)
         vexpr = self.compiled(expr=val_expr)
         keysfunc = self.compiled(expr='keys(@)')
 
         keys_doc = kexpr.search(dikt)
         keys = keysfunc.search(keys_doc)
-        for key in keys:
-            sub = keys_doc[key]
-            if isinstance(sub, list):
-                for dikt_item in sub:
-                    val = vexpr.search(dikt_item)
-                    vals.append([key, val])
-            else:
-                val = vexpr.search(sub)
-                vals.append([key, val])
-        return vals
+        return self._kv_points(keys_doc=keys_doc, keys=keys, vfunc=vexpr.search)
 
 if __name__ == "__main__":
     test_data={
@@ -94,3 +274,27 @@ if __name__ == "__main__":
 
     print("expect: {'x': 2, 'y': 20}")
     print("got: {}".format(jmespath.search("blah[?x==`2`]", test_data)))
+
+    # Planned (fast path) extraction must match jmespath.
+    test_data['zero'] = [{'x': 0, 'y': 1}, {'x': None, 'y': 2}, {'x': '', 'y': 3},
+                         {'x': [], 'y': 4}, {'x': False, 'y': 5}, {'x': 0.0, 'y': 6}]
+    metric_cfgs = {'xy': {'xy_expr': "blah[*][x,y]"},
+                   'truthy': {'xy_expr': "zero[?x][x,y]"},
+                   'xyf': {'xy_expr': "blah[?x==`2`][x,y]"},
+                   'xyn': {'xy_expr': "blah[?x!=`2`].y"},
+                   'kv': {'key_expr': "bar.bongo", 'val_expr': "idle"},
+                   'complex': {'xy_expr': "blah[?x > `1`][x,y]"}}
+    for metric_id, func in je.plan(metric_cfgs=metric_cfgs):
+        mcfg = metric_cfgs[metric_id]
+        if 'xy_expr' in mcfg:
+            expect = je.extract_xy(xy_expr=mcfg['xy_expr'], dikt=test_data)
+        else:
+            expect = je.extract_kv(key_expr=mcfg['key_expr'], val_expr=mcfg['val_expr'],
+                                   dikt=test_data)
+        assert func(test_data) == expect, metric_id
+        if 'xy_expr' in mcfg:
+            for odd in [{}, {'blah': None}, {'blah': [None, 1, {'x': 2}]}, {'blah': {'x': 2}}]:
+                assert func(odd) == je.extract_xy(xy_expr=mcfg['xy_expr'], dikt=odd), metric_id
+    assert je.fast(expr="blah[*][x,y]") is not None
+    assert je.fast(expr="blah[?x > `1`][x,y]") is None
+    print("plan A-OK!")
@@ -7,31 +7,208 @@
 # Please refer to the included "COPYING" file for terms and conditions
 # regarding the use and redistribution of this software.
 
+import datetime
+import fnmatch
 import glob
+import json
 import logging
 import os
 import re
+import tempfile
+import time
+
+INDEX_NAME = '.xc_stats_index.json'
+DATE_DIR_PAT = re.compile(r"^(\d{4})-(\d{1,2})-(\d{1,2})$")
+
+# An hour directory modified within this long of being indexed
+# is re-scanned, since files can still be landing in its sub-directories.
+SETTLE_SEC = 3600
+
+def date_dir_in_range(*, name, start_ts, end_ts):
+    """
+    Return whether a <YYYY-M-D> directory may hold files in [start_ts, end_ts],
+    or None if name isn't a date.
+
+    The time zone of the directory layout isn't known, so allow a day either side.
+    """
+    m = DATE_DIR_PAT.match(name)
+    if not m:
+        return None
+    try:
+        day = datetime.date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+    except ValueError:
+        return None
+    one_day = datetime.timedelta(days=1)
+    first = datetime.datetime.utcfromtimestamp(start_ts).date() - one_day
+    last = datetime.datetime.utcfromtimestamp(end_ts).date() + one_day
+    return first <= day <= last
+
+
+class DateDirIndex(object):
+    """
+    Sidecar index (INDEX_NAME) of the files in a <date>/<hour>/... tree:
+
+        {"hours": {<hour>: {"mtime": <hour directory mtime>,
+                            "indexed": <time indexed>,
+                            "min_ts": <ts>, "max_ts": <ts>,
+                            "files": [[<path relative to date dir>, <ts>, <node>], ...]}}}
+
+    Hours are (re-)scanned only when new or changed, and skipped entirely
+    when their files' time range is outside the requested window.
+    If the index can't be written (e.g. read-only netstore) it's just
+    not persisted.
+    """
+    def __init__(self, *, path, pattern, match):
+        """
+        Required parameters:
+            path:       date directory
+            pattern:    glob pattern of file names of interest
+            match:      match(path) returns (ts, node) or None to ignore the file
+        """
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.pattern = pattern
+        self.match = match
+        self.hours = self._load()
+        self.dirty = False
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.path, INDEX_NAME)) as fp:
+                return json.load(fp).get('hours', {})
+        except (OSError, ValueError):
+            return {}
+
+    def _scan_hour(self, *, entry, mtime):
+        files = []
+        for path in glob.glob(os.path.join(entry.path, '**', self.pattern), recursive=True):
+            m = self.match(path)
+            if m is None:
+                continue
+            ts, node = m
+            files.append([os.path.relpath(path, self.path), ts, node])
+        tss = [f[1] for f in files]
+        return {'mtime': mtime,
+                'indexed': time.time(),
+                'min_ts': min(tss) if tss else None,
+                'max_ts': max(tss) if tss else None,
+                'files': files}
+
+    def files(self, *, start_ts, end_ts):
+        """
+        Return list of (path, ts, node) with start_ts <= ts <= end_ts.
+        """
+        rtn = []
+        seen = set()
+        for entry in os.scandir(self.path):
+            if entry.name.startswith('.'):
+                continue
+            if not entry.is_dir():
+                # Not in an hour directory, always check.
+                if not fnmatch.fnmatch(entry.name, self.pattern):
+                    continue
+                m = self.match(entry.path)
+                if m is not None and start_ts <= m[0] <= end_ts:
+                    rtn.append((entry.path, m[0], m[1]))
+                continue
+
+            seen.add(entry.name)
+            mtime = entry.stat().st_mtime
+            hour = self.hours.get(entry.name, None)
+            if (hour is None or hour['mtime'] != mtime
+                    or hour['indexed'] - mtime < SETTLE_SEC):
+                self.logger.debug("indexing: {}".format(entry.path))
+                hour = self._scan_hour(entry=entry, mtime=mtime)
+                self.hours[entry.name] = hour
+                self.dirty = True
+            if hour['min_ts'] is None or hour['max_ts'] < start_ts or hour['min_ts'] > end_ts:
+                continue
+            for relpath, ts, node in hour['files']:
+                if start_ts <= ts <= end_ts:
+                    rtn.append((os.path.join(self.path, relpath), ts, node))
+
+        for name in set(self.hours.keys()) - seen:
+            del self.hours[name]
+            self.dirty = True
+        return rtn
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix='.', suffix='.tmp')
+            with os.fdopen(fd, 'w') as fp:
+                json.dump({'hours': self.hours}, fp)
+            os.rename(tmp_path, os.path.join(self.path, INDEX_NAME))
+            self.dirty = False
+        except OSError as e:
+            self.logger.debug("can't save index in {}: {}".format(self.path, e))
+
 
 class XcalarStatsFileFinder(object):
-    def __init__(self, *, dsh):
+    def __init__(self, *, dsh, use_index=True):
         self.dsh = dsh
+        self.use_index = use_index
         self.logger = logging.getLogger(__name__)
 
+    def _find(self, *, top, pattern, match, start_ts, end_ts):
+        """
+        Return list of (path, ts, node) of the files under top
+        matching pattern with start_ts <= ts <= end_ts.
+
+        Date directories (<top>/<YYYY-M-D>/...) outside the time window
+        are skipped and the rest looked up through their DateDirIndex.
+        Anything else is listed in full.
+        """
+        rtn = []
+        if not self.use_index or not os.path.isdir(top):
+            paths = glob.glob(os.path.join(top, '**', pattern), recursive=True)
+        else:
+            paths = []
+            for entry in os.scandir(top):
+                if entry.name.startswith('.'):
+                    continue
+                in_range = None
+                if entry.is_dir():
+                    in_range = date_dir_in_range(name=entry.name,
+                                                 start_ts=start_ts, end_ts=end_ts)
+                    if in_range is None:
+                        paths.extend(glob.glob(os.path.join(entry.path, '**', pattern),
+                                               recursive=True))
+                elif fnmatch.fnmatch(entry.name, pattern):
+                    paths.append(entry.path)
+                if not in_range:
+                    continue
+                index = DateDirIndex(path=entry.path, pattern=pattern, match=match)
+                rtn.extend(index.files(start_ts=start_ts, end_ts=end_ts))
+                index.save()
+
+        for path in paths:
+            m = match(path)
+            if m is None:
+                continue
+            ts, node = m
+            # XXXrs - a little slop here since a file can contain multiple seconds...
+            if ts < start_ts or ts > end_ts:
+                continue
+            rtn.append((path, ts, node))
+        return rtn
+
     def system_stats_files(self, *, start_ts, end_ts, nodes=None):
         # /foo/bar/DataflowStatsHistory/systemStats/2020-6-20/18/1592702381_node1_stats.json.gz
-        paths_by_node = {}
         filename_pat = re.compile(r"(\d+)_node(\d+)_stats.json.*")
-        for path in glob.glob('{}/**/*.json*'.format(os.path.join(self.dsh, "systemStats")), recursive=True):
+        def match(path):
             directory, filename = os.path.split(path)
             m = filename_pat.match(filename)
             if not m:
                 self.logger.debug("FAIL TO MATCH: {}".format(filename))
-                continue
-            ts = float(m.group(1))
-            node = m.group(2)
-            # XXXrs - a little slop here since a file can contain multiple seconds...
-            if ts < start_ts or ts > end_ts:
-                continue
+                return None
+            return float(m.group(1)), m.group(2)
+
+        paths_by_node = {}
+        for path, ts, node in self._find(top=os.path.join(self.dsh, "systemStats"),
+                                         pattern='*.json*', match=match,
+                                         start_ts=start_ts, end_ts=end_ts):
             if nodes and node not in nodes:
                 continue
             paths_by_node.setdefault(node, []).append(path)
@@ -40,18 +217,32 @@ class XcalarStatsFileFinder(object):
     def job_stats_files(self, *, start_ts, end_ts):
         # /foo/bar/DataflowStatsHistory/jobStats/2020-06-13/6/1592053315-XcalarSDKOpt-5EE4CB0504DC68D3-tpchSess_1036913322_worker_45-q7-thr45-q7-admin-1592053156_3064544/job_stats.json.gz
         filepath_pat = re.compile(r".*/(\d+)-.*/job_stats.json.*")
-        paths = []
-        for path in glob.glob('{}/**/job_stats.json*'.format(os.path.join(self.dsh, "jobStats")), recursive=True):
+        def match(path):
             m = filepath_pat.match(path)
             if not m:
                 self.logger.debug("FAIL TO MATCH: {}".format(path))
-                continue
-            ts = float(m.group(1))
-            # XXXrs - a little slop here since a file can contain multiple seconds...
-            if ts < start_ts or ts > end_ts:
-                continue
-            paths.append(path)
-        return paths
+                return None
+            return float(m.group(1)), None
+
+        return [path for path, ts, node in self._find(top=os.path.join(self.dsh, "jobStats"),
+                                                      pattern='job_stats.json*', match=match,
+                                                      start_ts=start_ts, end_ts=end_ts)]
 
 if __name__ == "__main__":
-    print("Compile check A-OK!")
+
+    import argparse
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument('--dsh', default=None, type=str,
+                                help='path to DataflowStatsHistory directory to index')
+    args = argParser.parse_args()
+
+    if not args.dsh:
+        print("Compile check A-OK!")
+    else:
+        # Index (or refresh the index of) everything.
+        finder = XcalarStatsFileFinder(dsh=args.dsh)
+        end_ts = time.time()+86400
+        paths_by_node = finder.system_stats_files(start_ts=0, end_ts=end_ts)
+        for node in sorted(paths_by_node.keys()):
+            print("node{}: {} system stats files".format(node, len(paths_by_node[node])))
+        print("{} job stats files".format(len(finder.job_stats_files(start_ts=0, end_ts=end_ts))))
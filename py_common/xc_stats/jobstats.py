@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 Xcalar, Inc. All rights reserved.
+#
+# No use, or distribution, of this source code is permitted in any form or
+# means without a valid, written license agreement with Xcalar, Inc.
+# Please refer to the included "COPYING" file for terms and conditions
+# regarding the use and redistribution of this software.
+
+"""
+Time series derived from Xcalar per-query job stats files
+(DataflowStatsHistory/jobStats/.../job_stats.json.gz), one query per line:
+
+    {"job_start_timestamp_microsecs": <us>,
+     "job_end_timestamp_microsecs": <us>,
+     "nodes": [{"api_type": <str>,
+                "operation_start_timestamp_microsecs": <us>,
+                "operation_end_timestamp_microsecs": <us>,
+                "node_time_elapsed_millisecs": <ms>,
+                "xdb_bytes_required": <bytes>,
+                "num_rows_per_node": [<rows on cluster node 0>, ...]}, ...]}
+
+A "job_metric" metric configuration selects one of JOB_METRICS:
+
+    queries:        number of queries running
+    operators:      number of operators running
+    memory_bytes:   sum of the memory required by the running operators
+    busy_nodes:     number of cluster nodes with operators running
+    node_operators: per-node number of operators running
+    latency_ms:     operator latency "percentile" (default 50) over
+                    "bucket_sec" (default 60) buckets
+
+all but queries optionally limited to an "api" (e.g. "XcalarApiJoin").
+
+Aggregation is in two steps so that files can be parsed in parallel:
+partial_points() runs in the loader processes, returning each file's
+events (start/end deltas) or samples, finalize() merges these once
+everything is loaded.  All but node_operators are cluster-wide, stored
+under CLUSTER_NODE.
+"""
+
+import logging
+import numpy as np
+
+CLUSTER_NODE = 'cluster'
+
+JOB_METRICS = ['queries', 'operators', 'memory_bytes', 'busy_nodes',
+               'node_operators', 'latency_ms']
+
+logger = logging.getLogger(__name__)
+
+def _us_to_s(val):
+    if val is None:
+        return None
+    return float(val)/1000000
+
+
+class JobOp(object):
+    """
+    One operator of a query, times in seconds.
+    """
+    def __init__(self, *, dikt):
+        self.api = dikt.get('api_type', None)
+        self.start = _us_to_s(dikt.get('operation_start_timestamp_microsecs', None))
+        self.end = _us_to_s(dikt.get('operation_end_timestamp_microsecs', None))
+        elapsed_ms = dikt.get('node_time_elapsed_millisecs', None)
+        if elapsed_ms is None and self.start is not None and self.end is not None:
+            elapsed_ms = (self.end-self.start)*1000
+        self.elapsed_ms = elapsed_ms
+        if self.end is None and self.start is not None and elapsed_ms is not None:
+            self.end = self.start+float(elapsed_ms)/1000
+        self.mem_bytes = dikt.get('xdb_bytes_required', dikt.get('size', 0)) or 0
+        self.rows_per_node = dikt.get('num_rows_per_node', dikt.get('rows_per_node', None))
+
+    def timed(self):
+        return self.start is not None and self.end is not None
+
+    def busy_nodes(self):
+        """
+        Cluster nodes (as strings, as system stats nodes) that did work.
+        """
+        if not isinstance(self.rows_per_node, list):
+            return []
+        return [str(idx) for idx, rows in enumerate(self.rows_per_node) if rows]
+
+
+class JobQuery(object):
+    """
+    One query (line) of a job stats file.
+    """
+    def __init__(self, *, dikt):
+        self.ops = [JobOp(dikt=d) for d in dikt.get('nodes', []) if isinstance(d, dict)]
+        timed = [op for op in self.ops if op.timed()]
+        self.start = _us_to_s(dikt.get('job_start_timestamp_microsecs', None))
+        if self.start is None and timed:
+            self.start = min([op.start for op in timed])
+        self.end = _us_to_s(dikt.get('job_end_timestamp_microsecs', None))
+        if self.end is None and timed:
+            self.end = max([op.end for op in timed])
+
+    def timed(self):
+        return self.start is not None and self.end is not None
+
+
+def partial_points(*, queries, params, nodes=None):
+    """
+    Returns {node: [(ts, val), ...]} of one file's contribution to
+    a job metric.  params is the metric configuration dictionary.
+    """
+    job_metric = params.get('job_metric')
+    api = params.get('api', None)
+    rtn = {}
+
+    def _add(node, ts, val):
+        rtn.setdefault(node, []).append((ts, val))
+
+    for query in queries:
+        if job_metric == 'queries':
+            if query.timed():
+                _add(CLUSTER_NODE, query.start, 1)
+                _add(CLUSTER_NODE, query.end, -1)
+            continue
+        for op in query.ops:
+            if not op.timed() or (api and op.api != api):
+                continue
+            if job_metric == 'operators':
+                _add(CLUSTER_NODE, op.start, 1)
+                _add(CLUSTER_NODE, op.end, -1)
+            elif job_metric == 'memory_bytes':
+                _add(CLUSTER_NODE, op.start, op.mem_bytes)
+                _add(CLUSTER_NODE, op.end, -op.mem_bytes)
+            elif job_metric in ['busy_nodes', 'node_operators']:
+                # busy_nodes is reduced to CLUSTER_NODE by finalize()
+                for node in op.busy_nodes():
+                    if nodes and node not in nodes:
+                        continue
+                    _add(node, op.start, 1)
+                    _add(node, op.end, -1)
+            elif job_metric == 'latency_ms':
+                if op.elapsed_ms is not None:
+                    _add(CLUSTER_NODE, op.end, op.elapsed_ms)
+            else:
+                raise ValueError("unsupported job_metric: {}".format(job_metric))
+    return rtn
+
+
+def running_total(*, ts, delta):
+    """
+    Sum start/end deltas into (ts, value) of the running total at each
+    distinct timestamp.  At equal timestamps ends are applied first.
+    """
+    if not len(ts):
+        return np.empty(0), np.empty(0)
+    order = np.lexsort((delta, ts))
+    ts = ts[order]
+    total = np.cumsum(delta[order])
+    last = np.append(ts[1:] != ts[:-1], True)
+    return ts[last], total[last]
+
+
+def bucket_percentile(*, ts, val, bucket_sec, percentile):
+    """
+    Returns (bucket mid-point ts, percentile of val) for each non-empty
+    bucket_sec bucket.
+    """
+    if not len(ts):
+        return np.empty(0), np.empty(0)
+    buckets = np.floor(ts/bucket_sec)
+    order = np.argsort(buckets, kind='stable')
+    buckets = buckets[order]
+    val = val[order]
+    starts = np.flatnonzero(np.append(True, buckets[1:] != buckets[:-1]))
+    ends = np.append(starts[1:], len(buckets))
+    xs = (buckets[starts]+0.5)*bucket_sec
+    ys = np.array([np.percentile(val[s:e], percentile) for s, e in zip(starts, ends)])
+    return xs, ys
+
+
+def finalize(*, params, node_to_columns):
+    """
+    Merge all files' partial_points() for a job metric.
+    node_to_columns is {node: (ts array, val array)}.
+    Returns {node: (ts array, val array)}.
+    """
+    job_metric = params.get('job_metric')
+    if job_metric == 'latency_ms':
+        return {node: bucket_percentile(ts=ts, val=val,
+                                        bucket_sec=float(params.get('bucket_sec', 60)),
+                                        percentile=float(params.get('percentile', 50)))
+                for node, (ts, val) in node_to_columns.items()}
+
+    totals = {node: running_total(ts=ts, delta=val)
+              for node, (ts, val) in node_to_columns.items()}
+    if job_metric != 'busy_nodes':
+        return totals
+
+    # Each node contributes +1 when it becomes busy, -1 when idle.
+    all_ts = []
+    all_delta = []
+    for node, (ts, total) in totals.items():
+        busy = (total > 0).astype(np.float64)
+        delta = np.diff(np.append(0, busy))
+        changed = delta != 0
+        all_ts.append(ts[changed])
+        all_delta.append(delta[changed])
+    if not all_ts:
+        return {}
+    return {CLUSTER_NODE: running_total(ts=np.concatenate(all_ts),
+                                        delta=np.concatenate(all_delta))}
+
+
+if __name__ == "__main__":
+    def _op(api, start, end, rows):
+        return {'api_type': api,
+                'operation_start_timestamp_microsecs': start*1000000,
+                'operation_end_timestamp_microsecs': end*1000000,
+                'xdb_bytes_required': 100,
+                'num_rows_per_node': rows}
+    queries = [JobQuery(dikt={'nodes': [_op('XcalarApiMap', 10, 20, [1, 0]),
+                                        _op('XcalarApiJoin', 15, 30, [0, 5])]}),
+               JobQuery(dikt={'job_start_timestamp_microsecs': 5000000,
+                              'job_end_timestamp_microsecs': 25000000,
+                              'nodes': [_op('XcalarApiMap', 20, 25, [2, 2])]})]
+    assert queries[0].start == 10 and queries[0].end == 30
+
+    def _run(params):
+        # Split across two "files" to exercise the merge.
+        parts = [partial_points(queries=[q], params=params) for q in queries]
+        merged = {}
+        for part in parts:
+            for node, points in part.items():
+                merged.setdefault(node, []).extend(points)
+        cols = {node: tuple(np.array(c, dtype=np.float64) for c in zip(*points))
+                for node, points in merged.items()}
+        return {node: (list(ts), list(val))
+                for node, (ts, val) in finalize(params=params, node_to_columns=cols).items()}
+
+    assert _run({'job_metric': 'queries'}) == \
+                {CLUSTER_NODE: ([5, 10, 25, 30], [1, 2, 1, 0])}
+    assert _run({'job_metric': 'operators', 'api': 'XcalarApiMap'}) == \
+                {CLUSTER_NODE: ([10, 20, 25], [1, 1, 0])}
+    assert _run({'job_metric': 'node_operators'}) == \
+                {'0': ([10, 20, 25], [1, 1, 0]), '1': ([15, 20, 25, 30], [1, 2, 1, 0])}
+    assert _run({'job_metric': 'busy_nodes'}) == \
+                {CLUSTER_NODE: ([10, 15, 25, 30], [1, 2, 1, 0])}
+    assert _run({'job_metric': 'latency_ms', 'bucket_sec': 60, 'percentile': 100}) == \
+                {CLUSTER_NODE: ([30, ], [15000, ])}
+    print("A-OK!")
@@ -7,14 +7,16 @@
 # Please refer to the included "COPYING" file for terms and conditions
 # regarding the use and redistribution of this software.
 
+import concurrent.futures
 import datetime
 import gzip
 import json
-import json_lines
 import logging
+import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 import multiprocessing
+import numpy as np
 import os
 import pprint
 import psutil
@@ -22,17 +24,69 @@ import queue
 import threading
 import time
 
-from extract import JSONExtract
+from extract import JSONExtract, iter_json_lines, json_loads
 from findfiles import XcalarStatsFileFinder
+import downsample
+import jobstats
+from jobstats import CLUSTER_NODE
 
 logger = logging.getLogger(__name__)
 
+def to_columns(points):
+    """
+    Convert a list of (x, y) points to a pair of float arrays.
+    Points that can't be converted are dropped.
+    """
+    if not len(points):
+        return np.empty(0), np.empty(0)
+    try:
+        arr = np.asarray(points, dtype=np.float64)
+        if arr.ndim != 2 or arr.shape[1] != 2:
+            raise ValueError("not a list of pairs")
+    except (TypeError, ValueError):
+        good = []
+        for pt in points:
+            try:
+                x, y = pt
+                good.append((float(x), float(y)))
+            except (TypeError, ValueError):
+                continue
+        if not good:
+            return np.empty(0), np.empty(0)
+        arr = np.asarray(good, dtype=np.float64)
+    return arr[:, 0].copy(), arr[:, 1].copy()
+
+
+class _Series(object):
+    """
+    Growable timestamp/value columns.
+    """
+    def __init__(self, *, capacity=1024):
+        self.ts = np.empty(capacity)
+        self.val = np.empty(capacity)
+        self.size = 0
+
+    def extend(self, *, ts, val):
+        need = self.size + len(ts)
+        if need > len(self.ts):
+            capacity = max(need, 2*len(self.ts))
+            for name in ['ts', 'val']:
+                grown = np.empty(capacity)
+                grown[:self.size] = getattr(self, name)[:self.size]
+                setattr(self, name, grown)
+        self.ts[self.size:need] = ts
+        self.val[self.size:need] = val
+        self.size = need
+
+    def columns(self):
+        return self.ts[:self.size], self.val[:self.size]
+
+
 class MetricsData(object):
     def __init__(self):
         self.source_to_ids = {}
         self.id_to_cfg = {}
-        self.node_id_to_points = {}
-        self.nodes = set()
+        self.node_id_to_series = {}
         self.data_write_lock = threading.Lock()
 
     def register_metric(self, *, metric_cfg):
@@ -51,20 +105,76 @@ class MetricsData(object):
         return self.id_to_cfg[metric_id]
 
     def add_points(self, *, node, metric_id, points):
-        if not len(points):
+        ts, val = to_columns(points)
+        self.add_columns(node=node, metric_id=metric_id, ts=ts, val=val)
+
+    def add_columns(self, *, node, metric_id, ts, val):
+        if not len(ts):
             return
-        key = "{}:{}".format(node, metric_id)
         with self.data_write_lock:
             # Thread safe.
-            self.nodes.add(node)
-            self.node_id_to_points.setdefault(key, []).extend(points)
+            self.node_id_to_series.setdefault((node, metric_id), _Series()).extend(ts=ts, val=val)
 
     def get_points(self, *, node, metric_id):
-        key = "{}:{}".format(node, metric_id)
-        return self.node_id_to_points.get(key, [])
+        """
+        Returns (timestamps, values) arrays, empty if no data.
+        Cluster-wide data (e.g. from job stats) are returned for
+        any node without data of its own.
+        """
+        series = self.node_id_to_series.get((node, metric_id), None)
+        if series is None:
+            series = self.node_id_to_series.get((CLUSTER_NODE, metric_id), None)
+        if series is None:
+            return np.empty(0), np.empty(0)
+        return series.columns()
+
+    def nodes_for_id(self, *, metric_id):
+        return [node for node, mid in self.node_id_to_series.keys() if mid == metric_id]
+
+    def replace_metric(self, *, metric_id, node_to_columns):
+        """
+        Replace all of a metric's data with {node: (ts, val)}.
+        """
+        with self.data_write_lock:
+            for node in self.nodes_for_id(metric_id=metric_id):
+                del self.node_id_to_series[(node, metric_id)]
+        for node, (ts, val) in node_to_columns.items():
+            self.add_columns(node=node, metric_id=metric_id, ts=ts, val=val)
+
+    def window(self, *, node, metric_id, start_ts, end_ts, swapxy=False):
+        """
+        Returns the (x, y) arrays of points with x between start_ts
+        and end_ts (s), sorted by x, or None if there are no data at all
+        for the node/metric.
+
+        ASS-U-ME: the x-axis is timestamps.  Best effort rescale to
+        seconds if (presumably) in ms or us.
+        """
+        xs, ys = self.get_points(node=node, metric_id=metric_id)
+        if not len(xs):
+            return None
+        if swapxy:
+            xs, ys = ys, xs
+        now_x10 = time.time()*10
+        xs = np.where(xs > now_x10, xs/1000, xs)
+        xs = np.where(xs > now_x10, xs/1000, xs)
+
+        # Exclude points outside our time range
+        keep = (xs >= start_ts) & (xs <= end_ts)
+        xs = xs[keep]
+        ys = ys[keep]
+        order = np.lexsort((ys, xs))
+        return xs[order], ys[order]
 
     def all_nodes(self):
-        return list(self.nodes)
+        """
+        All nodes with data, the cluster-wide pseudo-node only
+        if there's nothing else.
+        """
+        nodes = set([node for node, mid in self.node_id_to_series.keys()])
+        if len(nodes) > 1:
+            nodes.discard(CLUSTER_NODE)
+        return list(nodes)
 
 
 class MetricCfg(object):
@@ -81,6 +191,13 @@ class MetricCfg(object):
             "key_expr": <expr>,
             "val_expr": <expr>,
 
+            If "_JOB_STATS", alternatively (see jobstats.py):
+
+            "job_metric": <name>,
+            "api": <api_type>,
+            "percentile": <pct>,
+            "bucket_sec": <sec>,
+
             "color": <str>,
             "label": <str>,
             "swapxy": <bool>,
@@ -107,6 +224,13 @@ class MetricCfg(object):
                                                        self.dikt.get("val_expr")))
         elif "csv:" in source:
             return(source)
+        elif "job_metric" in self.dikt:
+            if self.dikt.get("job_metric") not in jobstats.JOB_METRICS:
+                raise ValueError("unknown job_metric: {}".format(self.dikt.get("job_metric")))
+            return("{}:job_metric:{}".format(self.source(),
+                        ":".join(["{}={}".format(key, self.dikt.get(key))
+                                  for key in ["job_metric", "api", "percentile", "bucket_sec"]
+                                  if key in self.dikt])))
 
         raise ValueError("can't determine metric_id from {}".format(self.dikt))
 
@@ -129,6 +253,9 @@ class FigureCfg(object):
             y1range: (min, max),
             y2range: (min, max),
 
+            reduce: "minmax"|"lttb"|"mean", (see downsample.py, default none)
+            max_points: <int>, (per metric after reduction, default 2000)
+
             metrics: [
                 <MetricCfg>,
                 ...
@@ -147,6 +274,9 @@ class FigureCfg(object):
         self.mcfgs = []
         for mcfg in metrics:
             self.mcfgs.append(MetricCfg(dikt=mcfg))
+        reduce = self.get('reduce', None)
+        if reduce is not None and reduce not in downsample.METHODS:
+            raise ValueError("unsupported \"reduce\": {}".format(reduce))
 
     def metric_configs(self):
         return self.mcfgs
@@ -196,14 +326,13 @@ def get_ts(*, dt, tm, tz):
 
 
 def put_points(*, node , metric_id, points, q):
-    max_points = 100 # XXXrs magic
-    start = 0
-    while True:
-        sendpoints = points[start:start+max_points]
-        if not sendpoints:
-            break
-        q.put({'node':node, 'metric_id':metric_id, 'points':sendpoints})
-        start += max_points
+    """
+    Send a file's points for a node/metric as a single pair of arrays.
+    """
+    ts, val = to_columns(points)
+    if not len(ts):
+        return
+    q.put({'node':node, 'metric_id':metric_id, 'ts':ts, 'val':val})
 
 
 def put_done(*, q):
@@ -215,18 +344,76 @@ def load_system_stats_file(*, je, path, metrics_data, node, q):
     Extract relevant data from a Xcalar system stats file.
     """
 
-    with json_lines.open(path) as f:
-        for dikt in f:
-            for metric_id in metrics_data.ids_for_source(source="_SYSTEM_STATS"):
-                mcfg = metrics_data.cfg_for_id(metric_id=metric_id).dikt
-                if 'xy_expr' in mcfg:
-                    points = je.extract_xy(xy_expr=mcfg.get('xy_expr'), dikt=dikt)
-                elif 'key_expr' in mcfg and 'val_expr' in mcfg:
-                    points = je.extract_kv(key_expr=mcfg.get('key_expr'),
-                                           val_expr=mcfg.get('val_expr'), dikt=dikt)
-                else:
-                    raise ValueError("invalid metric config: {}".format(mcfg))
-                put_points(node=node, metric_id=metric_id, points=points, q=q)
+    metric_ids = metrics_data.ids_for_source(source="_SYSTEM_STATS")
+    plan = je.plan(metric_cfgs={metric_id: metrics_data.cfg_for_id(metric_id=metric_id).dikt
+                                for metric_id in metric_ids})
+    id_to_points = {metric_id: [] for metric_id in metric_ids}
+    for dikt in iter_json_lines(path=path):
+        for metric_id, func in plan:
+            points = func(dikt)
+            if points:
+                id_to_points[metric_id].extend(points)
+
+    for metric_id, points in id_to_points.items():
+        put_points(node=node, metric_id=metric_id, points=points, q=q)
+
+
+def load_job_stats_file(*, je, path, metrics_data, nodes, q):
+    """
+    Extract relevant data from a Xcalar job stats file.
+
+    "job_metric" metrics are sent as this file's partial results,
+    merged by finalize_job_stats() once all files are loaded.
+    Expressions are evaluated over each query's stats, as cluster-wide data.
+    """
+    metric_ids = metrics_data.ids_for_source(source="_JOB_STATS")
+    id_to_cfg = {metric_id: metrics_data.cfg_for_id(metric_id=metric_id).dikt
+                 for metric_id in metric_ids}
+    job_ids = [mid for mid, mcfg in id_to_cfg.items() if 'job_metric' in mcfg]
+    plan = je.plan(metric_cfgs={mid: mcfg for mid, mcfg in id_to_cfg.items()
+                                if 'job_metric' not in mcfg})
+
+    try:
+        dikts = list(iter_json_lines(path=path))
+    except ValueError:
+        # Not JSON Lines, a single (multi-line) document instead.
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as fp:
+            doc = json_loads(fp.read())
+        dikts = doc if isinstance(doc, list) else [doc]
+    id_to_points = {metric_id: [] for metric_id, func in plan}
+    for dikt in dikts:
+        for metric_id, func in plan:
+            points = func(dikt)
+            if points:
+                id_to_points[metric_id].extend(points)
+    for metric_id, points in id_to_points.items():
+        put_points(node=CLUSTER_NODE, metric_id=metric_id, points=points, q=q)
+
+    if not job_ids:
+        return
+    queries = [jobstats.JobQuery(dikt=dikt) for dikt in dikts if isinstance(dikt, dict)]
+    for metric_id in job_ids:
+        node_to_points = jobstats.partial_points(queries=queries,
+                                                 params=id_to_cfg[metric_id],
+                                                 nodes=nodes)
+        for node, points in node_to_points.items():
+            put_points(node=node, metric_id=metric_id, points=points, q=q)
+
+
+def finalize_job_stats(*, metrics_data):
+    """
+    Merge the per-file partial results of all "job_metric" metrics.
+    """
+    for metric_id in metrics_data.ids_for_source(source="_JOB_STATS"):
+        params = metrics_data.cfg_for_id(metric_id=metric_id).dikt
+        if 'job_metric' not in params:
+            continue
+        node_to_columns = {node: metrics_data.get_points(node=node, metric_id=metric_id)
+                           for node in metrics_data.nodes_for_id(metric_id=metric_id)}
+        metrics_data.replace_metric(metric_id=metric_id,
+                                    node_to_columns=jobstats.finalize(params=params,
+                                                                      node_to_columns=node_to_columns))
 
 
 def load_csv_file(*, metric_id, path, start_ts, end_ts, nodes, q):
@@ -280,7 +467,12 @@ def file_loader(*, load_args, metrics_data, q):
             continue
 
         if source == "_JOB_STATS":
-            raise Exception('_JOB_STATS not supported')
+            load_job_stats_file(je=je,
+                                metrics_data=metrics_data,
+                                path=args['path'],
+                                nodes=args['nodes'],
+                                q=q)
+            continue
 
         # Anything else is a csv file
         load_csv_file(metric_id=args['metric_id'],
@@ -302,8 +494,8 @@ def get_points(*, metrics_data, p, q):
     reads extracted points data from the "parent" end of the queue
     until a "done" message is received.
 
-    Points data are added to the master MetricsData instance via
-    the thread-safe add_points() method.
+    Points data (timestamp/value arrays) are added to the master
+    MetricsData instance via the thread-safe add_columns() method.
 
     When "done", is received (or if the queue times out) join the
     file loader process and return.
@@ -313,9 +505,10 @@ def get_points(*, metrics_data, p, q):
             item = q.get(True, 600) # XXXrs ad-hoc 10min timeout
             if "done" in item:
                 break
-            metrics_data.add_points(node=item['node'],
-                                    metric_id=item['metric_id'],
-                                    points=item['points'])
+            metrics_data.add_columns(node=item['node'],
+                                     metric_id=item['metric_id'],
+                                     ts=item['ts'],
+                                     val=item['val'])
         except queue.Empty:
             break
     p.join()
@@ -340,6 +533,18 @@ def system_stats_load_args(*, dsh, start_ts, end_ts, nodes):
     return args
 
 
+def job_stats_load_args(*, dsh, start_ts, end_ts, nodes):
+    """
+    Return an array of argument structures which define the job stats
+    files that need to be loaded, and the arguments required to
+    extract the appropriate data.
+    """
+
+    paths = XcalarStatsFileFinder(dsh=dsh).job_stats_files(start_ts=start_ts,
+                                                           end_ts=end_ts)
+    return [{'source': '_JOB_STATS', 'path': path, 'nodes': nodes} for path in sorted(paths)]
+
+
 def csv_load_args(*, metric_id, path, start_ts, end_ts, nodes):
     """
     Return an array of argument structures which define the csv
@@ -369,14 +574,29 @@ def csv_load_args(*, metric_id, path, start_ts, end_ts, nodes):
     return args
 
 
+FORMATS = ['pdf', 'png', 'svg']
+
 def plot(*, fig_groups, dsh, plotdir,
             start_ts, end_ts, tz, nodes=None,
-            csv_name_to_path):
+            csv_name_to_path, fmt='pdf', workers=None):
+    """
+    Plot all figure groups for all nodes.
+
+    Each (figure group, node) is rendered in its own process (up to
+    workers, default one per core) as a single pdf file, or as one
+    png/svg file per figure.
+
+    Returns a dictionary of per-stage elapsed seconds and
+    the list of files written.
+    """
+    if fmt not in FORMATS:
+        raise ValueError("unsupported format: {}".format(fmt))
 
     # Scan the configuration files to determine the specific metrics required
     # to satisfy the needs of all the figures in all the figure groups and
     # "register" the required metrics with the MetricsData instance.
 
+    stage_start = time.time()
     metrics_data = MetricsData()
     for fg_cfg in fig_groups:
         for fcfg in fg_cfg.figures():
@@ -394,6 +614,13 @@ def plot(*, fig_groups, dsh, plotdir,
                                                     start_ts=start_ts,
                                                     end_ts=end_ts,
                                                     nodes=nodes))
+        elif source == "_JOB_STATS":
+            if not dsh:
+                raise ValueError("--dsh required to plot job stats")
+            load_args.extend(job_stats_load_args(dsh=dsh,
+                                                 start_ts=start_ts,
+                                                 end_ts=end_ts,
+                                                 nodes=nodes))
         elif "csv:" in source:
             foo,name = source.split(':')
             path = csv_name_to_path.get(name, None)
@@ -411,6 +638,11 @@ def plot(*, fig_groups, dsh, plotdir,
     # load_args now contains an entry for each file that needs to be loaded.
     # Divvy up the work across all our cores.
 
+    scan_s = time.time()-stage_start
+    logger.info("stage scan: {} files in {:.1f}s".format(len(load_args), scan_s))
+    stage_start = time.time()
+    all_load_args = load_args
+
     max_procs = psutil.cpu_count() # one process per core max
     buckets = [[] for i in range(max_procs)]
     for idx,args in enumerate(load_args):
@@ -423,15 +655,15 @@ def plot(*, fig_groups, dsh, plotdir,
     # (Apparently, this is a known limitation when mixing threads/processes.)
 
     processes = []
-    for idx,load_args in enumerate(buckets):
-        if not len(load_args):
+    for idx,bucket in enumerate(buckets):
+        if not len(bucket):
             continue
-        logger.info("file_loader {} processing {} logs".format(idx, len(load_args)))
-        logger.debug("load_args: {}".format(pprint.pformat(load_args)))
+        logger.info("file_loader {} processing {} logs".format(idx, len(bucket)))
+        logger.debug("load_args: {}".format(pprint.pformat(bucket)))
         q = multiprocessing.Queue()
         p = multiprocessing.Process(target=file_loader,
                                     kwargs={"metrics_data":metrics_data,
-                                            "load_args":load_args,
+                                            "load_args":bucket,
                                             "q":q})
         p.daemon = True # Hygenic!
         p.start()
@@ -453,87 +685,139 @@ def plot(*, fig_groups, dsh, plotdir,
 
     # All the data are now loaded into the MetricsData instance.
     # Proceed with the plotting...
+    finalize_job_stats(metrics_data=metrics_data)
+    load_s = time.time()-stage_start
+    logger.info("stage load: {} files in {:.1f}s".format(len(all_load_args), load_s))
 
-    now_x10 = time.time()*10
+    stage_start = time.time()
     os.makedirs(plotdir, exist_ok=True)
+
+    # One rendering task per (figure group, node), each given only the
+    # (windowed) series its figures need.
+    tasks = []
     for fg_cfg in fig_groups:
-        fg_name = fg_cfg.get('name', 'Unknown')
         for node in sorted(metrics_data.all_nodes()):
-            outpath = os.path.join(plotdir, "{}_node{}.pdf".format(fg_name, node))
-
-            # XXXrs - FUTURE do each pdf page in a separate process?
-
-            with PdfPages(outpath) as pdf:
-                logger.info("plotting: {}".format(outpath))
-
-                for fcfg in fg_cfg.figures():
-
-                    fig,ax1 = plt.subplots(figsize=fcfg.get('figsize', (8.5, 5)))
-                    ax1.set_xlabel(fcfg.get('xlabel', 'time (s)'))
-                    ax1.set_title(fcfg.get('title', ''))
-                    ax2 = None
-
-
-                    y1color = fcfg.get('y1color', 'black')
-                    ax1.set_ylabel(fcfg.get('y1label', ''), color=y1color)
-                    y1range = fcfg.get('y1range', None)
-                    if y1range:
-                        ax1.axis(ymin=y1range[0], ymax=y1range[1])
-                    ax1.tick_params(axis='y', labelcolor=y1color)
-
-                    y2label = fcfg.get('y2label', None)
-                    if y2label is not None:
-                        ax2 = ax1.twinx()  # instantiate a second axes that shares the same x-axis
-                        y2color = fcfg.get('y2color', 'black')
-                        ax2.set_ylabel(y2label, color=y2color)
-                        y2range = fcfg.get('y2range', None)
-                        if y2range:
-                            ax2.axis(ymin=y2range[0], ymax=y2range[1])
-                        ax2.tick_params(axis='y', labelcolor=y2color)
-
-                    for mcfg in fcfg.metric_configs():
-                        metric_id = mcfg.metric_id()
-                        points = metrics_data.get_points(node=node, metric_id=metric_id)
-                        if not points:
-                            continue
-                        if mcfg.dikt.get('swapxy', False):
-                            points = [(y,x) for (x,y) in points]
-
-                        # ASS-U-ME: the x-axis is timestamps
-                        plot_points = []
-                        for pt in points:
-                            # Best effort rescale timestamp to seconds
-                            # if (presumably) in ms or us
-                            ts = pt[0]
-                            if ts > now_x10:
-                                ts = ts/1000
-                            if ts > now_x10:
-                                ts = ts/1000
-
-                            # Exclude points outside our time range
-                            if ts < start_ts or ts > end_ts:
-                                continue
-
-                            plot_points.append((ts, pt[1]))
-
-                        plot_points.sort()
-
-                        xes = [datetime.datetime.fromtimestamp(pt[0], tz=tz) for pt in plot_points]
-                        yes = [pt[1] for pt in plot_points]
-
-                        label = mcfg.dikt.get('label', 'Unknown')
-                        if mcfg.dikt.get('ploty2', False):
-                            color = mcfg.dikt.get('color', y2color)
-                            ax2.plot(xes, yes, color=color, label=label)
-                        else:
-                            color = mcfg.dikt.get('color', y1color)
-                            ax1.plot(xes, yes, color=color, label=label)
-
-                    fig.autofmt_xdate()
-                    fig.legend(loc="lower left")
-                    if y2label is not None:
-                        fig.tight_layout()  # otherwise the right y-label is slightly clipped
-                    pdf.savefig(fig)
+            series = {}
+            for fcfg in fg_cfg.figures():
+                for mcfg in fcfg.metric_configs():
+                    key = (mcfg.metric_id(), mcfg.dikt.get('swapxy', False))
+                    if key in series:
+                        continue
+                    series[key] = metrics_data.window(node=node, metric_id=key[0],
+                                                      start_ts=start_ts, end_ts=end_ts,
+                                                      swapxy=key[1])
+            tasks.append({'fg_cfg': fg_cfg, 'node': node, 'series': series,
+                          'plotdir': plotdir, 'fmt': fmt, 'tz': tz})
+    window_s = time.time()-stage_start
+    logger.info("stage window: {} tasks in {:.1f}s".format(len(tasks), window_s))
+
+    stage_start = time.time()
+    if workers is None:
+        workers = psutil.cpu_count()
+    workers = max(1, min(workers, len(tasks)))
+    outpaths = []
+    if workers == 1:
+        for task in tasks:
+            outpaths.extend(render_group_node(**task))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(render_group_node, **task) for task in tasks]
+            for future in futures:
+                # Any exception is re-raised here.
+                outpaths.extend(future.result())
+    render_s = time.time()-stage_start
+    logger.info("stage render: {} files, {} workers in {:.1f}s"
+                .format(len(outpaths), workers, render_s))
+    return {'scan_s': scan_s, 'load_s': load_s, 'window_s': window_s, 'render_s': render_s,
+            'outpaths': outpaths}
+
+
+def render_figure(*, fcfg, series, tz):
+    """
+    Render one figure from the series (see render_group_node()).
+    Returns the matplotlib figure.
+    """
+    fig,ax1 = plt.subplots(figsize=fcfg.get('figsize', (8.5, 5)))
+    # x values are plotted as date numbers, shown in our time zone
+    ax1.xaxis_date(tz=tz)
+    ax1.set_xlabel(fcfg.get('xlabel', 'time (s)'))
+    ax1.set_title(fcfg.get('title', ''))
+    ax2 = None
+
+
+    y1color = fcfg.get('y1color', 'black')
+    ax1.set_ylabel(fcfg.get('y1label', ''), color=y1color)
+    y1range = fcfg.get('y1range', None)
+    if y1range:
+        ax1.axis(ymin=y1range[0], ymax=y1range[1])
+    ax1.tick_params(axis='y', labelcolor=y1color)
+
+    y2label = fcfg.get('y2label', None)
+    if y2label is not None:
+        ax2 = ax1.twinx()  # instantiate a second axes that shares the same x-axis
+        y2color = fcfg.get('y2color', 'black')
+        ax2.set_ylabel(y2label, color=y2color)
+        y2range = fcfg.get('y2range', None)
+        if y2range:
+            ax2.axis(ymin=y2range[0], ymax=y2range[1])
+        ax2.tick_params(axis='y', labelcolor=y2color)
+
+    for mcfg in fcfg.metric_configs():
+        points = series.get((mcfg.metric_id(), mcfg.dikt.get('swapxy', False)), None)
+        if points is None:
+            continue
+        xs, yes = downsample.reduce_points(xs=points[0], ys=points[1],
+                                           method=fcfg.get('reduce', None),
+                                           max_points=int(fcfg.get('max_points', 2000)))
+
+        xes = mdates.date2num((xs*1e6).astype('datetime64[us]'))
+
+        label = mcfg.dikt.get('label', 'Unknown')
+        if mcfg.dikt.get('ploty2', False):
+            color = mcfg.dikt.get('color', y2color)
+            ax2.plot(xes, yes, color=color, label=label)
+        else:
+            color = mcfg.dikt.get('color', y1color)
+            ax1.plot(xes, yes, color=color, label=label)
+
+    fig.autofmt_xdate()
+    fig.legend(loc="lower left")
+    if y2label is not None:
+        fig.tight_layout()  # otherwise the right y-label is slightly clipped
+    return fig
+
+
+def render_group_node(*, fg_cfg, node, series, plotdir, fmt, tz):
+    """
+    May run in a worker process.
+
+    Render all figures of a figure group for a node, either as pages
+    of a single pdf file or as one png/svg file per figure.
+    series is a dictionary of (metric_id, swapxy): (x, y) arrays
+    (as returned by MetricsData.window()).
+
+    Returns the list of files written.
+    """
+    fg_name = fg_cfg.get('name', 'Unknown')
+    if fmt == 'pdf':
+        outpath = os.path.join(plotdir, "{}_node{}.pdf".format(fg_name, node))
+        with PdfPages(outpath) as pdf:
+            logger.info("plotting: {}".format(outpath))
+            for fcfg in fg_cfg.figures():
+                fig = render_figure(fcfg=fcfg, series=series, tz=tz)
+                pdf.savefig(fig)
+                plt.close(fig)
+        return [outpath]
+
+    outpaths = []
+    for idx, fcfg in enumerate(fg_cfg.figures()):
+        outpath = os.path.join(plotdir, "{}_node{}_{:02d}.{}".format(fg_name, node, idx, fmt))
+        logger.info("plotting: {}".format(outpath))
+        fig = render_figure(fcfg=fcfg, series=series, tz=tz)
+        fig.savefig(outpath, format=fmt)
+        plt.close(fig)
+        outpaths.append(outpath)
+    return outpaths
 
 
 if __name__ == "__main__":
@@ -576,6 +860,12 @@ if __name__ == "__main__":
     argParser.add_argument('--csv', default=None, type=str, action="append",
                                 help='identify a csv file for plotting --csv=<name>:<path>')
 
+    argParser.add_argument('--format', default='pdf', choices=FORMATS, dest='fmt',
+                                help='pdf (one file per figure group and node)'
+                                     ' or png/svg (one file per figure)')
+    argParser.add_argument('--workers', default=None, type=int,
+                                help='number of rendering processes (default one per core)')
+
     args = argParser.parse_args()
 
     if args.dsh and not os.path.exists(args.dsh):
@@ -626,4 +916,4 @@ if __name__ == "__main__":
 
     plot(fig_groups=fig_groups, dsh=args.dsh, plotdir=args.plotdir,
          start_ts=start_ts, end_ts=end_ts, tz=tz, nodes=args.node,
-         csv_name_to_path=csv_name_to_path)
+         csv_name_to_path=csv_name_to_path, fmt=args.fmt, workers=args.workers)
@@ -29,6 +29,7 @@ from py_common.jenkins_aggregators import JenkinsPostprocessorBase
 from py_common.jenkins_aggregators import JenkinsJobDataCollection
 from py_common.jenkins_aggregators import JenkinsJobMetaCollection
 from py_common.jenkins_aggregators import JenkinsAllJobIndex
+from py_common.jenkins_aggregators.windowed_stats import BuildWindows
 from py_common.mongo import MongoDB, JenkinsMongoDB
 from py_common.sorts import nat_sort
 
@@ -592,6 +593,32 @@ class UbmPerfPostprocessor(JenkinsPostprocessorBase):
     #     max (max value over build_cnt runs)
     #     min_max_delta_pct (percent by which max is greater than min)
     #
+    # Return dict of ubm: mean duration over the runs in the given
+    # (successful) build of this job, or None if the build doesn't qualify
+    def _ubm_build_means(self, *, test_group, bld):
+        b_job_name = bld.get('job_name', None)
+        if not b_job_name or b_job_name != self.job_name:
+            return None
+        bnum = bld.get('build_number')
+        job_result = self.ubm_perf_results_data.job_result(bnum=bnum)
+        if not job_result or job_result != 'SUCCESS':
+            return None
+        ubm_results = self.ubm_perf_results_data\
+            .results(test_group=test_group, bnum=bnum)
+        ubm_vals = ubm_results.get('ubm_vals', {})
+        return {ubm: statistics.mean(ubm_vals[ubm]) for ubm in ubm_vals}
+
+    # Return the per-ubm stats dict (see _ubm_stats) for a ubm's list of
+    # per-build mean durations
+    def _ubm_summary(self, *, count, mean, stdev, ubm_min, ubm_max):
+        rtn = {'build_cnt': count, 'avg_s': mean}
+        if stdev is not None:
+            rtn['cv_pct'] = self.get_cv(stdev, mean)
+        rtn['min'] = ubm_min
+        rtn['max'] = ubm_max
+        rtn['min_max_delta_pct'] = self.get_delta(ubm_min, ubm_max)
+        return rtn
+
     def _ubm_stats(self, *, test_group, builds):
         self.logger.info("start")
         rtn = {}
@@ -602,38 +629,24 @@ class UbmPerfPostprocessor(JenkinsPostprocessorBase):
         # each element in the list corresponds to runs in a single build
         ubm_val_list = {}
         for bld in builds:
-            b_job_name = bld.get('job_name', None)
-            if not b_job_name or b_job_name != self.job_name:
-                continue
-            bnum = bld.get('build_number')
-            job_result = self.ubm_perf_results_data.job_result(bnum=bnum)
-            if not job_result or job_result != 'SUCCESS':
+            ubm_means = self._ubm_build_means(test_group=test_group, bld=bld)
+            if not ubm_means:
                 continue
-            ubm_vals = {}
-            ubm_results = {}
-            ubm_results = self.ubm_perf_results_data\
-                .results(test_group=test_group, bnum=bnum)
-            ubm_vals = ubm_results.get('ubm_vals', {})
-            for ubm in ubm_vals:
-                ubm_mean = statistics.mean(ubm_vals[ubm])
+            for ubm, ubm_mean in ubm_means.items():
                 ubm_val_list.setdefault(ubm, []).append(ubm_mean)
         # second, for each ubm, generate the count, mean, stdev stats across
         # all its elements (builds) in ubm_val_list and store in the rtn dict
         for ubm in ubm_val_list:
             self.logger.debug("ubm {} val_list {}".format(ubm,
                                                           ubm_val_list[ubm]))
-            rtn.setdefault(ubm, {})['build_cnt'] = len(ubm_val_list[ubm])
-            mean = statistics.mean(ubm_val_list[ubm])
-            rtn.setdefault(ubm, {})['avg_s'] = mean
+            stdev = None
             if len(ubm_val_list[ubm]) > 1:
                 stdev = statistics.stdev(ubm_val_list[ubm])
-                rtn.setdefault(ubm, {})['cv_pct'] = self.get_cv(stdev, mean)
-            ubm_min = min(ubm_val_list[ubm])
-            ubm_max = max(ubm_val_list[ubm])
-            rtn.setdefault(ubm, {})['min'] = ubm_min
-            rtn.setdefault(ubm, {})['max'] = ubm_max
-            rtn.setdefault(ubm, {})['min_max_delta_pct'] =\
-                self.get_delta(ubm_min, ubm_max)
+            rtn[ubm] = self._ubm_summary(count=len(ubm_val_list[ubm]),
+                                         mean=statistics.mean(ubm_val_list[ubm]),
+                                         stdev=stdev,
+                                         ubm_min=min(ubm_val_list[ubm]),
+                                         ubm_max=max(ubm_val_list[ubm]))
         return rtn
 
     def has_regressed(self, *, ubm, new_mean, old_mean, old_sdev):
@@ -745,9 +758,12 @@ class UbmPerfPostprocessor(JenkinsPostprocessorBase):
             # a creeping regression over time.
             #
             # Details:
-            # Use self.alljob.builds_by_time() to get all builds within
-            # a time period, and then invoke _ubm_stats() on the builds list
-            # to get a ubm's stats (build_cnt, avg, stdev) over these builds
+            # Use BuildWindows to get all builds spanning the time periods
+            # with a single query, and then summarize each ubm's per-build
+            # mean durations over each period to get a ubm's stats
+            # (build_cnt, avg, stdev) over the period's builds.  Per-build
+            # results are only looked up once, however many periods
+            # include the build.
 
             ubm_all_period_stats = {}  # ubm all period (ap) stats dict
             try:
@@ -793,19 +809,28 @@ class UbmPerfPostprocessor(JenkinsPostprocessorBase):
                 #  ...
                 # }
 
+                windows = BuildWindows.fetch(alljob=self.alljob,
+                                             job_name=self.job_name,
+                                             periods=periods)
+                period_stats = windows.value_stats(
+                    values=lambda bld: self._ubm_build_means(test_group=tg,
+                                                             bld=bld))
                 for period in periods:
                     self.logger.debug("period: {}".format(period))
-                    builds = self.alljob.builds_by_time(
-                        start_time_ms=period['start'],
-                        end_time_ms=period['end'])
-                    blist = builds.get('builds', None)
-                    ubm_stats = self._ubm_stats(test_group=tg, builds=blist)
-                    self.logger.debug("ubm_stats: {}".format(ubm_stats))
-                    for ubm in ubm_stats:
-                        for stat in ubm_stats[ubm]:
+                    for ubm in period_stats:
+                        vstats = period_stats[ubm].get(period['label'])
+                        if not vstats:
+                            continue
+                        ubm_stats = self._ubm_summary(count=vstats['count'],
+                                                      mean=vstats['mean'],
+                                                      stdev=vstats.get('stdev'),
+                                                      ubm_min=vstats['min'],
+                                                      ubm_max=vstats['max'])
+                        self.logger.debug("{} ubm_stats: {}".format(ubm, ubm_stats))
+                        for stat in ubm_stats:
                             ubm_all_period_stats.setdefault(ubm, {}).\
                                 setdefault(stat, {})[period['label']] =\
-                                ubm_stats[ubm][stat]
+                                ubm_stats[stat]
 
                 # now compute regression vs a N run group that's 60d old using
                 # the ubm_all_period_stats{} dict to get this window